@@ -0,0 +1,89 @@
+"""
+Cache engine benchmark: lookup cost and memory at 100k+ entries.
+
+Usage:
+    python -m benchmarks.cache [--entries 200000] [--lookups 1000000]
+
+Fills a plain dict of (value, timestamp) tuples (the old src/cache.py layout)
+and a TTLCache with the same entries, then times random lookups against both
+and prints traced memory. A second run keeps writing 5x more keys than a
+bounded TTLCache may hold, to show memory staying flat under eviction.
+"""
+import time
+import random
+import argparse
+import tracemalloc
+
+from src.ttlcache import TTLCache
+
+TTL = 300
+
+class _Entity:
+    # Stand-in for a Telethon User/Chat: a small slotted object
+    __slots__ = ("id", "first_name")
+
+    def __init__(self, entity_id: int):
+        self.id = entity_id
+        self.first_name = f"user{entity_id}"
+
+def _traced(build):
+    tracemalloc.start()
+    store = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, current
+
+def _dict_get(store: dict, key: int):
+    if key in store:
+        data, timestamp = store[key]
+        if time.time() - timestamp < TTL:
+            return data
+    return None
+
+def _time_lookups(get, keys: list) -> float:
+    started = time.perf_counter()
+    for key in keys:
+        get(key)
+    return (time.perf_counter() - started) / len(keys) * 1e9
+
+def main(entries: int, lookups: int):
+    values = [_Entity(i) for i in range(entries)]
+    keys = [random.randrange(entries) for _ in range(lookups)]
+
+    def build_dict():
+        now = time.time()
+        return {i: (values[i], now) for i in range(entries)}
+
+    def build_cache():
+        cache = TTLCache("bench", ttl=TTL, max_entries=entries)
+        for i in range(entries):
+            cache.set(i, values[i])
+        return cache
+
+    plain, plain_mem = _traced(build_dict)
+    cache, cache_mem = _traced(build_cache)
+
+    plain_ns = _time_lookups(lambda k: _dict_get(plain, k), keys)
+    cache_ns = _time_lookups(cache.get, keys)
+
+    print(f"entries={entries:,} lookups={lookups:,}")
+    print(f"dict of tuples:   {plain_ns:6.0f} ns/lookup  memory={plain_mem / 1e6:7.2f} MB (excluding values)")
+    print(f"TTLCache:         {cache_ns:6.0f} ns/lookup  memory={cache_mem / 1e6:7.2f} MB (excluding values)")
+
+    bounded = TTLCache("bounded", ttl=TTL, max_entries=entries // 5)
+    tracemalloc.start()
+    report_every = entries
+    for i in range(entries * 5):
+        bounded.set(i, i)
+        if (i + 1) % report_every == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"bounded, {i + 1:>10,} writes  entries={len(bounded):>8,}  memory={current / 1e6:7.2f} MB")
+    tracemalloc.stop()
+    print(f"bounded stats: {bounded.stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=1_000_000)
+    args = parser.parse_args()
+    main(args.entries, args.lookups)
@@ -0,0 +1,122 @@
+"""
+get_message_context round trips: window hit, one-request fetch, and the
+old three sequential requests, against a fake client with a fixed RTT.
+
+Usage:
+    python -m benchmarks.context [--messages 5000] [--rtt-ms 50] [--lookups 20]
+
+The fake client holds a chat of `--messages` messages and answers
+GetHistoryRequest with Telegram's offset_id/add_offset/limit semantics, so
+the printed context also checks the slice is right. Exits non-zero if a
+lookup needs more requests than expected (0 from a window, 1 otherwise).
+tests/test_message_context.py checks get_message_context against the same
+fake client.
+"""
+import sys
+import time
+import asyncio
+import argparse
+import datetime
+from types import SimpleNamespace
+
+from telethon import functions
+from telethon.tl.types import Message, PeerUser, User
+from telethon.utils import get_peer_id
+
+from src import history
+from src.tools import interactions
+
+CHAT = User(id=7, access_hash=1, first_name="Bench")
+DATE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _message(message_id: int) -> Message:
+    return Message(id=message_id, peer_id=PeerUser(CHAT.id), date=DATE, message=f"message {message_id}")
+
+class FakeClient:
+    """
+    A chat of `total` messages (ids 1..total). Answers GetHistoryRequest
+    with Telegram's offset_id/add_offset/limit semantics (at most 100
+    messages per request) after `rtt` seconds, and records every request.
+    """
+
+    def __init__(self, total: int, rtt: float = 0.0):
+        self.total = total
+        self.rtt = rtt
+        self.requests: list = []
+
+    async def get_input_entity(self, entity):
+        return entity
+
+    async def __call__(self, request):
+        assert isinstance(request, functions.messages.GetHistoryRequest)
+        self.requests.append(request)
+        await asyncio.sleep(self.rtt)
+        # Newest first: ids below offset_id, shifted up by a negative add_offset
+        ids = list(range(self.total, 0, -1))
+        start = sum(1 for i in ids if i >= request.offset_id) + request.add_offset
+        start = max(0, start)
+        chosen = ids[start:start + min(request.limit, 100)]
+        return SimpleNamespace(messages=[_message(i) for i in chosen], users=[CHAT], chats=[])
+
+    async def get_messages(self, entity, limit=None, max_id=0, min_id=0, reverse=False, ids=None):
+        # The pre-change path: one request per call
+        self.requests.append(("get_messages", limit, max_id, min_id, reverse, ids))
+        await asyncio.sleep(self.rtt)
+        if ids is not None:
+            return _message(ids)
+        if reverse:
+            return [_message(i) for i in range(min_id + 1, min(min_id + limit, self.total) + 1)]
+        return [_message(i) for i in range(max_id - 1, max(max_id - limit, 0), -1)]
+
+async def _old_context(client: FakeClient, message_id: int, count: int):
+    before = await client.get_messages(CHAT, limit=count, max_id=message_id)
+    after = await client.get_messages(CHAT, limit=count, min_id=message_id, reverse=True)
+    center = await client.get_messages(CHAT, ids=message_id)
+    return before, center, after
+
+async def main(total: int, rtt_ms: float, lookups: int, count: int = 5) -> int:
+    client = FakeClient(total, rtt_ms / 1000)
+    interactions.client = client
+
+    async def entity(_):
+        return CHAT
+    interactions.get_or_fetch_entity = entity
+
+    failures = 0
+    targets = [total // 2 + i * 37 for i in range(lookups)] + [1, total]
+    for label, run, expected in (
+        ("three requests (old)", lambda m: _old_context(client, m, count), 3),
+        ("one request", lambda m: interactions.get_message_context(CHAT.id, m, count), 1),
+    ):
+        client.requests = []
+        started = time.perf_counter()
+        for message_id in targets:
+            before = len(client.requests)
+            await run(message_id)
+            if len(client.requests) - before != expected:
+                failures += 1
+        elapsed = (time.perf_counter() - started) / len(targets) * 1000
+        print(f"{label:<22} {len(client.requests) / len(targets):.1f} requests/lookup  {elapsed:6.1f} ms/lookup")
+
+    text = await interactions.get_message_context(CHAT.id, total // 2, 2)
+    print(text)
+    expected = [total // 2 + d for d in (-2, -1, 0, 1, 2)]
+    if [int(line.split("]")[0].split("[")[1]) for line in text.splitlines()] != expected:
+        print("wrong context slice")
+        failures += 1
+
+    # A window holding the newest messages answers without any request
+    history.get_message_windows().add_newest(get_peer_id(CHAT), [_message(i) for i in range(total, total - 50, -1)], reached_start=False)
+    client.requests = []
+    await interactions.get_message_context(CHAT.id, total - 20, count)
+    print(f"{'window hit':<22} {len(client.requests):.1f} requests/lookup")
+    failures += len(client.requests) != 0
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    parser.add_argument("--lookups", type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(main(args.messages, args.rtt_ms, args.lookups)) else 0)
@@ -0,0 +1,49 @@
+"""
+Duplicate-suppression benchmark: memory and throughput over millions of ids.
+
+Usage:
+    python -m benchmarks.dedupe [--messages 5000000] [--capacity 200000]
+
+Feeds unique (chat_id, message_id) pairs through MessageDeduper, replaying a
+slice of recent ids as duplicates, and prints traced memory after every
+million messages. Memory should stay flat once the capacity is reached.
+"""
+import time
+import random
+import argparse
+import tracemalloc
+
+from src.dedupe import MessageDeduper
+
+def main(messages: int, capacity: int, chats: int):
+    deduper = MessageDeduper(capacity=capacity)
+    tracemalloc.start()
+    report_every = 1_000_000
+
+    started = time.perf_counter()
+    duplicates_sent = 0
+    for i in range(1, messages + 1):
+        chat_id = 1_000_000_000 + (i % chats)
+        deduper.seen(chat_id, i)
+        if i % 100 == 0:
+            # Redeliver a recent message, as a reconnect catch-up would
+            j = i - random.randint(1, 50)
+            deduper.seen(1_000_000_000 + (j % chats), j)
+            duplicates_sent += 1
+        if i % report_every == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"{i:>10,} messages  entries={len(deduper):>8,}  memory={current / 1e6:7.2f} MB  peak={peak / 1e6:7.2f} MB")
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+
+    stats = deduper.stats()
+    print(f"throughput: {(messages + duplicates_sent) / elapsed:,.0f} checks/s (traced)")
+    print(f"duplicates sent={duplicates_sent:,} suppressed={stats['duplicates']:,} rotations={stats['rotations']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    parser.add_argument("--capacity", type=int, default=200_000)
+    parser.add_argument("--chats", type=int, default=500)
+    args = parser.parse_args()
+    main(args.messages, args.capacity, args.chats)
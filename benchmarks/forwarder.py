@@ -0,0 +1,211 @@
+"""
+Local forwarder benchmark against a stand-in webhook.
+
+Usage:
+    python -m benchmarks.forwarder [--messages 2000] [--concurrency 20] [--delay-ms 0]
+
+Starts a minimal keep-alive HTTP/1.1 server on 127.0.0.1 that accepts any POST
+and measures messages/sec for the old per-message httpx.AsyncClient pattern
+versus the shared pooled client used by src/forwarder.py, then pushes the same
+stream through the delivery queue in single-POST and micro-batch mode, and
+fans it out to two fast destinations plus one slow one.
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import logging
+
+import httpx
+
+os.environ.setdefault("POKE_API_KEY", "benchmark")
+
+_RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 2\r\n"
+    b"Connection: keep-alive\r\n\r\n{}"
+)
+_ERROR_RESPONSE = (
+    b"HTTP/1.1 500 Internal Server Error\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 2\r\n"
+    b"Connection: keep-alive\r\n\r\n{}"
+)
+
+class StandInWebhook:
+    """
+    Tiny asyncio HTTP server that answers every request with 200 {},
+    or with a 500 for a `fail_rate` fraction of requests.
+    """
+
+    def __init__(self, delay: float = 0.0, fail_rate: float = 0.0):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if self.fail_rate and random.random() < self.fail_rate:
+                    self.failures += 1
+                    writer.write(_ERROR_RESPONSE)
+                else:
+                    writer.write(_RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/webhook"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+def _payload(i: int) -> dict:
+    return {
+        "message": f"📩 [TELEGRAM MESSAGE]\nFrom: Bench\nChat: Bench (ID: 1)\nType: GROUP\n\nmessage {i}",
+        "sender": "Bench",
+        "chat_id": 1,
+        "chat_title": "Bench",
+        "chat_type": "group",
+        "timestamp": "",
+        "message_id": i
+    }
+
+async def _per_message_client(url: str, data: dict):
+    # The pre-pooling behaviour: a fresh client (and connection) per message.
+    async with httpx.AsyncClient() as http_client:
+        await http_client.post(url, json=data, headers={"Authorization": "Bearer benchmark"}, timeout=5.0)
+
+async def _run(send, messages: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await send(_payload(i))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(messages)))
+    return messages / (time.perf_counter() - started)
+
+async def _run_queue(forwarder, messages: int, batch: bool) -> float:
+    queue = forwarder.DeliveryQueue(
+        "bench",
+        forwarder.forward_to_poke,
+        maxsize=messages,
+        workers=forwarder.QUEUE_WORKERS,
+        key=lambda data: data.get("chat_id"),
+        deliver_batch=forwarder.forward_batch_to_poke if batch else None,
+        batch_size=forwarder.BATCH_MAX_SIZE,
+        batch_linger=forwarder.BATCH_LINGER_MS / 1000
+    )
+    await queue.start()
+    started = time.perf_counter()
+    for i in range(messages):
+        data = _payload(i)
+        data["chat_id"] = i % 16
+        await queue.put(data)
+    await queue.stop(timeout=120)
+    return messages / (time.perf_counter() - started)
+
+async def _run_fanout(forwarder, fast_urls: list, slow_url: str, messages: int) -> dict:
+    destinations = [
+        forwarder.Destination(name, url, guard=forwarder._make_guard(name, {}), get_client=forwarder.open_http_client)
+        for name, url in [(f"fast-{i}", u) for i, u in enumerate(fast_urls)] + [("slow", slow_url)]
+    ]
+    queue_options = {"maxsize": messages, "workers": forwarder.QUEUE_WORKERS}
+    for destination in destinations:
+        await destination.start(queue_options, {})
+
+    started = time.perf_counter()
+    for i in range(messages):
+        data = _payload(i)
+        data["chat_id"] = i % 16
+        await forwarder.enqueue_forward(data, destinations)
+
+    # Time until every fast destination has everything, while the slow one lags
+    fast = destinations[:-1]
+    while any(d.queue.counters["delivered"] < messages for d in fast):
+        await asyncio.sleep(0.005)
+    fast_elapsed = time.perf_counter() - started
+    slow_delivered = int(destinations[-1].queue.counters["delivered"])
+
+    for destination in destinations:
+        await destination.stop(timeout=0)
+    return {"fast_rate": messages / fast_elapsed, "slow_delivered": slow_delivered}
+
+async def main(messages: int, concurrency: int, delay_ms: float):
+    webhook = StandInWebhook(delay=delay_ms / 1000)
+    url = await webhook.start()
+    os.environ["POKE_WEBHOOK_URL"] = url
+
+    from src import forwarder
+    forwarder.POKE_API_KEY = os.environ["POKE_API_KEY"]
+    forwarder.BATCH_WEBHOOK_URL = url
+
+    try:
+        before = await _run(lambda d: _per_message_client(url, d), messages, concurrency)
+        before_conns = webhook.connections
+
+        await forwarder.open_http_client()
+        after = await _run(forwarder.forward_to_poke, messages, concurrency)
+        after_conns = webhook.connections - before_conns
+
+        requests_before = webhook.requests
+        queued_single = await _run_queue(forwarder, messages, batch=False)
+        single_requests = webhook.requests - requests_before
+
+        requests_before = webhook.requests
+        queued_batch = await _run_queue(forwarder, messages, batch=True)
+        batch_requests = webhook.requests - requests_before
+
+        fast_hooks = [StandInWebhook(delay=delay_ms / 1000) for _ in range(2)]
+        slow_hook = StandInWebhook(delay=0.2)
+        fast_urls = [await hook.start() for hook in fast_hooks]
+        slow_url = await slow_hook.start()
+        fanout = await _run_fanout(forwarder, fast_urls, slow_url, messages)
+        for hook in fast_hooks + [slow_hook]:
+            await hook.stop()
+        await forwarder.close_http_client()
+    finally:
+        await webhook.stop()
+
+    print(f"messages={messages} concurrency={concurrency} webhook_delay={delay_ms}ms")
+    print(f"before (client per message): {before:8.1f} msg/s  connections={before_conns}")
+    print(f"after  (pooled client):      {after:8.1f} msg/s  connections={after_conns}")
+    print(f"speedup: {after / before:.2f}x")
+    print(f"queue, single POST:          {queued_single:8.1f} msg/s  requests={single_requests}")
+    print(f"queue, micro-batch:          {queued_batch:8.1f} msg/s  requests={batch_requests}")
+    print(f"fan-out, 2 fast + 1 slow:    {fanout['fast_rate']:8.1f} msg/s per fast destination  "
+          f"(slow one had {fanout['slow_delivered']} delivered meanwhile)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args.messages, args.concurrency, args.delay_ms))
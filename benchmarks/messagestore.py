@@ -0,0 +1,106 @@
+"""
+search_messages index benchmark: ingest rate and query latency.
+
+Usage:
+    python -m benchmarks.messagestore [--messages 200000] [--queries 100] [--path /tmp/messages-bench.db]
+
+Feeds synthetic messages (a vocabulary with a Zipf-like word distribution,
+over 200 chats) through MessageStore.add() as the event handlers would,
+then times searches: a rare word, two words, a very common word, a prefix,
+and common words filtered by chat and by date. "truncated" counts searches
+with more matches than MESSAGE_INDEX_RANK_WINDOW ranks. The defaults run in
+well under a minute; pass --messages 1000000 for a large account.
+"""
+import os
+import time
+import random
+import itertools
+import asyncio
+import argparse
+import datetime
+
+from telethon.tl.types import Message, PeerChannel
+
+from src.messagestore import MessageStore
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "to", "su", "vi", "de", "po", "an", "el", "or", "us", "ti"]
+
+def _vocabulary(rng: random.Random, size: int = 20_000) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def _messages(count: int, vocabulary: list, rng: random.Random):
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    for i in range(count):
+        text = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(3, 30)))
+        yield Message(
+            id=i + 1,
+            peer_id=PeerChannel(1000 + i % 200),
+            from_id=None,
+            date=START + datetime.timedelta(seconds=i * 30),
+            message=text
+        )
+
+def _time(run, queries: list) -> tuple:
+    started = time.perf_counter()
+    hits = truncated = 0
+    for query in queries:
+        found, more = asyncio.get_event_loop().run_until_complete(run(query))
+        hits += bool(found)
+        truncated += more
+    return (time.perf_counter() - started) / len(queries) * 1000, hits, truncated
+
+async def _ingest(store: MessageStore, count: int, vocabulary: list) -> float:
+    rng = random.Random(3)
+    started = time.perf_counter()
+    for i, message in enumerate(_messages(count, vocabulary, rng)):
+        store.add(message)
+        if i % 50_000 == 49_999:
+            # Let the writer keep up, as it would between update batches
+            await store._flush()
+    await store._flush()
+    return time.perf_counter() - started
+
+def main(count: int, queries: int, path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    store = MessageStore(path, commit_interval=3600)
+    loop.run_until_complete(store.open())
+
+    rng = random.Random(5)
+    vocabulary = _vocabulary(rng)
+    elapsed = loop.run_until_complete(_ingest(store, count, vocabulary))
+    size = os.path.getsize(path) / 2**20
+    print(f"messages={count:,} ingested in {elapsed:.1f}s ({count / elapsed:,.0f}/s), {size:.0f} MiB  {store.stats()}")
+
+    # Mostly mid-frequency words, as people search for
+    common, rare = vocabulary[:200], vocabulary[2000:]
+    end = int((START + datetime.timedelta(seconds=count * 30)).timestamp())
+    month = 30 * 86400
+    kinds = {
+        "one word": lambda: (rng.choice(rare), {}),
+        "two words": lambda: (f"{rng.choice(common)} {rng.choice(rare)}", {}),
+        "common word": lambda: (rng.choice(common[:20]), {}),
+        "prefix": lambda: (rng.choice(rare)[:4] + "*", {}),
+        "in chat": lambda: (rng.choice(common), {"peer_id": -1000000001000 - rng.randrange(200)}),
+        "last month": lambda: (rng.choice(common), {"since": end - month}),
+    }
+    for kind, make in kinds.items():
+        sample = [make() for _ in range(queries)]
+        ms, hits, truncated = _time(lambda q: store.search(q[0], limit=20, **q[1]), sample)
+        print(f"{kind:<12} {ms:7.2f} ms/query  hits={hits}/{queries}  truncated={truncated}")
+    loop.run_until_complete(store.close())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--path", default="/tmp/messages-bench.db")
+    args = parser.parse_args()
+    main(args.messages, args.queries, args.path)
@@ -0,0 +1,115 @@
+"""
+Durable outbox benchmark against a flaky local webhook.
+
+Usage:
+    python -m benchmarks.outbox [--messages 5000] [--fail-rate 0.3]
+
+1. Write path: durable appends/sec with group commit versus one
+   transaction (and fsync) per message.
+2. End to end: every message is appended to the outbox and delivered to a
+   stand-in webhook that fails `--fail-rate` of requests; failed deliveries
+   are retried with backoff until the outbox is empty.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import argparse
+import logging
+import tempfile
+
+from benchmarks.forwarder import StandInWebhook, _payload
+
+os.environ.setdefault("POKE_API_KEY", "benchmark")
+
+def _per_message_commit(path: str, messages: int) -> float:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("CREATE TABLE outbox (id INTEGER PRIMARY KEY, payload TEXT)")
+    started = time.perf_counter()
+    for i in range(messages):
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO outbox (payload) VALUES (?)", (str(_payload(i)),))
+        conn.execute("COMMIT")
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return messages / elapsed
+
+async def _group_commit(path: str, messages: int) -> tuple:
+    from src.outbox import Outbox
+
+    outbox = Outbox(path)
+    await outbox.start(lambda entry: True)
+    started = time.perf_counter()
+    for i in range(messages):
+        outbox.append(_payload(i))
+        if i % 100 == 0:
+            # Let the writer run, as the event loop would between Telegram updates
+            await asyncio.sleep(0)
+    while outbox.counters["committed_rows"] < messages:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    commits = outbox.counters["commits"]
+    await outbox.close()
+    return messages / elapsed, commits
+
+async def _end_to_end(path: str, messages: int, fail_rate: float) -> dict:
+    webhook = StandInWebhook(fail_rate=fail_rate)
+    url = await webhook.start()
+    os.environ["POKE_WEBHOOK_URL"] = url
+
+    from src import forwarder
+    forwarder.POKE_API_KEY = os.environ["POKE_API_KEY"]
+    forwarder.OUTBOX_PATH = path
+    forwarder.OUTBOX_BACKOFF_BASE = 0.05
+    forwarder.OUTBOX_BACKOFF_MAX = 1.0
+    # Random failures should exercise retries, not trip the circuit breaker
+    forwarder.BREAKER_FAILURES = messages
+
+    await forwarder.open_http_client()
+    await forwarder.start_delivery()
+    outbox = forwarder.get_outbox()
+    outbox.poll_interval = 0.05
+
+    started = time.perf_counter()
+    for i in range(messages):
+        await forwarder.enqueue_forward(_payload(i))
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    while outbox.counters["acked"] < messages:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    stats = outbox.stats()
+    await forwarder.stop_delivery()
+    await forwarder.close_http_client()
+    await webhook.stop()
+    return {
+        "rate": messages / elapsed,
+        "requests": webhook.requests,
+        "failures": webhook.failures,
+        "retried": stats["retried"],
+        "commits": stats["commits"]
+    }
+
+async def main(messages: int, fail_rate: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        naive = await asyncio.to_thread(_per_message_commit, os.path.join(tmp, "naive.db"), messages)
+        grouped, commits = await _group_commit(os.path.join(tmp, "grouped.db"), messages)
+        e2e = await _end_to_end(os.path.join(tmp, "outbox.db"), messages, fail_rate)
+
+    print(f"messages={messages} fail_rate={fail_rate:.0%}")
+    print(f"append, commit per message: {naive:9.1f} msg/s  commits={messages}")
+    print(f"append, group commit:       {grouped:9.1f} msg/s  commits={commits}")
+    print(f"end to end (all acked):     {e2e['rate']:9.1f} msg/s  requests={e2e['requests']} "
+          f"failures={e2e['failures']} retried={e2e['retried']} commits={e2e['commits']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    asyncio.run(main(args.messages, args.fail_rate))
@@ -0,0 +1,98 @@
+"""
+search_contacts index benchmark: query latency at 50k peers.
+
+Usage:
+    python -m benchmarks.search [--peers 50000] [--queries 2000]
+
+Indexes synthetic users (Latin and Cyrillic names, usernames, phones) in a
+PeerSearchIndex and times prefix, multi-word, typo and cross-script queries
+against it, next to the old linear substring scan over the contact list.
+"""
+import time
+import random
+import argparse
+
+from telethon.tl.types import User
+
+from src.search import PeerSearchIndex
+
+LATIN = ["ma", "ri", "jo", "an", "el", "ka", "ton", "li", "sa", "ver", "ni", "co", "da", "mi", "ro", "be", "la", "ste", "phen", "us"]
+CYRILLIC = ["ма", "ри", "ан", "ол", "га", "ни", "ки", "та", "сер", "гей", "ва", "ли", "ев", "ко", "на", "ми", "ха", "ил"]
+
+def _name(rng: random.Random, syllables: list, parts: int) -> str:
+    return "".join(rng.choice(syllables) for _ in range(parts)).capitalize()
+
+def _users(count: int) -> list:
+    # Names built from syllables: a few thousand distinct first names and
+    # many more last names, about a fifth of them in Cyrillic
+    rng = random.Random(7)
+    users = []
+    for i in range(count):
+        syllables = CYRILLIC if rng.random() < 0.2 else LATIN
+        first, last = _name(rng, syllables, rng.randint(2, 3)), _name(rng, syllables, rng.randint(2, 4))
+        users.append(User(
+            id=i + 1,
+            first_name=first,
+            last_name=last,
+            username=f"{first.lower()}_{last.lower()}{rng.randint(1, 99)}" if first.isascii() and rng.random() < 0.4 else None,
+            phone=f"1555{i:07d}" if i % 2 else None
+        ))
+    return users
+
+_TO_CYRILLIC = {"ma": "ма", "ri": "ри", "an": "ан", "ni": "ни", "li": "ли", "mi": "ми"}
+
+def _translit(name: str) -> str:
+    # Latin query for a Cyrillic name and the other way round, where the syllables allow
+    from src.search import normalize
+    if not name.isascii():
+        return normalize(name)
+    for latin, cyrillic in _TO_CYRILLIC.items():
+        name = name.lower().replace(latin, cyrillic)
+    return name
+
+def _linear(users: list, query: str, limit: int) -> list:
+    # The scan search_contacts used before the index
+    q_lower = query.lower()
+    found = []
+    for user in users:
+        name = f"{user.first_name or ''} {user.last_name or ''}".strip().lower()
+        username = (user.username or "").lower()
+        if q_lower in name or q_lower in username:
+            found.append(user)
+    return found[:limit]
+
+def _time(search, queries: list) -> float:
+    started = time.perf_counter()
+    for query in queries:
+        search(query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+def main(peers: int, queries: int):
+    users = _users(peers)
+    index = PeerSearchIndex()
+    started = time.perf_counter()
+    index.set_contacts(users)
+    print(f"peers={peers:,} indexed in {time.perf_counter() - started:.2f}s  {index.stats()}")
+
+    rng = random.Random(11)
+    kinds = {
+        "prefix": lambda u: (u.first_name or "")[:3],
+        "full name": lambda u: f"{u.first_name} {u.last_name}",
+        "username": lambda u: f"@{u.username}" if u.username else u.first_name,
+        "phone": lambda u: f"+{u.phone[:8]}" if u.phone else u.first_name,
+        "typo": lambda u: u.last_name[:2] + u.last_name[3:] if len(u.last_name) > 5 else u.last_name,
+        "translit": lambda u: _translit(u.first_name),
+    }
+    for kind, make in kinds.items():
+        sample = [make(rng.choice(users)) for _ in range(queries)]
+        hits = sum(1 for q in sample[:100] if index.search(q, 10))
+        indexed_us = _time(lambda q: index.search(q, 10), sample)
+        linear_us = _time(lambda q: _linear(users, q, 10), sample[:max(1, queries // 20)])
+        print(f"{kind:<10} index={indexed_us:8.1f} us/query  linear scan={linear_us:8.1f} us/query  hits={hits}/100")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    args = parser.parse_args()
+    main(args.peers, args.queries)
@@ -1,61 +1,206 @@
-import time
+import os
+import re
+import asyncio
 import logging
-from typing import Optional, Any, Dict, Tuple
+from typing import Optional, Any, Dict, Set, Union
+from telethon import functions, types
+from telethon.utils import parse_phone, resolve_id
 from .client import client
+from .utils import MUTE_FOREVER, entity_name, get_mute_until, is_mute_active
+from .ttlcache import TTLCache
+from .peerstore import PeerStore
+from .search import get_search_index
 
 logger = logging.getLogger("telegram_cache")
 
 # Caching Configuration
-LIST_TTL = 60           # 1 minute for volatile lists (chats, contacts)
+LIST_TTL = 60           # 1 minute for volatile lists (contacts)
 ENTITY_TTL = 300        # 5 minutes for stable entities (User/Chat)
-MESSAGE_TTL = 10        # 10 seconds for message lists (debounce)
-MUTE_TTL = 30           # 30 seconds for mute status (fast reaction)
+
+# Size budgets (oldest/least recently used entries are evicted first)
+ENTITY_MAX_ENTRIES = 10_000
+SENDER_NAMES_MAX_ENTRIES = 50_000
+MUTE_MAX_ENTRIES = 50_000
+SWEEP_INTERVAL = 60     # seconds between expiry sweeps
+
+# Stale-while-revalidate (contacts, get_me): once expired, the old value is
+# served while one background refresh runs, for at most this many seconds
+CACHE_MAX_STALE_S = float(os.getenv("TELEGRAM_CACHE_MAX_STALE_S", "600"))
+CACHE_PREWARM = os.getenv("TELEGRAM_CACHE_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# Persistent entity store (opt-in; peers seen before resolve after a restart)
+ENTITY_STORE_PATH = os.getenv("TELEGRAM_ENTITY_STORE_PATH")
+ENTITY_STORE_COMMIT_S = float(os.getenv("TELEGRAM_ENTITY_STORE_COMMIT_S", "2"))
 
 # In-memory stores
-_DIALOGS_CACHE: Dict[str, Any] = {"data": None, "timestamp": 0}
-_CONTACTS_CACHE: Dict[str, Any] = {"data": None, "timestamp": 0}
-_ENTITY_CACHE: Dict[int, Tuple[Any, float]] = {} 
-_MESSAGES_CACHE: Dict[str, Tuple[str, float]] = {}
-_ME_CACHE: Dict[str, Any] = {"data": None, "timestamp": 0}
+_CONTACTS_CACHE = TTLCache("contacts", ttl=LIST_TTL, max_entries=1, max_stale=CACHE_MAX_STALE_S)
+_ENTITY_CACHE = TTLCache(
+    "entities", ttl=ENTITY_TTL, max_entries=ENTITY_MAX_ENTRIES, sweep_interval=SWEEP_INTERVAL,
+    on_remove=lambda entity_id, _: _unindex_entity(entity_id)
+)
+# Display names of message senders, for records that outlive their sender's entity entry
+_SENDER_NAMES = TTLCache("sender_names", max_entries=SENDER_NAMES_MAX_ENTRIES)
+_ME_CACHE = TTLCache("me", ttl=ENTITY_TTL, max_entries=1, max_stale=CACHE_MAX_STALE_S)
 
 # --- Entity Caching ---
 
 def get_cached_me() -> Optional[Any]:
     """Helper to get cached 'me'."""
-    if _ME_CACHE["data"] and (time.time() - _ME_CACHE["timestamp"] < ENTITY_TTL):
-        return _ME_CACHE["data"]
-    return None
+    return _ME_CACHE.get("me") or None
 
 def set_cached_me(me: Any) -> None:
-    _ME_CACHE["data"] = me
-    _ME_CACHE["timestamp"] = time.time()
-
-def get_cached_entity(entity_id: int) -> Optional[Any]:
-    """Helper to get entity from cache or None."""
-    if entity_id in _ENTITY_CACHE:
-        data, timestamp = _ENTITY_CACHE[entity_id]
-        if time.time() - timestamp < ENTITY_TTL:
-            return data
-    return None
-
-def cache_entity(entity_id: int, entity: Any) -> None:
-    """Helper to cache entity."""
-    current_time = time.time()
-    _ENTITY_CACHE[entity_id] = (entity, current_time)
-    if hasattr(entity, 'id'):
-        _ENTITY_CACHE[entity.id] = (entity, current_time)
-
-async def get_or_fetch_entity(entity_id: int, force_refresh: bool = False) -> Any:
+    _ME_CACHE.set("me", me)
+
+async def get_or_fetch_me() -> Any:
+    """The current user; a stale copy is returned while it is refreshed in the background."""
+    return await _revalidate(_ME_CACHE, "me", _fetch_me)
+
+async def _fetch_me() -> Any:
+    me = await client.get_me()
+    set_cached_me(me)
+    return me
+
+# Entities are stored once, under entity.id. Every other way of naming
+# them (marked ID, @username, phone, the key a caller used) is an alias in
+# _ENTITY_ALIASES; _ENTITY_ALIAS_SETS is the reverse map used to drop stale
+# aliases when an entity changes or leaves the cache.
+_ENTITY_ALIASES: Dict[Any, int] = {}
+_ENTITY_ALIAS_SETS: Dict[int, Set[Any]] = {}
+
+_USERNAME_RE = re.compile(r"^(?:@|(?:https?://)?(?:www\.)?(?:t|telegram)\.(?:me|dog)/)?([a-z][a-z0-9_]{3,31})/?$")
+
+def _normalize_key(key: Any) -> Any:
     """
-    Smart helper to get an entity.
-    Checks cache first (unless force_refresh is True).
-    If missing or expired, fetches from Telegram and caches it.
+    Normalizes a chat_id as given to a tool, the way Telethon reads it:
+    ints (marked or not) -> bare ID, digit strings -> '+phone',
+    usernames and t.me links -> '@name'. Anything else is returned as is.
     """
-    if not force_refresh:
-        entity = get_cached_entity(entity_id)
-        if entity:
-            return entity
+    if isinstance(key, str):
+        phone = parse_phone(key)
+        if phone:
+            return f"+{phone}"
+        match = _USERNAME_RE.match(key.strip().lower())
+        return f"@{match.group(1)}" if match else key
+    if isinstance(key, int) and not isinstance(key, bool):
+        return resolve_id(key)[0]
+    return key
+
+def _entity_aliases(entity: Any) -> Set[Any]:
+    aliases: Set[Any] = set()
+    usernames = [getattr(entity, "username", None)]
+    usernames += [getattr(u, "username", None) for u in getattr(entity, "usernames", None) or []]
+    for username in usernames:
+        if username:
+            aliases.add(f"@{username.lower()}")
+    phone = getattr(entity, "phone", None)
+    if phone:
+        aliases.add(f"+{phone}")
+    return aliases
+
+def _index_entity(entity_id: int, aliases: Set[Any]) -> None:
+    for alias in _ENTITY_ALIAS_SETS.get(entity_id, set()) - aliases:
+        if _ENTITY_ALIASES.get(alias) == entity_id:
+            del _ENTITY_ALIASES[alias]
+    for alias in aliases:
+        previous = _ENTITY_ALIASES.get(alias)
+        if previous is not None and previous != entity_id:
+            # e.g. a username that moved to another entity
+            _ENTITY_ALIAS_SETS.get(previous, set()).discard(alias)
+        _ENTITY_ALIASES[alias] = entity_id
+    _ENTITY_ALIAS_SETS[entity_id] = aliases
+
+def _unindex_entity(entity_id: int) -> None:
+    for alias in _ENTITY_ALIAS_SETS.pop(entity_id, ()):
+        if _ENTITY_ALIASES.get(alias) == entity_id:
+            del _ENTITY_ALIASES[alias]
+
+def get_cached_entity(entity_id: Union[int, str]) -> Optional[Any]:
+    """
+    Helper to get entity from cache or None.
+    Accepts any alias of a cached entity: ID, marked ID, @username, t.me link or phone.
+    """
+    key = _normalize_key(entity_id)
+    return _ENTITY_CACHE.get(_ENTITY_ALIASES.get(key, key))
+
+def cache_entity(entity_id: Union[int, str], entity: Any) -> None:
+    """Helper to cache entity (and persist it, if the entity store is enabled)."""
+    key = _normalize_key(entity_id)
+    primary = getattr(entity, "id", None)
+    if primary is None:
+        _ENTITY_CACHE.set(key, entity)
+        return
+
+    aliases = _entity_aliases(entity)
+    if key != primary:
+        # Keeps lookups by e.g. a phone the entity does not expose
+        aliases.add(key)
+    _ENTITY_CACHE.set(primary, entity)
+    _index_entity(primary, aliases)
+    if _ENTITY_STORE is not None:
+        _ENTITY_STORE.add(entity)
+
+# --- Persistent Entity Store ---
+
+_ENTITY_STORE: Optional[PeerStore] = None
+_ENTITY_STORE_LOAD: Optional[asyncio.Task] = None
+
+async def start_entity_store() -> None:
+    """
+    Opens TELEGRAM_ENTITY_STORE_PATH, if configured, and feeds the stored
+    entities to the Telethon session in the background, so their access
+    hashes are known without a dialog sync. Called from server_lifespan.
+    """
+    global _ENTITY_STORE, _ENTITY_STORE_LOAD
+    if not ENTITY_STORE_PATH or _ENTITY_STORE is not None:
+        return
+    _ENTITY_STORE = PeerStore(ENTITY_STORE_PATH, commit_interval=ENTITY_STORE_COMMIT_S)
+    _ENTITY_STORE_LOAD = asyncio.create_task(_load_entity_store())
+
+async def _load_entity_store() -> None:
+    global _ENTITY_STORE
+    try:
+        entities = await _ENTITY_STORE.open()
+        if entities:
+            client.session.process_entities(entities)
+    except Exception as e:
+        logger.error(f"Failed to load entity store {ENTITY_STORE_PATH}: {e}")
+        _ENTITY_STORE = None
+
+async def stop_entity_store() -> None:
+    """Writes out buffered entities and closes the store."""
+    global _ENTITY_STORE, _ENTITY_STORE_LOAD
+    if _ENTITY_STORE_LOAD is not None:
+        await asyncio.gather(_ENTITY_STORE_LOAD, return_exceptions=True)
+        _ENTITY_STORE_LOAD = None
+    if _ENTITY_STORE is not None:
+        await _ENTITY_STORE.close()
+        _ENTITY_STORE = None
+
+async def _entity_store_ready() -> None:
+    # Lookups right after startup wait for the (fast) load instead of syncing dialogs
+    if _ENTITY_STORE_LOAD is not None and not _ENTITY_STORE_LOAD.done():
+        await asyncio.shield(_ENTITY_STORE_LOAD)
 
+# Single-flight: concurrent misses for the same entity share one fetch,
+# and failed lookups share one recovery dialog sync.
+_ENTITY_FETCHES: Dict[Any, asyncio.Task] = {}
+_DIALOG_SYNC: Optional[asyncio.Task] = None
+_FETCH_STATS: Dict[str, int] = {"fetches": 0, "coalesced": 0, "dialog_syncs": 0, "dialog_syncs_joined": 0}
+
+async def _sync_dialogs() -> None:
+    """Runs the recovery dialog sync, or joins the one already in flight."""
+    global _DIALOG_SYNC
+    if _DIALOG_SYNC is None or _DIALOG_SYNC.done():
+        _FETCH_STATS["dialog_syncs"] += 1
+        # Fetch a reasonable number of dialogs to find the chat
+        _DIALOG_SYNC = asyncio.create_task(client.get_dialogs(limit=50))
+    else:
+        _FETCH_STATS["dialog_syncs_joined"] += 1
+    # Shielded so one cancelled caller does not cancel the sync for the others
+    await asyncio.shield(_DIALOG_SYNC)
+
+async def _fetch_entity(entity_id: Any) -> Any:
+    await _entity_store_ready()
     logger.debug(f"Fetching fresh entity for ID {entity_id}...")
     try:
         entity = await client.get_entity(entity_id)
@@ -66,8 +211,7 @@ async def get_or_fetch_entity(entity_id: int, force_refresh: bool = False) -> An
         # Fetching dialogs "seeds" the internal cache.
         logger.warning(f"Entity {entity_id} not found in internal cache. Syncing dialogs to recover...")
         try:
-            # Fetch a reasonable number of dialogs to find the chat
-            await client.get_dialogs(limit=50)
+            await _sync_dialogs()
             # Retry
             entity = await client.get_entity(entity_id)
             cache_entity(entity_id, entity)
@@ -79,61 +223,192 @@ async def get_or_fetch_entity(entity_id: int, force_refresh: bool = False) -> An
         logger.error(f"Failed to fetch entity {entity_id}: {e}")
         raise e
 
-# --- List Caching ---
+async def get_or_fetch_entity(entity_id: Union[int, str], force_refresh: bool = False) -> Any:
+    """
+    Smart helper to get an entity.
+    Checks cache first (unless force_refresh is True).
+    If missing or expired, fetches from Telegram and caches it; concurrent
+    callers asking for the same entity wait on the same fetch.
+    """
+    if not force_refresh:
+        entity = get_cached_entity(entity_id)
+        if entity:
+            return entity
+
+    # Keyed by the normalized form, so '@Name' and 't.me/name' share a fetch
+    key = _normalize_key(entity_id)
+    task = _ENTITY_FETCHES.get(key)
+    if task is None:
+        _FETCH_STATS["fetches"] += 1
+        task = asyncio.create_task(_fetch_entity(entity_id))
+        _ENTITY_FETCHES[key] = task
+        task.add_done_callback(lambda _: _ENTITY_FETCHES.pop(key, None))
+    else:
+        _FETCH_STATS["coalesced"] += 1
+    return await asyncio.shield(task)
 
-def get_cached_dialogs(limit: int) -> Optional[list]:
-    current_time = time.time()
-    cached_data = _DIALOGS_CACHE["data"]
-    timestamp = _DIALOGS_CACHE["timestamp"]
-    
-    if cached_data and (current_time - timestamp < LIST_TTL):
-        # We have a valid cache. 
-        # CAUTION: If user requests 200 items but we only cached top 20, 
-        # this simple check might need refinement. For now, we assume
-        # the list header is usually consistent.
-        if len(cached_data) >= limit:
-            return cached_data[:limit]
-    return None
-
-def set_cached_dialogs(dialogs: list) -> None:
-    _DIALOGS_CACHE["data"] = dialogs
-    _DIALOGS_CACHE["timestamp"] = time.time()
+# --- List Caching ---
+# (The dialog list is an update-driven index, see src/dialogs.py)
 
 def get_cached_contacts() -> Optional[list]:
-    current_time = time.time()
-    if _CONTACTS_CACHE["data"] and (current_time - _CONTACTS_CACHE["timestamp"] < LIST_TTL):
-        return _CONTACTS_CACHE["data"]
-    return None
+    # Stale copies count too; contact lists change rarely
+    return _CONTACTS_CACHE.get_stale("contacts")[0] or None
 
 def set_cached_contacts(contacts: list) -> None:
-    _CONTACTS_CACHE["data"] = contacts
-    _CONTACTS_CACHE["timestamp"] = time.time()
+    _CONTACTS_CACHE.set("contacts", contacts)
+
+async def get_or_fetch_contacts() -> Any:
+    """The contacts list; a stale copy is returned while it is refreshed in the background."""
+    return await _revalidate(_CONTACTS_CACHE, "contacts", _fetch_contacts)
+
+# The last full contacts result and its Telegram hash, kept past cache
+# expiry so refreshes can ask "changed since?" (ContactsNotModified if not)
+_CONTACTS_LAST: Optional[Any] = None
+_CONTACTS_HASH = 0
+
+def _contacts_hash(contacts: Any) -> int:
+    """
+    Telegram's hash for contacts.getContacts: the usual 64-bit hash over
+    saved_count followed by the contacts' user IDs in ascending order.
+    """
+    h = 0
+    for value in [contacts.saved_count, *sorted(c.user_id for c in contacts.contacts)]:
+        h ^= h >> 21
+        h ^= (h << 35) & 0xFFFFFFFFFFFFFFFF
+        h ^= h >> 4
+        h = (h + value) & 0xFFFFFFFFFFFFFFFF
+    # Sent as a signed long
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+async def _fetch_contacts() -> Any:
+    global _CONTACTS_LAST, _CONTACTS_HASH
+    result = await client(functions.contacts.GetContactsRequest(hash=_CONTACTS_HASH))
+    if isinstance(result, types.contacts.ContactsNotModified) and _CONTACTS_LAST is not None:
+        # Unchanged: only restart the TTL
+        _REFRESH_STATS["not_modified"] += 1
+        set_cached_contacts(_CONTACTS_LAST)
+        return _CONTACTS_LAST
+    # Cache individual users from the contacts list for entity lookups
+    for user in result.users:
+        cache_entity(user.id, user)
+    _CONTACTS_LAST, _CONTACTS_HASH = result, _contacts_hash(result)
+    get_search_index().set_contacts(result.users)
+    set_cached_contacts(result)
+    return result
+
+# --- Stale-while-revalidate ---
+# Expired values are served as they are while one refresh per key runs in
+# the background; callers only wait when there is nothing to serve (cold
+# cache, or older than CACHE_MAX_STALE_S).
+
+_REFRESHES: Dict[str, asyncio.Task] = {}
+_REFRESH_STATS: Dict[str, int] = {"stale_served": 0, "refreshes": 0, "refresh_errors": 0, "blocking": 0, "not_modified": 0}
+
+def _refresh(key: str, fetch) -> asyncio.Task:
+    """Starts the refresh for `key`, or returns the one already in flight."""
+    task = _REFRESHES.get(key)
+    if task is None:
+        _REFRESH_STATS["refreshes"] += 1
+        task = asyncio.create_task(fetch())
+        _REFRESHES[key] = task
+        task.add_done_callback(lambda t: _refresh_done(key, t))
+    return task
+
+def _refresh_done(key: str, task: asyncio.Task) -> None:
+    _REFRESHES.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        # Retrieved here so background failures are logged, not "never retrieved"
+        _REFRESH_STATS["refresh_errors"] += 1
+        logger.warning(f"Refreshing {key} failed: {task.exception()}")
+
+async def _revalidate(cache: TTLCache, key: str, fetch) -> Any:
+    value, fresh = cache.get_stale(key)
+    if fresh:
+        return value
+    task = _refresh(key, fetch)
+    if value is not None:
+        _REFRESH_STATS["stale_served"] += 1
+        return value
+    _REFRESH_STATS["blocking"] += 1
+    return await asyncio.shield(task)
 
-# --- Message Caching ---
+async def warm_caches() -> None:
+    """Fills the contacts and get_me caches at startup so first calls do not wait on them."""
+    if not CACHE_PREWARM:
+        return
+    # Failures are logged by _refresh_done; the caches then fill on first use
+    results = await asyncio.gather(_refresh("me", _fetch_me), _refresh("contacts", _fetch_contacts), return_exceptions=True)
+    if not any(isinstance(r, BaseException) for r in results):
+        logger.info("Pre-warmed contacts and get_me caches.")
 
-def get_cached_messages(key: str) -> Optional[str]:
-    if key in _MESSAGES_CACHE:
-        data, timestamp = _MESSAGES_CACHE[key]
-        if time.time() - timestamp < MESSAGE_TTL:
-            return data
-    return None
+# --- Sender Names ---
+# Messages are cached as records holding only the sender's ID (see
+# src/history.py); names come from the entity cache, or from here once the
+# entity has expired.
 
-def set_cached_messages(key: str, content: str) -> None:
-    _MESSAGES_CACHE[key] = (content, time.time())
+def get_cached_sender_name(sender_id: int) -> Optional[str]:
+    entity = get_cached_entity(sender_id)
+    if entity is not None:
+        return entity_name(entity)
+    return _SENDER_NAMES.get(sender_id)
+
+def set_cached_sender_name(sender_id: int, name: str) -> None:
+    if _SENDER_NAMES.get(sender_id) != name:
+        _SENDER_NAMES.set(sender_id, name)
 
 # --- Mute Status Caching ---
+# Event-driven: seeded from dialogs at startup and kept current by
+# UpdateNotifySettings and mute_chat/unmute_chat. Entries do not expire
+# (only the least recently used are evicted past the budget); we store the
+# mute deadline so timed mutes lapse without a refetch.
 
-_MUTE_STATUS_CACHE: Dict[int, Tuple[bool, float]] = {}
+_MUTE_STATUS_CACHE = TTLCache("mute_status", max_entries=MUTE_MAX_ENTRIES)
 
 def get_cached_mute_status(peer_id: int) -> Optional[bool]:
     """
-    Returns cached mute status (True/False) if valid, else None.
+    Returns cached mute status (True/False) if known, else None.
+    """
+    mute_until = _MUTE_STATUS_CACHE.get(peer_id)
+    if mute_until is None:
+        return None
+    return is_mute_active(mute_until)
+
+def set_cached_mute_status(peer_id: int, is_muted: bool, mute_until: Optional[float] = None) -> None:
+    """
+    Records the mute status of a peer.
+    `mute_until` (unix timestamp) lets a timed mute expire on its own.
     """
-    if peer_id in _MUTE_STATUS_CACHE:
-        is_muted, timestamp = _MUTE_STATUS_CACHE[peer_id]
-        if time.time() - timestamp < MUTE_TTL:
-            return is_muted
-    return None
+    if mute_until is None:
+        mute_until = float(MUTE_FOREVER) if is_muted else 0.0
+    _MUTE_STATUS_CACHE.set(peer_id, mute_until)
+
+def seed_mute_statuses(dialogs: list) -> int:
+    """
+    Bulk-loads mute status from the notify_settings carried by get_dialogs results.
+    Returns the number of peers seeded.
+    """
+    count = 0
+    for dialog in dialogs:
+        entity = getattr(dialog, "entity", None)
+        tl_dialog = getattr(dialog, "dialog", None)
+        if entity is None or tl_dialog is None:
+            continue
+        settings = getattr(tl_dialog, "notify_settings", None)
+        _MUTE_STATUS_CACHE.set(entity.id, get_mute_until(settings))
+        if _ENTITY_STORE is not None:
+            _ENTITY_STORE.add(entity)
+        count += 1
+    return count
+
+# --- Stats ---
 
-def set_cached_mute_status(peer_id: int, is_muted: bool) -> None:
-    _MUTE_STATUS_CACHE[peer_id] = (is_muted, time.time())
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss/eviction counters and sizes for every cache."""
+    caches = (_ENTITY_CACHE, _SENDER_NAMES, _MUTE_STATUS_CACHE, _CONTACTS_CACHE, _ME_CACHE)
+    stats = {cache.name: cache.stats() for cache in caches}
+    stats["entities"]["aliases"] = len(_ENTITY_ALIASES)
+    stats["entity_fetch"] = dict(_FETCH_STATS, in_flight=len(_ENTITY_FETCHES))
+    stats["refresh"] = dict(_REFRESH_STATS, in_flight=len(_REFRESHES))
+    if _ENTITY_STORE is not None:
+        stats["entity_store"] = _ENTITY_STORE.stats()
+    return stats
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+from array import array
+from hashlib import blake2b
+from typing import Dict, Set
+
+logger = logging.getLogger("telegram_dedupe")
+
+class MessageDeduper:
+    """
+    Bounded duplicate detector keyed on (chat_id, message_id).
+
+    Keys are kept in two generations of sets. When the current generation
+    reaches half the capacity or half the time window, it becomes the previous
+    generation and the old previous one is discarded. A key is therefore
+    remembered for at least half the window (or the last capacity/2 keys,
+    whichever ends first) and memory never grows past `capacity` keys, no
+    matter how many messages pass through.
+
+    Keys are 64-bit BLAKE2b digests of (chat_id, message_id), the same on
+    every platform and interpreter; a false positive would need a full
+    64-bit collision.
+    """
+
+    def __init__(self, capacity: int = 200_000, window: float = 86400.0):
+        self.capacity = max(2, capacity)
+        self.window = window
+        self._current: Set[int] = set()
+        self._previous: Set[int] = set()
+        self._rotated_at = time.time()
+        self.counters: Dict[str, int] = {"checked": 0, "duplicates": 0, "rotations": 0}
+
+    @staticmethod
+    def _key(chat_id: int, message_id: int) -> int:
+        # A documented, fixed-width hash, so keys saved by one interpreter load in another
+        digest = blake2b(f"{chat_id}:{message_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def _maybe_rotate(self) -> None:
+        if len(self._current) >= self.capacity // 2 or time.time() - self._rotated_at >= self.window / 2:
+            self._previous = self._current
+            self._current = set()
+            self._rotated_at = time.time()
+            self.counters["rotations"] += 1
+
+    def seen(self, chat_id: int, message_id: int) -> bool:
+        """
+        Returns True if this message was already seen (a duplicate);
+        otherwise records it and returns False.
+        """
+        self.counters["checked"] += 1
+        key = self._key(chat_id, message_id)
+        if key in self._current or key in self._previous:
+            self.counters["duplicates"] += 1
+            return True
+        self._maybe_rotate()
+        self._current.add(key)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self), "capacity": self.capacity, **self.counters}
+
+    # --- Persistence ---
+
+    def save(self, path: str) -> None:
+        """Writes both generations as packed 64-bit keys (atomic replace)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            header = array("d", [self._rotated_at, float(len(self._previous))])
+            header.tofile(f)
+            array("q", self._previous).tofile(f)
+            array("q", self._current).tofile(f)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        """Restores state written by `save()`, ignoring it if the window has passed."""
+        with open(path, "rb") as f:
+            header = array("d")
+            header.fromfile(f, 2)
+            keys = array("q")
+            keys.frombytes(f.read())
+
+        rotated_at, previous_len = header[0], int(header[1])
+        age = time.time() - rotated_at
+        if age >= self.window:
+            logger.info(f"Dedupe state in {path} is older than the window. Starting empty.")
+            return
+
+        self._previous = set(keys[:previous_len])
+        self._current = set(keys[previous_len:])
+        self._rotated_at = rotated_at
+        if age >= self.window / 2:
+            # The saved "previous" generation has fully expired meanwhile
+            self._previous = self._current
+            self._current = set()
+            self._rotated_at = time.time()
+        logger.info(f"Loaded {len(self)} dedupe keys from {path}.")
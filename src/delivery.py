@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("telegram_delivery")
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+class DeliveryQueue:
+    """
+    Bounded pipeline stage between the Telegram event handler and the webhook.
+
+    Payloads are accepted with `put()` (which returns immediately unless the
+    overflow policy is 'block' and the queue is full) and delivered by a pool
+    of worker tasks calling `deliver(payload)`.
+
+    Each worker owns one lane. Payloads are routed to a lane by `key(payload)`
+    (e.g. the chat id), so payloads sharing a key are delivered in order.
+
+    If `deliver_batch` is given, workers run in micro-batch mode: a worker
+    collects up to `batch_size` payloads from its lane, waiting at most
+    `batch_linger` seconds after the first one, and hands them to
+    `deliver_batch(payloads)` in a single call.
+
+    Payloads read back from the spill file are plain JSON values; `restore`
+    turns each into a queue item again, or returns None if it took the
+    payload over itself.
+
+    Overflow policies when a lane is full:
+        block       - wait for room (back-pressure on the caller).
+        drop_oldest - discard the oldest queued payload to make room.
+        spill       - append the payload to a JSONL spill file; it is fed back
+                      into the queue once there is room again. Until then,
+                      later payloads with the same key are spilled behind it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        deliver: Callable[[Any], Awaitable[bool]],
+        maxsize: int = 1000,
+        workers: int = 4,
+        overflow: str = OVERFLOW_BLOCK,
+        spill_path: Optional[str] = None,
+        key: Optional[Callable[[Any], Any]] = None,
+        deliver_batch: Optional[Callable[[List[Any]], Awaitable[bool]]] = None,
+        batch_size: int = 50,
+        batch_linger: float = 0.25,
+        restore: Optional[Callable[[Any], Any]] = None
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'. Expected one of: {', '.join(OVERFLOW_POLICIES)}")
+        if overflow == OVERFLOW_SPILL and not spill_path:
+            raise ValueError("The 'spill' overflow policy requires a spill_path")
+
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.worker_count = max(1, workers)
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.batch_size = max(1, batch_size)
+        self.batch_linger = max(0.0, batch_linger)
+        self._deliver = deliver
+        self._deliver_batch = deliver_batch
+        self._key = key
+        self._restore = restore
+
+        self._lanes: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._spill_task: Optional[asyncio.Task] = None
+        self._spill_event: Optional[asyncio.Event] = None
+        self._closing = False
+        self._round_robin = 0
+        # Payloads per key waiting in the spill files; new ones queue up behind them
+        self._spilled: Dict[Any, int] = {}
+
+        self.counters: Dict[str, float] = {
+            "enqueued": 0,
+            "delivered": 0,
+            "failed": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "unspilled": 0,
+            "batches": 0,
+            "max_depth": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0
+        }
+
+    @property
+    def running(self) -> bool:
+        return bool(self._lanes) and not self._closing
+
+    @property
+    def batching(self) -> bool:
+        return self._deliver_batch is not None
+
+    def depth(self) -> int:
+        return sum(lane.qsize() for lane in self._lanes)
+
+    async def start(self) -> None:
+        if self._lanes:
+            return
+        self._closing = False
+        # Split the total budget across lanes
+        lane_size = max(1, self.maxsize // self.worker_count)
+        self._lanes = [asyncio.Queue(maxsize=lane_size) for _ in range(self.worker_count)]
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        if self.overflow == OVERFLOW_SPILL:
+            self._spill_event = asyncio.Event()
+            self._spill_task = asyncio.create_task(self._unspill_loop(), name=f"{self.name}-unspill")
+            self._spilled = await asyncio.to_thread(self._count_spilled)
+            if self._spilled or any(os.path.exists(path) and os.path.getsize(path) > 0 for path in (self._draining_path(), self.spill_path)):
+                # Leftovers from a previous run
+                self._spill_event.set()
+        mode = f"batch (size={self.batch_size}, linger={self.batch_linger}s)" if self.batching else "single"
+        logger.info(f"Delivery queue '{self.name}' started (maxsize={self.maxsize}, workers={self.worker_count}, overflow={self.overflow}, mode={mode}).")
+
+    async def put(self, payload: Any) -> bool:
+        """
+        Hands a payload to the delivery workers.
+        Returns False if the payload was not accepted (queue stopped).
+        """
+        if not self.running:
+            logger.warning(f"Delivery queue '{self.name}' is not running. Payload not accepted.")
+            return False
+
+        key = self._key_of(payload)
+        lane = self._lane(key)
+        item = (payload, time.monotonic())
+        self.counters["enqueued"] += 1
+
+        if self.overflow == OVERFLOW_SPILL and key in self._spilled:
+            # Older payloads of this key are on disk; stay behind them
+            self._spill(payload)
+            return True
+        if lane.full():
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                try:
+                    lane.get_nowait()
+                    lane.task_done()
+                    self.counters["dropped"] += 1
+                    logger.warning(f"Delivery queue '{self.name}' full. Dropped oldest payload.")
+                except asyncio.QueueEmpty:
+                    pass
+            elif self.overflow == OVERFLOW_SPILL:
+                self._spill(payload)
+                return True
+
+        # For 'block' this waits until a worker frees a slot
+        await lane.put(item)
+        self._record_depth()
+        return True
+
+    def offer(self, payload: Any) -> bool:
+        """
+        Non-blocking put that ignores the overflow policy.
+        Returns False if the payload's lane is full, older payloads with its
+        key are spilled, or the queue is stopped.
+        """
+        if not self.running:
+            return False
+        key = self._key_of(payload)
+        if key in self._spilled:
+            return False
+        lane = self._lane(key)
+        try:
+            lane.put_nowait((payload, time.monotonic()))
+        except asyncio.QueueFull:
+            return False
+        self.counters["enqueued"] += 1
+        self._record_depth()
+        return True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stops accepting payloads, drains what is queued (up to `timeout`) and
+        stops the workers. Spilled payloads stay on disk for the next start.
+        """
+        if not self._lanes:
+            return
+        self._closing = True
+
+        if self._spill_task:
+            self._spill_task.cancel()
+            await asyncio.gather(self._spill_task, return_exceptions=True)
+            self._spill_task = None
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Delivery queue '{self.name}' did not drain within {timeout}s. {self.depth()} payload(s) abandoned.")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._lanes = []
+        logger.info(f"Delivery queue '{self.name}' stopped.")
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.counters["delivered"] + self.counters["failed"]
+        avg_latency = self.counters["latency_total"] / completed if completed else 0.0
+        stats = {
+            "depth": self.depth(),
+            "maxsize": self.maxsize,
+            "workers": self.worker_count,
+            "overflow": self.overflow,
+            "mode": "batch" if self.batching else "single",
+            "enqueued": int(self.counters["enqueued"]),
+            "delivered": int(self.counters["delivered"]),
+            "failed": int(self.counters["failed"]),
+            "dropped": int(self.counters["dropped"]),
+            "spilled": int(self.counters["spilled"]),
+            "unspilled": int(self.counters["unspilled"]),
+            "max_depth": int(self.counters["max_depth"]),
+            "avg_latency_ms": round(avg_latency * 1000, 2),
+            "max_latency_ms": round(self.counters["latency_max"] * 1000, 2)
+        }
+        if self.batching:
+            batches = self.counters["batches"]
+            stats["batches"] = int(batches)
+            stats["avg_batch_size"] = round(completed / batches, 2) if batches else 0.0
+        return stats
+
+    # --- Internals ---
+
+    def _key_of(self, payload: Any) -> Any:
+        return self._key(payload) if self._key else None
+
+    def _lane_for(self, payload: Any) -> asyncio.Queue:
+        return self._lane(self._key_of(payload))
+
+    def _lane(self, key: Any) -> asyncio.Queue:
+        if key is None:
+            self._round_robin = (self._round_robin + 1) % len(self._lanes)
+            return self._lanes[self._round_robin]
+        return self._lanes[hash(key) % len(self._lanes)]
+
+    def _record_depth(self) -> None:
+        depth = self.depth()
+        if depth > self.counters["max_depth"]:
+            self.counters["max_depth"] = depth
+
+    def _record_done(self, items: List[tuple], ok: bool) -> None:
+        now = time.monotonic()
+        self.counters["delivered" if ok else "failed"] += len(items)
+        for _, enqueued_at in items:
+            latency = now - enqueued_at
+            self.counters["latency_total"] += latency
+            if latency > self.counters["latency_max"]:
+                self.counters["latency_max"] = latency
+
+    async def _collect_batch(self, lane: asyncio.Queue) -> List[tuple]:
+        items = [await lane.get()]
+        deadline = time.monotonic() + self.batch_linger
+        while len(items) < self.batch_size:
+            try:
+                items.append(lane.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closing:
+                break
+            try:
+                items.append(await asyncio.wait_for(lane.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _worker(self, index: int) -> None:
+        lane = self._lanes[index]
+        while True:
+            if self.batching:
+                items = await self._collect_batch(lane)
+            else:
+                items = [await lane.get()]
+
+            ok = False
+            try:
+                if self.batching:
+                    self.counters["batches"] += 1
+                    ok = await self._deliver_batch([payload for payload, _ in items])
+                else:
+                    ok = await self._deliver(items[0][0])
+            except Exception as e:
+                logger.error(f"Delivery worker {self.name}-{index} failed: {e}")
+            finally:
+                self._record_done(items, bool(ok))
+                for _ in items:
+                    lane.task_done()
+
+    def _spill(self, payload: Any) -> None:
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            key = self._key_of(payload)
+            if key is not None:
+                self._spilled[key] = self._spilled.get(key, 0) + 1
+            self.counters["spilled"] += 1
+            self._spill_event.set()
+            logger.debug(f"Delivery queue '{self.name}' full. Spilled payload to {self.spill_path}.")
+        except Exception as e:
+            self.counters["dropped"] += 1
+            logger.error(f"Failed to spill payload to {self.spill_path}: {e}")
+
+    def _draining_path(self) -> str:
+        return f"{self.spill_path}.draining"
+
+    def _take_spill_file(self) -> List[Any]:
+        # Rename first so payloads spilled meanwhile start a fresh file. The
+        # renamed file is only removed once all of it is back in the queue.
+        draining = self._draining_path()
+        if not os.path.exists(draining):
+            if not os.path.exists(self.spill_path):
+                return []
+            os.replace(self.spill_path, draining)
+
+        payloads = []
+        with open(draining, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        payloads.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping corrupt spill line in {draining}")
+        return payloads
+
+    def _count_spilled(self) -> Dict[Any, int]:
+        counts: Dict[Any, int] = {}
+        for path in (self._draining_path(), self.spill_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key = self._key_of(json.loads(line))
+                    except ValueError:
+                        continue
+                    if key is not None:
+                        counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _unspilled(self, payload: Any) -> None:
+        key = self._key_of(payload)
+        count = self._spilled.get(key, 0) - 1
+        if count > 0:
+            self._spilled[key] = count
+        else:
+            self._spilled.pop(key, None)
+
+    def _keep_draining(self, payloads: List[Any]) -> None:
+        # Rewrites the draining file with what was not re-queued; the next
+        # start drains it before the spill file
+        draining = self._draining_path()
+        try:
+            with open(draining + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(payload, ensure_ascii=False) + "\n" for payload in payloads)
+            os.replace(draining + ".tmp", draining)
+        except Exception as e:
+            logger.error(f"Failed to keep {len(payloads)} spilled payload(s) in {draining}: {e}")
+
+    async def _unspill_loop(self) -> None:
+        while True:
+            await self._spill_event.wait()
+            self._spill_event.clear()
+
+            # Wait until the queue has drained to half before feeding it again
+            while self.depth() > self.maxsize // 2:
+                await asyncio.sleep(0.1)
+
+            # Cancelling this leaves the draining file in place (nothing lost)
+            payloads = await asyncio.to_thread(self._take_spill_file)
+            for i, payload in enumerate(payloads):
+                item = self._restore(payload) if self._restore else payload
+                try:
+                    if item is not None:
+                        await self._lane_for(item).put((item, time.monotonic()))
+                except asyncio.CancelledError:
+                    # Shutting down: keep what was not re-queued for the next start
+                    self._keep_draining(payloads[i:])
+                    raise
+                self._unspilled(payload)
+                self.counters["unspilled"] += 1
+                self._record_depth()
+            if os.path.exists(self._draining_path()):
+                os.remove(self._draining_path())
+            if os.path.exists(self.spill_path):
+                # Spilled while draining (or left over behind the draining file)
+                self._spill_event.set()
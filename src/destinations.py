@@ -0,0 +1,397 @@
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
+from .delivery import DeliveryQueue
+from .outbox import Outbox, OutboxEntry
+from .resilience import DestinationGuard
+from .rules import RuleSet
+
+logger = logging.getLogger("telegram_destinations")
+
+FORMAT_JSON = "json"
+FORMAT_TEXT = "text"
+FORMATS = (FORMAT_JSON, FORMAT_TEXT)
+
+_CONTENT_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_TEXT: "text/plain; charset=utf-8"
+}
+
+DELIVERED = "delivered"
+FAILED = "failed"
+DEFERRED = "deferred"
+
+# Destinations file format (JSON):
+#
+# {
+#     "destinations": [
+#         {"name": "poke", "url": "https://poke.com/api/v1/inbound-sms/webhook",
+#          "headers": {"Authorization": "Bearer ${POKE_API_KEY}"}},
+#         {"name": "alerts", "url": "https://ntfy.example.com/telegram", "format": "text",
+#          "rules": {"default": "drop", "rules": [{"action": "forward", "keywords": ["outage"]}]}},
+#         {"name": "archive", "url": "https://archive.example.com/single",
+#          "batch_url": "https://archive.example.com/batch", "rate_limit": 5}
+#     ]
+# }
+#
+# "format" is "json" (the payload object) or "text" (the message text only).
+# "rules" takes the same spec as FORWARD_RULES_PATH and filters this destination
+# only. Header values may reference environment variables as ${NAME}.
+
+class Envelope(dict):
+    """
+    A payload shared by every destination it is fanned out to.
+    Each body format is encoded at most once, however many destinations use it.
+    """
+    __slots__ = ("_bodies",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bodies: Dict[str, bytes] = {}
+
+    def encode(self, fmt: str) -> bytes:
+        body = self._bodies.get(fmt)
+        if body is None:
+            if fmt == FORMAT_TEXT:
+                body = str(self.get("message", "")).encode("utf-8")
+            else:
+                body = json.dumps(self, ensure_ascii=False).encode("utf-8")
+            self._bodies[fmt] = body
+        return body
+
+def as_envelope(payload: Dict[str, Any]) -> Envelope:
+    # Replayed/unspilled payloads come back as plain dicts
+    return payload if isinstance(payload, Envelope) else Envelope(payload)
+
+class Destination:
+    """
+    One webhook consumer: URL, headers, body format and optional filter, plus
+    its own delivery queue, rate limiter/circuit breaker and (optionally)
+    outbox, so a slow or failing destination never holds up the others.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        format: str = FORMAT_JSON,
+        batch_url: Optional[str] = None,
+        rules: Optional[RuleSet] = None,
+        guard: Optional[DestinationGuard] = None,
+        outbox_path: Optional[str] = None,
+        spill_path: Optional[str] = None,
+        pending_max: int = 1000,
+        unavailable: Optional[str] = None,
+        get_client: Optional[Callable[[], Awaitable[httpx.AsyncClient]]] = None
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"{name}: format must be one of {', '.join(FORMATS)}")
+        self.name = name
+        self.url = url
+        self.format = format
+        self.batch_url = batch_url
+        self.rules = rules
+        self.guard = guard or DestinationGuard(name, 0, 1, 5, 30.0)
+        self.outbox_path = outbox_path
+        self.spill_path = spill_path
+        # Set when the destination cannot deliver (e.g. missing API key)
+        self.unavailable = unavailable
+        self.headers = {**(headers or {}), "Content-Type": _CONTENT_TYPES[format]}
+
+        self.queue: Optional[DeliveryQueue] = None
+        self.outbox: Optional[Outbox] = None
+        self._get_client = get_client
+
+        # Payloads the queue had no room for; a feeder task puts them (applying
+        # the overflow policy) so the caller never waits on this destination
+        self._handoff: deque = deque()
+        self._feeding: Optional[Envelope] = None
+        self._feed_task: Optional[asyncio.Task] = None
+        self.handoff_counters: Dict[str, int] = {"queued": 0, "dropped": 0}
+
+        # Without an outbox, deferred payloads wait here (bounded) until the circuit lets them through
+        self._pending: deque = deque(maxlen=max(1, pending_max))
+        self._releasing: list = []
+        self._pending_task: Optional[asyncio.Task] = None
+        self.pending_counters: Dict[str, int] = {"held": 0, "released": 0, "dropped": 0}
+
+    def accepts(self, message) -> bool:
+        """Applies this destination's own rules to a raw Telethon message."""
+        return self.rules is None or self.rules.evaluate(message)[0]
+
+    # --- Sending ---
+
+    def _body(self, envelopes: List[Envelope], batch: bool) -> bytes:
+        if not batch:
+            return envelopes[0].encode(self.format)
+        bodies = [envelope.encode(self.format) for envelope in envelopes]
+        if self.format == FORMAT_TEXT:
+            return b"\n\n".join(bodies)
+        return b"[" + b",".join(bodies) + b"]"
+
+    async def post(self, envelopes: List[Envelope], batch: bool = False) -> str:
+        """
+        POSTs one payload (or a batch) through the breaker and rate limiter.
+        Returns DELIVERED, FAILED, or DEFERRED (circuit open, nothing was sent).
+        """
+        label = f"batch of {len(envelopes)}" if batch else "message"
+        if self.unavailable:
+            logger.warning(f"{self.unavailable} Cannot forward {label} to '{self.name}'.")
+            return FAILED
+
+        url = self.batch_url if batch else self.url
+        breaker = self.guard.breaker
+        if not breaker.allow():
+            logger.debug(f"Circuit open for '{self.name}'. Deferring {label}.")
+            return DEFERRED
+        await self.guard.bucket.acquire()
+
+        try:
+            http_client = await self._get_client()
+            logger.debug(f"Forwarding {label} to '{self.name}' ({url})...")
+            response = await http_client.post(url, content=self._body(envelopes, batch), headers=self.headers)
+            if response.is_error:
+                logger.error(f"Webhook '{self.name}' error: {response.status_code} - {response.text}")
+                # Only server-side trouble counts against the destination
+                breaker.record(response.status_code < 500 and response.status_code != 429)
+                return FAILED
+            breaker.record(True)
+            logger.info(f"Forwarded {label} to '{self.name}' (Status: {response.status_code})")
+            return DELIVERED
+
+        except Exception as e:
+            breaker.record(False)
+            logger.error(f"Failed to forward {label} to '{self.name}': {e}")
+            return FAILED
+
+    # --- Queue/outbox plumbing ---
+
+    async def start(self, queue_options: Dict[str, Any], outbox_options: Dict[str, Any], batching: bool = False) -> None:
+        if self.queue is None:
+            if batching and not self.batch_url:
+                logger.warning(f"Batching is enabled but '{self.name}' has no batch URL. Using single-POST delivery.")
+                batching = False
+
+            if self.outbox_path:
+                # Queue items are outbox entries; the outbox itself absorbs overflow
+                self.outbox = Outbox(self.outbox_path, **outbox_options)
+                deliver, deliver_batch = self._deliver_entry, self._deliver_entries
+                # A spill file from before the outbox was enabled holds plain payloads
+                key = lambda item: (item.payload if isinstance(item, OutboxEntry) else item).get("chat_id")
+                restore = self._adopt
+            else:
+                deliver, deliver_batch = self._deliver_payload, self._deliver_payloads
+                key = lambda data: data.get("chat_id")
+                restore = as_envelope
+
+            self.queue = DeliveryQueue(
+                self.name,
+                deliver,
+                spill_path=self.spill_path,
+                # Same chat -> same worker lane, so per-chat order is kept
+                key=key,
+                deliver_batch=deliver_batch if batching else None,
+                restore=restore,
+                **queue_options
+            )
+        await self.queue.start()
+        self._handoff = deque(self._handoff, maxlen=self.queue.maxsize)
+        if self.outbox is not None:
+            await self.outbox.start(self._dispatch_entry)
+
+    async def stop(self, timeout: float) -> None:
+        if self._feed_task is not None:
+            self._feed_task.cancel()
+            await asyncio.gather(self._feed_task, return_exceptions=True)
+            self._feed_task = None
+        if self._handoff:
+            logger.warning(f"{len(self._handoff)} payload(s) for '{self.name}' never reached its queue before shutdown.")
+            self._handoff.clear()
+        if self._pending_task is not None:
+            self._pending_task.cancel()
+        if self._pending:
+            logger.warning(f"{len(self._pending)} deferred payload(s) for '{self.name}' not delivered at shutdown.")
+        if self.queue is not None:
+            await self.queue.stop(timeout=timeout)
+            self.queue = None
+        if self.outbox is not None:
+            await self.outbox.close()
+            self.outbox = None
+
+    async def submit(self, envelope: Envelope) -> None:
+        """
+        Hands a payload to this destination (outbox, queue, or inline if not
+        started). Never waits for room in the queue, so a stalled destination
+        cannot hold up the caller or the other destinations.
+        """
+        if self.outbox is not None:
+            self.outbox.append(envelope, envelope.encode(FORMAT_JSON).decode("utf-8"))
+        elif self.queue is not None and self.queue.running:
+            self._hand_off(envelope)
+        else:
+            await self.post([envelope])
+
+    def _hand_off(self, envelope: Envelope) -> None:
+        # Straight into the queue while nothing is waiting ahead of it
+        if not self._handoff and self._feeding is None and self.queue.offer(envelope):
+            return
+        if len(self._handoff) == self._handoff.maxlen:
+            self.handoff_counters["dropped"] += 1
+            logger.warning(f"Hand-off buffer for '{self.name}' full. Dropped oldest payload.")
+        self._handoff.append(envelope)
+        self.handoff_counters["queued"] += 1
+        if self._feed_task is None or self._feed_task.done():
+            self._feed_task = asyncio.create_task(self._feed_queue(), name=f"{self.name}-handoff")
+
+    async def _feed_queue(self) -> None:
+        try:
+            while self._handoff and self.queue is not None:
+                self._feeding = self._handoff.popleft()
+                # The destination's overflow policy applies here: 'block' waits in this task only
+                await self.queue.put(self._feeding)
+                self._feeding = None
+        finally:
+            self._feeding = None
+
+    def _adopt(self, payload: Dict[str, Any]) -> None:
+        # Spilled before the outbox was enabled: make it an outbox entry
+        self.outbox.append(as_envelope(payload))
+
+    def _dispatch_entry(self, entry: OutboxEntry) -> bool:
+        # Leased rows come back from SQLite as plain dicts
+        entry.payload = as_envelope(entry.payload)
+        return self.queue is not None and self.queue.offer(entry)
+
+    def _hold_pending(self, payloads: list) -> None:
+        for payload in payloads:
+            if len(self._pending) == self._pending.maxlen:
+                self.pending_counters["dropped"] += 1
+            self._pending.append(payload)
+            self.pending_counters["held"] += 1
+        if self._pending_task is None or self._pending_task.done():
+            self._pending_task = asyncio.create_task(self._release_pending())
+
+    async def _release_pending(self) -> None:
+        while self._pending:
+            await asyncio.sleep(max(self.guard.breaker.retry_in(), 0.5))
+            if self.queue is None or not self.queue.running:
+                return
+            # Sent from here, oldest first: payloads the workers get meanwhile
+            # are held behind these (see _deliver_payload), so no chat's
+            # newer messages overtake its deferred ones
+            batching = self.queue.batching
+            while self._pending:
+                count = self.queue.batch_size if batching else 1
+                self._releasing = [self._pending.popleft() for _ in range(min(count, len(self._pending)))]
+                try:
+                    result = await self.post([as_envelope(p) for p in self._releasing], batch=batching)
+                finally:
+                    releasing, self._releasing = self._releasing, []
+                if result == DEFERRED:
+                    for payload in reversed(releasing):
+                        if len(self._pending) == self._pending.maxlen:
+                            self.pending_counters["dropped"] += 1
+                        self._pending.appendleft(payload)
+                    break
+                self.pending_counters["released"] += len(releasing)
+
+    def _behind_pending(self, payloads: list) -> bool:
+        # Deferred payloads go first: hold these behind them
+        if not (self._pending or self._releasing):
+            return False
+        self._hold_pending(payloads)
+        return True
+
+    async def _deliver_payload(self, payload: Dict[str, Any]) -> bool:
+        if self._behind_pending([payload]):
+            return False
+        result = await self.post([as_envelope(payload)])
+        if result == DEFERRED:
+            self._hold_pending([payload])
+        return result == DELIVERED
+
+    async def _deliver_payloads(self, batch: list) -> bool:
+        if self._behind_pending(batch):
+            return False
+        result = await self.post([as_envelope(p) for p in batch], batch=True)
+        if result == DEFERRED:
+            self._hold_pending(batch)
+        return result == DELIVERED
+
+    def _settle_entry(self, entry: OutboxEntry, result: str) -> None:
+        if result == DEFERRED:
+            # Not an attempt: keep it pending until the circuit is due to half-open
+            self.outbox.defer(entry, self.guard.retry_at())
+        else:
+            self.outbox.settle(entry, result == DELIVERED)
+
+    async def _deliver_entry(self, entry: OutboxEntry) -> bool:
+        result = await self.post([as_envelope(entry.payload)])
+        self._settle_entry(entry, result)
+        return result == DELIVERED
+
+    async def _deliver_entries(self, entries: list) -> bool:
+        result = await self.post([as_envelope(entry.payload) for entry in entries], batch=True)
+        for entry in entries:
+            self._settle_entry(entry, result)
+        return result == DELIVERED
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"url": self.url, "format": self.format, "filtered": self.rules is not None}
+        stats.update(self.guard.stats())
+        if self.outbox is None:
+            stats.update({f"deferred_{k}": v for k, v in self.pending_counters.items()})
+            stats["deferred_pending"] = len(self._pending)
+            stats.update({f"handoff_{k}": v for k, v in self.handoff_counters.items()})
+            stats["handoff_depth"] = len(self._handoff)
+        return stats
+
+# --- Loading ---
+
+def derived_path(path: Optional[str], name: str) -> Optional[str]:
+    """'data/outbox.db' -> 'data/outbox.<name>.db', so destinations never share a file."""
+    if not path:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+def load_destinations(
+    path: str,
+    get_client: Callable[[], Awaitable[httpx.AsyncClient]],
+    make_guard: Callable[[str, Dict[str, Any]], DestinationGuard],
+    outbox_path: Optional[str],
+    spill_path: Optional[str],
+    pending_max: int
+) -> List[Destination]:
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+
+    destinations = []
+    for i, item in enumerate(spec.get("destinations", [])):
+        name = item.get("name") or f"destination-{i}"
+        if not item.get("url"):
+            raise ValueError(f"{name}: url is required")
+        if any(d.name == name for d in destinations):
+            raise ValueError(f"{name}: duplicate destination name")
+        headers = {k: os.path.expandvars(str(v)) for k, v in (item.get("headers") or {}).items()}
+        destinations.append(Destination(
+            name,
+            item["url"],
+            headers=headers,
+            format=item.get("format", FORMAT_JSON),
+            batch_url=item.get("batch_url"),
+            rules=RuleSet(item["rules"]) if item.get("rules") else None,
+            guard=make_guard(name, item),
+            outbox_path=item.get("outbox_path") or derived_path(outbox_path, name),
+            spill_path=derived_path(spill_path, name),
+            pending_max=pending_max,
+            get_client=get_client
+        ))
+    if not destinations:
+        raise ValueError("no destinations configured")
+    return destinations
@@ -0,0 +1,401 @@
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+from telethon import events, types
+from telethon.utils import get_peer_id
+from .client import client
+from .cache import CACHE_MAX_STALE_S, cache_entity, get_cached_entity, seed_mute_statuses
+from .search import get_search_index
+from .utils import get_mute_until
+
+logger = logging.getLogger("telegram_dialogs")
+
+# Dialogs fetched when the index is first needed and not seeded yet
+DIALOGS_SEED_LIMIT = int(os.getenv("TELEGRAM_DIALOGS_SEED_LIMIT", "200"))
+# Full refetch as a safety net for updates missed while disconnected (0 = never)
+DIALOGS_RESYNC_S = float(os.getenv("TELEGRAM_DIALOGS_RESYNC_S", "1800"))
+# Dialogs per incremental fetch past the indexed prefix (100 = one GetDialogs request)
+DIALOGS_EXTEND_LIMIT = 100
+
+class DialogEntry:
+    """
+    One dialog in the index. Mirrors the parts of telethon's Dialog the
+    tools use (entity, unread_count, is_user/is_group/is_channel).
+    """
+    __slots__ = ("peer_id", "entity", "date", "pinned", "pin_rank", "unread_count", "unread_mark", "mute_until", "key")
+
+    def __init__(self, peer_id: int, entity: Any, date: float, pinned: bool = False, pin_rank: int = 0,
+                 unread_count: int = 0, unread_mark: bool = False, mute_until: float = 0.0):
+        self.peer_id = peer_id
+        self.entity = entity
+        self.date = date
+        self.pinned = pinned
+        self.pin_rank = pin_rank
+        self.unread_count = unread_count
+        self.unread_mark = unread_mark
+        self.mute_until = mute_until
+        self.key: Tuple = ()
+
+    @property
+    def is_user(self) -> bool:
+        return isinstance(self.entity, types.User)
+
+    @property
+    def is_group(self) -> bool:
+        return isinstance(self.entity, types.Chat) or bool(getattr(self.entity, "megagroup", False))
+
+    @property
+    def is_channel(self) -> bool:
+        return isinstance(self.entity, types.Channel)
+
+    @property
+    def is_unread(self) -> bool:
+        return self.unread_count > 0 or self.unread_mark
+
+    def sort_key(self) -> Tuple:
+        # Pinned dialogs first in pin order, then most recent activity first
+        if self.pinned:
+            return (0, self.pin_rank, self.peer_id)
+        return (1, -self.date, self.peer_id)
+
+def _timestamp(date) -> float:
+    return date.timestamp() if date else 0.0
+
+def _cursor(dialogs: list) -> Optional[Tuple[Any, int, Any]]:
+    """
+    (offset_date, offset_id, offset_peer) continuing after the last of a
+    get_dialogs result, computed the way telethon's own dialog iterator does.
+    """
+    if not dialogs:
+        return None
+    last = dialogs[-1]
+    message = getattr(last, "message", None)
+    return (
+        message.date if message else None,
+        message.id if message else 0,
+        getattr(last, "input_entity", None)
+    )
+
+class DialogIndex:
+    """
+    In-memory dialog list, seeded once from get_dialogs and then patched from
+    the update stream: new messages move their dialog to the top, read
+    updates set unread counts, pin updates reorder.
+
+    Entries are kept in a list sorted by `DialogEntry.sort_key()`, so a page
+    is a plain slice. `complete` is False while only a prefix of the list has
+    been fetched; `cursor` is where the next get_dialogs call continues, so
+    the index can be extended one page at a time instead of refetched.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, DialogEntry] = {}
+        self._order: List[Tuple] = []
+        self.seeded_at = 0.0
+        self.complete = False
+        self.cursor: Optional[Tuple[Any, int, Any]] = None
+        self.counters: Dict[str, int] = {"seeds": 0, "extends": 0, "new_messages": 0, "read_updates": 0, "created": 0}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    @property
+    def seeded(self) -> bool:
+        return self.seeded_at > 0
+
+    def get(self, peer_id: int) -> Optional[DialogEntry]:
+        return self._entries.get(peer_id)
+
+    def page(self, start: int, end: int) -> List[DialogEntry]:
+        return [self._entries[key[-1]] for key in self._order[start:end]]
+
+    def unread(self, limit: int) -> List[DialogEntry]:
+        found = []
+        for key in self._order:
+            entry = self._entries[key[-1]]
+            if entry.is_unread:
+                found.append(entry)
+                if len(found) >= limit:
+                    break
+        return found
+
+    # --- Writes ---
+
+    def _place(self, entry: DialogEntry) -> None:
+        if entry.key:
+            i = bisect_left(self._order, entry.key)
+            if i < len(self._order) and self._order[i] == entry.key:
+                del self._order[i]
+        entry.key = entry.sort_key()
+        insort(self._order, entry.key)
+
+    def _read(self, dialogs: list, entries: Dict[int, DialogEntry]) -> float:
+        """
+        Adds a get_dialogs result (telethon Dialog objects) to `entries`,
+        keeping current entries that updates have moved past the snapshot.
+        Returns the newest dialog date seen.
+        """
+        newest = 0.0
+        pin_rank = 0
+        for dialog in dialogs:
+            entity = getattr(dialog, "entity", None)
+            if entity is None:
+                continue
+            peer_id = get_peer_id(entity)
+            date = _timestamp(getattr(dialog, "date", None))
+            newest = max(newest, date)
+            current = self._entries.get(peer_id)
+            if current is not None and current.date > date:
+                entries[peer_id] = current
+                continue
+            tl_dialog = getattr(dialog, "dialog", None)
+            pinned = bool(getattr(dialog, "pinned", False))
+            entries[peer_id] = DialogEntry(
+                peer_id,
+                entity,
+                date,
+                pinned=pinned,
+                pin_rank=pin_rank,
+                unread_count=getattr(dialog, "unread_count", 0) or 0,
+                unread_mark=bool(getattr(tl_dialog, "unread_mark", False)),
+                mute_until=get_mute_until(getattr(tl_dialog, "notify_settings", None))
+            )
+            if pinned:
+                pin_rank += 1
+            cache_entity(entity.id, entity)
+            get_search_index().add(entity, dialog=True)
+        return newest
+
+    def seed(self, dialogs: list, complete: bool) -> int:
+        """Replaces the index with a get_dialogs result fetched from the top of the list."""
+        entries: Dict[int, DialogEntry] = {}
+        newest = self._read(dialogs, entries)
+
+        # Dialogs missing from the snapshot stay only if an update arrived after it was taken
+        dropped = []
+        for peer_id, entry in self._entries.items():
+            if peer_id not in entries:
+                if entry.date > newest:
+                    entries[peer_id] = entry
+                else:
+                    dropped.append(peer_id)
+        get_search_index().remove_dialogs(dropped)
+
+        self._entries = entries
+        for entry in entries.values():
+            entry.key = entry.sort_key()
+        self._order = sorted(entry.key for entry in entries.values())
+        self.complete = complete
+        self.cursor = _cursor(dialogs)
+        self.seeded_at = time.time()
+        self.counters["seeds"] += 1
+        return len(entries)
+
+    def extend(self, dialogs: list, complete: bool) -> int:
+        """
+        Appends a get_dialogs result fetched from `cursor` (the next page of
+        the list). Returns how many dialogs were new to the index.
+        """
+        entries: Dict[int, DialogEntry] = {}
+        self._read(dialogs, entries)
+        added = 0
+        for peer_id, entry in entries.items():
+            current = self._entries.get(peer_id)
+            if current is entry:
+                continue
+            if current is not None:
+                # Lets _place() drop the replaced entry's position
+                entry.key = current.key
+            else:
+                added += 1
+            self._entries[peer_id] = entry
+            self._place(entry)
+        self.complete = complete
+        self.cursor = _cursor(dialogs) or self.cursor
+        self.counters["extends"] += 1
+        return added
+
+    def on_message(self, peer_id: int, entity: Any, date: float, out: bool) -> None:
+        entry = self._entries.get(peer_id)
+        if entry is None:
+            if entity is None:
+                return
+            entry = DialogEntry(peer_id, entity, date)
+            self._entries[peer_id] = entry
+            self.counters["created"] += 1
+        elif entity is not None:
+            entry.entity = entity
+        if entity is not None:
+            get_search_index().add(entity, dialog=True)
+        self.counters["new_messages"] += 1
+
+        if out:
+            # Sending marks the chat as read
+            entry.unread_count = 0
+            entry.unread_mark = False
+        else:
+            entry.unread_count += 1
+        if date >= entry.date:
+            entry.date = date
+            if not entry.pinned:
+                self._place(entry)
+
+    def on_read(self, peer_id: int, still_unread: int) -> None:
+        entry = self._entries.get(peer_id)
+        if entry is not None:
+            entry.unread_count = still_unread
+            entry.unread_mark = False
+            self.counters["read_updates"] += 1
+
+    def on_unread_mark(self, peer_id: int, unread: bool) -> None:
+        entry = self._entries.get(peer_id)
+        if entry is not None:
+            entry.unread_mark = unread
+
+    def on_notify_settings(self, peer_id: int, mute_until: float) -> None:
+        entry = self._entries.get(peer_id)
+        if entry is not None:
+            entry.mute_until = mute_until
+
+    def on_pinned(self, peer_id: int, pinned: bool) -> None:
+        entry = self._entries.get(peer_id)
+        if entry is None or entry.pinned == pinned:
+            return
+        entry.pinned = pinned
+        if pinned:
+            # Newly pinned dialogs go on top of the pinned ones
+            entry.pin_rank = min((e.pin_rank for e in self._entries.values() if e.pinned and e is not entry), default=1) - 1
+        self._place(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dialogs": len(self),
+            "complete": self.complete,
+            "seeded_ago_s": round(time.time() - self.seeded_at) if self.seeded else None,
+            **self.counters
+        }
+
+_INDEX = DialogIndex()
+_SEED_LOCK: Optional[asyncio.Lock] = None
+_RESYNC: Optional[asyncio.Task] = None
+
+def get_dialog_stats() -> Dict[str, Any]:
+    return _INDEX.stats()
+
+def seed_dialog_index(dialogs: list, complete: bool) -> int:
+    """Seeds the index from dialogs fetched elsewhere (e.g. the startup mute seed)."""
+    return _INDEX.seed(dialogs, complete)
+
+def _covers(min_count: int) -> bool:
+    return _INDEX.seeded and (_INDEX.complete or len(_INDEX) >= min_count)
+
+async def _seed(limit: int, min_count: Optional[int] = None) -> None:
+    """
+    Fetches the first `limit` dialogs into the index or, when given
+    `min_count`, makes the index cover that many: an index that already has
+    a prefix is extended page by page from its cursor instead of refetched.
+    """
+    global _SEED_LOCK
+    if _SEED_LOCK is None:
+        _SEED_LOCK = asyncio.Lock()
+    async with _SEED_LOCK:
+        if min_count is not None and _INDEX.seeded and _INDEX.cursor is not None:
+            while not _covers(min_count):
+                await _extend()
+            return
+        if min_count is not None and _covers(min_count):
+            # Seeded by the caller we waited on
+            return
+        logger.debug(f"Seeding dialog index (limit={limit})...")
+        dialogs = await client.get_dialogs(limit=limit)
+        _INDEX.seed(dialogs, complete=len(dialogs) < limit)
+        seed_mute_statuses(dialogs)
+
+async def _extend() -> None:
+    """Fetches the next page of the dialog list after the index's cursor (one request)."""
+    cursor = _INDEX.cursor
+    offset_date, offset_id, offset_peer = cursor
+    logger.debug(f"Extending dialog index past {len(_INDEX)} dialogs...")
+    dialogs = await client.get_dialogs(
+        limit=DIALOGS_EXTEND_LIMIT,
+        offset_date=offset_date,
+        offset_id=offset_id,
+        offset_peer=offset_peer
+    )
+    _INDEX.extend(dialogs, complete=len(dialogs) < DIALOGS_EXTEND_LIMIT)
+    seed_mute_statuses(dialogs)
+    if _INDEX.cursor == cursor:
+        # The cursor did not move (should not happen); stop rather than loop
+        _INDEX.complete = True
+
+def _resync_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Background dialog resync failed: {task.exception()}")
+
+async def get_dialog_index(min_count: int = 0) -> DialogIndex:
+    """
+    Returns the dialog index, seeding it first if it was never seeded or
+    holds fewer than `min_count` dialogs of an incomplete list.
+
+    A resync that is due runs in the background while the current index is
+    served; callers only wait for it once the index is older than
+    DIALOGS_RESYNC_S + CACHE_MAX_STALE_S (e.g. resyncs keep failing).
+    """
+    global _RESYNC
+    age = time.time() - _INDEX.seeded_at
+    if not _covers(min_count):
+        await _seed(max(DIALOGS_SEED_LIMIT, min_count + 20), min_count)
+    elif DIALOGS_RESYNC_S and age > DIALOGS_RESYNC_S:
+        if _RESYNC is None or _RESYNC.done():
+            _RESYNC = asyncio.create_task(_seed(max(DIALOGS_SEED_LIMIT, len(_INDEX))))
+            _RESYNC.add_done_callback(_resync_done)
+        if age > DIALOGS_RESYNC_S + CACHE_MAX_STALE_S:
+            await asyncio.shield(_RESYNC)
+    return _INDEX
+
+# --- Update handlers ---
+
+async def handle_dialog_message(event):
+    """Moves the dialog of every new message (incoming or outgoing) to the top."""
+    try:
+        message = event.message
+        peer_id = get_peer_id(message.peer_id)
+        entity = event.chat
+        if entity is None or getattr(entity, "min", False):
+            entity = get_cached_entity(peer_id)
+        if entity is None and _INDEX.get(peer_id) is None:
+            # A dialog we have not seen yet; usually served from Telethon's entity cache
+            entity = await event.get_chat()
+        _INDEX.on_message(peer_id, entity, _timestamp(message.date), bool(message.out))
+    except Exception as e:
+        logger.error(f"Error updating dialog index: {e}")
+
+async def handle_dialog_update(update):
+    """Applies read, unread-mark, pin and notify settings updates to the index."""
+    try:
+        if isinstance(update, types.UpdateReadHistoryInbox):
+            _INDEX.on_read(get_peer_id(update.peer), update.still_unread_count)
+        elif isinstance(update, types.UpdateReadChannelInbox):
+            _INDEX.on_read(get_peer_id(types.PeerChannel(update.channel_id)), update.still_unread_count)
+        elif isinstance(update, types.UpdateDialogUnreadMark) and isinstance(update.peer, types.DialogPeer):
+            _INDEX.on_unread_mark(get_peer_id(update.peer.peer), update.unread)
+        elif isinstance(update, types.UpdateDialogPinned) and isinstance(update.peer, types.DialogPeer):
+            _INDEX.on_pinned(get_peer_id(update.peer.peer), update.pinned)
+        elif isinstance(update, types.UpdateNotifySettings) and isinstance(update.peer, types.NotifyPeer):
+            _INDEX.on_notify_settings(get_peer_id(update.peer.peer), get_mute_until(update.notify_settings))
+    except Exception as e:
+        logger.error(f"Error applying dialog update: {e}")
+
+def setup_dialog_index(client) -> None:
+    """Registers the handlers that keep the dialog index current."""
+    client.add_event_handler(handle_dialog_message, events.NewMessage())
+    client.add_event_handler(handle_dialog_update, events.Raw((
+        types.UpdateReadHistoryInbox,
+        types.UpdateReadChannelInbox,
+        types.UpdateDialogUnreadMark,
+        types.UpdateDialogPinned,
+        types.UpdateNotifySettings
+    )))
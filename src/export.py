@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageService
+from telethon.utils import get_peer_id
+from .client import client
+from .cache import get_or_fetch_entity
+from .messagestore import get_message_store
+from .resilience import TokenBucket
+from .utils import entity_name
+
+# Parquet output is optional (pip install pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger("telegram_export")
+
+# Chat history export (export_chat_history, python -m src.export)
+EXPORT_DIR = os.getenv("TELEGRAM_EXPORT_DIR", "data/exports")
+# Rows per checkpoint (and per Parquet part file); bounds the memory an export uses
+EXPORT_BATCH = int(os.getenv("TELEGRAM_EXPORT_BATCH", "10000"))
+# History requests per second, shared by all running exports
+EXPORT_RATE = float(os.getenv("TELEGRAM_EXPORT_RATE", "2"))
+EXPORT_BURST = int(os.getenv("TELEGRAM_EXPORT_BURST", "5"))
+
+FORMATS = ("jsonl", "parquet")
+# Messages per history request iter_messages makes (Telegram's maximum)
+_REQUEST_SIZE = 100
+
+def to_row(message: Any) -> Dict[str, Any]:
+    """The exported columns of a telethon Message."""
+    media = None
+    if getattr(message, "media", None) is not None:
+        media = "photo" if message.photo else "document" if message.document else "other"
+    reply_to = getattr(message, "reply_to", None)
+    return {
+        "id": message.id,
+        "date": message.date,
+        "edit_date": getattr(message, "edit_date", None),
+        "sender_id": getattr(message, "sender_id", None),
+        "reply_to": getattr(reply_to, "reply_to_msg_id", None),
+        "text": getattr(message, "message", None) or "",
+        "media": media,
+        "views": getattr(message, "views", None),
+        "forwards": getattr(message, "forwards", None),
+        "grouped_id": getattr(message, "grouped_id", None),
+    }
+
+def _json_default(value: Any) -> Any:
+    # Dates as ISO 8601
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+class _JsonlSink:
+    """
+    Appends rows to one JSONL file. The checkpoint records the file's size
+    after each committed batch; a resume truncates anything written past it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def open(self, checkpoint: Dict[str, Any]) -> None:
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "wb")
+        self._file.truncate(checkpoint.get("size", 0))
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._file.write("".join(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows).encode())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"size": self._file.tell()}
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class _ParquetSink:
+    """
+    Writes each batch as a part file of a Parquet dataset directory (Parquet
+    files cannot be appended to). Parts past the checkpoint's count are
+    left-overs of an interrupted batch and are removed on resume.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._parts = 0
+        self._schema = pa.schema([
+            ("id", pa.int64()),
+            ("date", pa.timestamp("s", tz="UTC")),
+            ("edit_date", pa.timestamp("s", tz="UTC")),
+            ("sender_id", pa.int64()),
+            ("reply_to", pa.int64()),
+            ("text", pa.string()),
+            ("media", pa.string()),
+            ("views", pa.int64()),
+            ("forwards", pa.int64()),
+            ("grouped_id", pa.int64()),
+        ])
+
+    def _part(self, index: int) -> str:
+        return os.path.join(self.path, f"part-{index:05d}.parquet")
+
+    def open(self, checkpoint: Dict[str, Any]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._parts = checkpoint.get("parts", 0)
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and int(name[5:10]) >= self._parts:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        table = pa.Table.from_pylist(rows, schema=self._schema)
+        part = self._part(self._parts)
+        pq.write_table(table, part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self._parts += 1
+        return {"parts": self._parts}
+
+    def close(self) -> None:
+        pass
+
+class ExportBudget:
+    """
+    History requests shared by all running exports: a token bucket, and a
+    pause for all of them when any one hits a FloodWait longer than the
+    client sleeps through by itself.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self._resume_at = 0.0
+        self.counters: Dict[str, Any] = {"requests": 0, "flood_waits": 0, "flood_wait_s": 0}
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self.bucket.acquire()
+        self.counters["requests"] += 1
+
+    def flood_wait(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self.counters["flood_waits"] += 1
+        self.counters["flood_wait_s"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, **self.bucket.stats()}
+
+class ChatExport:
+    """
+    Streams one chat's history, oldest first, into `path` in batches of
+    EXPORT_BATCH rows. After every batch a checkpoint (`path` +
+    ".checkpoint.json") records the last exported message ID, so an
+    interrupted export resumes where it stopped and a finished one, run
+    again, appends only newer messages. Service messages (joins, pins, ...)
+    are skipped.
+    """
+
+    def __init__(self, entity: Any, file_format: str, directory: str, budget: ExportBudget):
+        self.entity = entity
+        self.peer_id = get_peer_id(entity)
+        self.name = entity_name(entity)
+        self.file_format = file_format
+        self.path = os.path.join(directory, f"{self.peer_id}.{file_format}")
+        self.checkpoint_path = self.path + ".checkpoint.json"
+        self.budget = budget
+        self.status = "pending"
+        self.last_id = 0
+        self.count = 0
+        self.exported = 0
+        # Where the committed rows end in the output (file size or part count)
+        self._position: Dict[str, Any] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _commit(self, sink: Any, rows: List[Dict[str, Any]], last_id: int) -> None:
+        if rows:
+            self._position = sink.write(rows)
+        self.count += len(rows)
+        self.last_id = last_id
+        checkpoint = {"chat_id": self.peer_id, "format": self.file_format, "last_id": last_id, "count": self.count, **self._position}
+        with open(self.checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    async def _messages(self, min_id: int):
+        # One budget token per history request iter_messages will make
+        await self.budget.acquire()
+        seen = 0
+        async for message in client.iter_messages(self.entity, reverse=True, min_id=min_id, wait_time=0):
+            yield message
+            seen += 1
+            if seen % _REQUEST_SIZE == 0:
+                await self.budget.acquire()
+
+    async def run(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        checkpoint = self._load_checkpoint()
+        sink = _ParquetSink(self.path) if self.file_format == "parquet" else _JsonlSink(self.path)
+        await asyncio.to_thread(sink.open, checkpoint)
+        self.last_id = checkpoint.get("last_id", 0)
+        self.count = checkpoint.get("count", 0)
+        self._position = {k: checkpoint[k] for k in ("size", "parts") if k in checkpoint}
+        self.status = "running"
+        store = get_message_store()
+        rows: List[Dict[str, Any]] = []
+        last_id = self.last_id
+        try:
+            while True:
+                try:
+                    async for message in self._messages(last_id):
+                        last_id = message.id
+                        if isinstance(message, MessageService):
+                            continue
+                        rows.append(to_row(message))
+                        if store is not None:
+                            store.add(message)
+                        if len(rows) >= EXPORT_BATCH:
+                            await asyncio.to_thread(self._commit, sink, rows, last_id)
+                            self.exported += len(rows)
+                            rows = []
+                    break
+                except FloodWaitError as e:
+                    # Every export waits it out; this one then continues after last_id
+                    logger.warning(f"Export of {self.peer_id} hit a {e.seconds}s FloodWait.")
+                    self.budget.flood_wait(e.seconds)
+            await asyncio.to_thread(self._commit, sink, rows, last_id)
+            self.exported += len(rows)
+            self.status = "done"
+        except asyncio.CancelledError:
+            # Keep what was read; the next run resumes after it
+            await asyncio.to_thread(self._commit, sink, rows, last_id)
+            self.exported += len(rows)
+            self.status = "stopped"
+            raise
+        except Exception as e:
+            self.status = f"failed: {e}"
+            logger.error(f"Export of {self.peer_id} failed: {e}", exc_info=True)
+        finally:
+            await asyncio.to_thread(sink.close)
+
+    def describe(self) -> str:
+        return (
+            f"{self.name} ({self.peer_id}) -> {self.path}: {self.status}, {self.exported} messages this run, "
+            f"{self.count} in total, last message ID {self.last_id}"
+        )
+
+_BUDGET = ExportBudget(EXPORT_RATE, EXPORT_BURST)
+_EXPORTS: Dict[Tuple[int, str], ChatExport] = {}
+
+def get_export_budget() -> ExportBudget:
+    return _BUDGET
+
+def start_export(entity: Any, file_format: str = "jsonl", directory: str = EXPORT_DIR, update: bool = False) -> ChatExport:
+    """
+    Starts exporting a chat in the background, or returns its export if one
+    is running, or finished and `update` is not set. Failed and stopped
+    exports are started again (from their checkpoint).
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format '{file_format}' (expected one of: {', '.join(FORMATS)}).")
+    if file_format == "parquet" and pq is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow).")
+    key = (get_peer_id(entity), file_format)
+    export = _EXPORTS.get(key)
+    if export is not None and export.task and (not export.task.done() or (export.status == "done" and not update)):
+        return export
+    export = _EXPORTS[key] = ChatExport(entity, file_format, directory, _BUDGET)
+    export.task = asyncio.create_task(export.run(), name=f"export-{key[0]}")
+    return export
+
+async def stop_exports() -> None:
+    """Stops running exports after checkpointing them. Called from server_lifespan."""
+    tasks = [e.task for e in _EXPORTS.values() if e.task and not e.task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _main(chats: List[str], file_format: str, directory: str) -> int:
+    await client.connect()
+    try:
+        exports = []
+        for chat in chats:
+            entity = await get_or_fetch_entity(int(chat) if chat.lstrip("-").isdigit() else chat)
+            exports.append(start_export(entity, file_format, directory))
+        tasks = [export.task for export in exports]
+        while not all(task.done() for task in tasks):
+            await asyncio.wait(tasks, timeout=10)
+            for export in exports:
+                logger.info(export.describe())
+        logger.info(f"Request budget: {_BUDGET.stats()}")
+        return sum(export.status != "done" for export in exports)
+    finally:
+        await client.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export chats' full history (resumable).")
+    parser.add_argument("chats", nargs="+", help="chat IDs or usernames; several are exported concurrently")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--dir", default=EXPORT_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    sys.exit(1 if asyncio.run(_main(args.chats, args.format, args.dir)) else 0)
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from typing import Iterable
+from .cache import get_cached_entity, get_cached_sender_name
+from .history import MessageRecord
+from .messagestore import MessageHit
+from .utils import entity_name
+
+def sender_name(record: MessageRecord) -> str:
+    if record.sender_id is None:
+        return "Unknown"
+    return get_cached_sender_name(record.sender_id) or "Unknown"
+
+def _date(record: MessageRecord) -> str:
+    # Same text as telethon's aware datetimes (e.g. 2024-05-01 12:00:00+00:00)
+    return str(datetime.fromtimestamp(record.date, timezone.utc)) if record.date else "None"
+
+def format_message(record: MessageRecord) -> str:
+    """One get_messages line."""
+    reply_info = f" | reply to {record.reply_to}" if record.reply_to else ""
+    return f"ID: {record.id} | {sender_name(record)} | Date: {_date(record)}{reply_info} | Message: {record.text}"
+
+def format_messages(records: Iterable[MessageRecord]) -> str:
+    return "\n".join(format_message(record) for record in records)
+
+def format_context_line(record: MessageRecord, target: bool = False) -> str:
+    """One get_message_context line; media-only messages show as <media>."""
+    line = f"[{record.id}] {record.text or '<media>'}"
+    return f"-> {line} (TARGET)" if target else line
+
+def format_search_hit(hit: MessageHit) -> str:
+    """One search_messages line; names come from the caches, never the network."""
+    chat = get_cached_entity(hit.peer_id)
+    chat_name = entity_name(chat) if chat is not None else "Unknown"
+    sender = get_cached_sender_name(hit.sender_id) if hit.sender_id is not None else None
+    date = datetime.fromtimestamp(hit.date, timezone.utc) if hit.date else None
+    return (
+        f"Chat: {chat_name} ({hit.peer_id}) | ID: {hit.message_id} | {sender or 'Unknown'} "
+        f"| Date: {date} | {hit.snippet}"
+    )
@@ -1,12 +1,29 @@
 import os
 import logging
 import httpx
-import time
 import asyncio
-from telethon import events, functions
+import importlib.util
+from typing import Any, Dict, List, Optional
+from telethon import events, functions, types
+from telethon.utils import get_peer_id
 from dotenv import load_dotenv
 from telethon.tl.types import PeerNotifySettings
-from .cache import get_cached_mute_status, set_cached_mute_status
+from .cache import (
+    get_cached_mute_status,
+    set_cached_mute_status,
+    seed_mute_statuses,
+    get_cached_entity,
+    cache_entity
+)
+from .utils import get_mute_until, is_mute_active
+from .dialogs import seed_dialog_index
+from .history import setup_message_windows
+from .delivery import DeliveryQueue
+from .outbox import Outbox
+from .rules import get_ruleset, peer_chat_type
+from .dedupe import MessageDeduper
+from .resilience import DestinationGuard
+from .destinations import DELIVERED, Destination, Envelope, as_envelope, load_destinations
 
 load_dotenv()
 logger = logging.getLogger("telegram_forwarder")
@@ -15,101 +32,415 @@ logger = logging.getLogger("telegram_forwarder")
 WEBHOOK_URL = "https://poke.com/api/v1/inbound-sms/webhook"
 POKE_API_KEY = os.getenv("POKE_API_KEY")
 
-async def forward_to_poke(message_data: dict):
-    if not POKE_API_KEY:
-        logger.warning("POKE_API_KEY not set. Cannot forward message.")
-        return
+# HTTP client pool (shared by all forwarded messages)
+HTTP_MAX_CONNECTIONS = int(os.getenv("FORWARD_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("FORWARD_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("FORWARD_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("FORWARD_HTTP2", "false").lower() in ("1", "true", "yes")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("FORWARD_HTTP_CONNECT_TIMEOUT", "3.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("FORWARD_HTTP_READ_TIMEOUT", "5.0"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("FORWARD_HTTP_WRITE_TIMEOUT", "5.0"))
+HTTP_POOL_TIMEOUT = float(os.getenv("FORWARD_HTTP_POOL_TIMEOUT", "2.0"))
 
-    target_url = os.getenv("POKE_WEBHOOK_URL", WEBHOOK_URL)
-    
-    headers = {
-        "Authorization": f"Bearer {POKE_API_KEY}",
-        "Content-Type": "application/json"
+# Delivery queue (decouples the event handler from webhook latency)
+QUEUE_MAXSIZE = int(os.getenv("FORWARD_QUEUE_MAXSIZE", "1000"))
+QUEUE_WORKERS = int(os.getenv("FORWARD_WORKERS", "4"))
+QUEUE_OVERFLOW = os.getenv("FORWARD_OVERFLOW_POLICY", "block").lower()
+QUEUE_SPILL_PATH = os.getenv("FORWARD_SPILL_PATH", "forward_spill.jsonl")
+QUEUE_DRAIN_TIMEOUT = float(os.getenv("FORWARD_DRAIN_TIMEOUT", "10"))
+
+# Micro-batching (opt-in; requires an endpoint that accepts a JSON array)
+BATCH_ENABLED = os.getenv("FORWARD_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+BATCH_WEBHOOK_URL = os.getenv("POKE_BATCH_WEBHOOK_URL")
+BATCH_MAX_SIZE = int(os.getenv("FORWARD_BATCH_MAX_SIZE", "50"))
+BATCH_LINGER_MS = float(os.getenv("FORWARD_BATCH_LINGER_MS", "250"))
+
+# Fan-out to several webhooks (JSON file, see src/destinations.py). Unset = Poke only.
+DESTINATIONS_PATH = os.getenv("FORWARD_DESTINATIONS_PATH")
+
+# Per-destination rate limit and circuit breaker (defaults; overridable per destination)
+RATE_LIMIT = float(os.getenv("FORWARD_RATE_LIMIT", "0"))          # requests/sec, 0 = unlimited
+RATE_BURST = int(os.getenv("FORWARD_RATE_BURST", "10"))
+BREAKER_FAILURES = int(os.getenv("FORWARD_BREAKER_FAILURES", "5"))  # consecutive failures to open
+BREAKER_RESET = float(os.getenv("FORWARD_BREAKER_RESET", "30"))     # seconds before a trial request
+PENDING_MAX = int(os.getenv("FORWARD_PENDING_MAX", "1000"))         # deferred payloads held without an outbox
+
+# Durable outbox (opt-in; survives webhook outages and restarts)
+OUTBOX_PATH = os.getenv("FORWARD_OUTBOX_PATH")
+OUTBOX_COMMIT_MS = float(os.getenv("FORWARD_OUTBOX_COMMIT_MS", "20"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("FORWARD_OUTBOX_BACKOFF_BASE", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("FORWARD_OUTBOX_BACKOFF_MAX", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("FORWARD_OUTBOX_MAX_ATTEMPTS", "0"))
+
+# Dialogs fetched at startup to seed the mute cache (0 = all)
+MUTE_SEED_LIMIT = int(os.getenv("FORWARD_MUTE_SEED_LIMIT", "0"))
+
+# Delay before a batched background lookup of unknown senders/chats
+ENTITY_FILL_DELAY = float(os.getenv("FORWARD_ENTITY_FILL_DELAY", "0.5"))
+
+# Duplicate suppression (redelivered updates after reconnects/catch-up)
+DEDUPE_CAPACITY = int(os.getenv("FORWARD_DEDUPE_CAPACITY", "200000"))
+DEDUPE_WINDOW = float(os.getenv("FORWARD_DEDUPE_WINDOW", "86400"))
+DEDUPE_PATH = os.getenv("FORWARD_DEDUPE_PATH")
+
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+def _build_http_client() -> httpx.AsyncClient:
+    http2 = HTTP2_ENABLED
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("FORWARD_HTTP2 is set but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT
+        )
+    )
+
+async def open_http_client() -> httpx.AsyncClient:
+    """
+    Creates the shared pooled HTTP client used for webhook delivery.
+    Called from server_lifespan on startup; safe to call more than once.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = _build_http_client()
+        logger.debug(f"Opened forwarder HTTP pool (max_connections={HTTP_MAX_CONNECTIONS}, keepalive={HTTP_MAX_KEEPALIVE}).")
+    return _HTTP_CLIENT
+
+async def close_http_client() -> None:
+    """
+    Closes the shared HTTP client and its pooled connections.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+        logger.debug("Closed forwarder HTTP pool.")
+
+# --- Destinations ---
+
+_DESTINATIONS: Optional[List[Destination]] = None
+
+def _make_guard(name: str, overrides: Dict[str, Any]) -> DestinationGuard:
+    return DestinationGuard(
+        name,
+        float(overrides.get("rate_limit", RATE_LIMIT)),
+        int(overrides.get("rate_burst", RATE_BURST)),
+        int(overrides.get("breaker_failures", BREAKER_FAILURES)),
+        float(overrides.get("breaker_reset", BREAKER_RESET))
+    )
+
+def _poke_destination() -> Destination:
+    return Destination(
+        "poke",
+        os.getenv("POKE_WEBHOOK_URL", WEBHOOK_URL),
+        headers={"Authorization": f"Bearer {POKE_API_KEY}"},
+        batch_url=BATCH_WEBHOOK_URL,
+        guard=_make_guard("poke", {}),
+        outbox_path=OUTBOX_PATH,
+        spill_path=QUEUE_SPILL_PATH,
+        pending_max=PENDING_MAX,
+        unavailable=None if POKE_API_KEY else "POKE_API_KEY not set.",
+        get_client=open_http_client
+    )
+
+def get_destinations() -> List[Destination]:
+    """
+    Returns the configured destinations: those in FORWARD_DESTINATIONS_PATH,
+    or just the Poke webhook if no destinations file is set.
+    """
+    global _DESTINATIONS
+    if _DESTINATIONS is None:
+        if DESTINATIONS_PATH:
+            try:
+                _DESTINATIONS = load_destinations(DESTINATIONS_PATH, open_http_client, _make_guard, OUTBOX_PATH, QUEUE_SPILL_PATH, PENDING_MAX)
+                logger.info(f"Loaded {len(_DESTINATIONS)} destination(s) from {DESTINATIONS_PATH}: {', '.join(d.name for d in _DESTINATIONS)}")
+            except Exception as e:
+                # Forward nowhere rather than to a destination nobody configured
+                logger.error(f"Invalid destinations file {DESTINATIONS_PATH}: {e}. Forwarding is disabled.")
+                _DESTINATIONS = []
+        else:
+            _DESTINATIONS = [_poke_destination()]
+    return _DESTINATIONS
+
+def _primary() -> Optional[Destination]:
+    destinations = get_destinations()
+    return destinations[0] if destinations else None
+
+async def forward_to_poke(message_data: dict) -> bool:
+    """
+    POSTs one payload to the primary destination (the Poke webhook unless a
+    destinations file is configured). Returns True on a 2xx/3xx response.
+    """
+    destination = _primary()
+    return destination is not None and await destination.post([as_envelope(message_data)]) == DELIVERED
+
+async def forward_batch_to_poke(batch: list) -> bool:
+    """
+    POSTs several payloads as one JSON array to the primary destination's batch URL.
+    Payloads keep their queue order, so per-chat ordering is preserved.
+    """
+    destination = _primary()
+    return destination is not None and await destination.post([as_envelope(p) for p in batch], batch=True) == DELIVERED
+
+# --- Delivery Queue ---
+
+def get_delivery_queue() -> Optional[DeliveryQueue]:
+    destination = _primary()
+    return destination.queue if destination else None
+
+def get_outbox() -> Optional[Outbox]:
+    destination = _primary()
+    return destination.outbox if destination else None
+
+async def start_delivery() -> None:
+    """
+    Starts a delivery queue (and outbox, if configured) per destination.
+    Called from server_lifespan.
+    """
+    queue_options = {
+        "maxsize": QUEUE_MAXSIZE,
+        "workers": QUEUE_WORKERS,
+        "overflow": QUEUE_OVERFLOW,
+        "batch_size": BATCH_MAX_SIZE,
+        "batch_linger": BATCH_LINGER_MS / 1000
     }
-    
-    # Use non-blocking async client
-    async with httpx.AsyncClient() as http_client:
-        try:
-            logger.debug(f"Forwarding to {target_url}...")
-            response = await http_client.post(
-                target_url, 
-                json=message_data, 
-                headers=headers, 
-                timeout=5.0
-            )
-            if response.is_error:
-                logger.error(f"Poke Webhook Error: {response.status_code} - {response.text}")
-            else:
-                logger.info(f"Forwarded message to Poke (Status: {response.status_code})")
-                
-        except Exception as e:
-            logger.error(f"Failed to forward message to Poke: {e}")
+    outbox_options = {
+        "commit_interval": OUTBOX_COMMIT_MS / 1000,
+        "backoff_base": OUTBOX_BACKOFF_BASE,
+        "backoff_max": OUTBOX_BACKOFF_MAX,
+        "max_attempts": OUTBOX_MAX_ATTEMPTS
+    }
+    for destination in get_destinations():
+        await destination.start(queue_options, outbox_options, batching=BATCH_ENABLED)
+
+async def stop_delivery() -> None:
+    """
+    Drains queued payloads (bounded by FORWARD_DRAIN_TIMEOUT) and stops the workers.
+    Undelivered outbox entries stay on disk and are replayed on the next start.
+    """
+    global _DESTINATIONS
+    if _DESTINATIONS:
+        # Destinations drain side by side, so the timeout is not multiplied
+        await asyncio.gather(*(d.stop(QUEUE_DRAIN_TIMEOUT) for d in _DESTINATIONS))
+    _DESTINATIONS = None
+
+async def enqueue_forward(message_data: dict, destinations: Optional[List[Destination]] = None) -> None:
+    """
+    Hands a payload to every destination (default: all configured ones).
+    The payload is serialized once per body format and shared by all of them.
+    Never waits for room in a destination's queue (see Destination.submit).
+    Falls back to inline delivery if the queues are not running (e.g. no lifespan).
+    """
+    if destinations is None:
+        destinations = get_destinations()
+    envelope = Envelope(message_data)
+    if len(destinations) == 1:
+        await destinations[0].submit(envelope)
+    elif destinations:
+        await asyncio.gather(*(d.submit(envelope) for d in destinations))
 
 # --- Helper ---
 
-async def is_chat_muted(client, peer):
+async def is_chat_muted(client, peer, peer_id: Optional[int] = None):
     """
     Checks if a chat/channel is muted.
-    Uses cache to avoid rate limits.
+    Served from the event-driven mute cache; only peers never seen before
+    (not in the startup dialog seed) cost one GetNotifySettingsRequest.
+    `peer` may be an entity or a raw Peer; pass `peer_id` for the latter.
+    It is resolved to an input peer (from the session) before the request.
     """
+    if peer_id is None:
+        peer_id = getattr(peer, "id", None)
     try:
-        if peer.id:
-            cached = get_cached_mute_status(peer.id)
+        if peer_id:
+            cached = get_cached_mute_status(peer_id)
             if cached is not None:
                 return cached
 
+        # GetNotifySettingsRequest needs an InputNotifyPeer, not a raw Peer
+        try:
+            input_peer = await client.get_input_entity(peer)
+        except Exception as e:
+            logger.warning(f"Could not resolve {peer_id} to check its mute status ({e}). Assuming NOT muted.")
+            return False
+
         # Fetch fresh settings
         # Use GetNotifySettingsRequest as client.get_notify_settings does not exist
         # Add timeout to prevent hanging
         try:
              settings = await asyncio.wait_for(
-                 client(functions.account.GetNotifySettingsRequest(peer=peer)),
+                 client(functions.account.GetNotifySettingsRequest(peer=types.InputNotifyPeer(peer=input_peer))),
                  timeout=5.0
              )
         except asyncio.TimeoutError:
-             logger.warning(f"Timeout checking mute status for {peer.id}. Assuming NOT muted.")
+             logger.warning(f"Timeout checking mute status for {peer_id}. Assuming NOT muted.")
              return False
 
-        is_muted = False
+        mute_until = 0.0
         if isinstance(settings, PeerNotifySettings):
-            logger.debug(f"Notify Settings for {peer.id}: mute_until={settings.mute_until}, silent={getattr(settings, 'silent', 'N/A')}, type={type(settings).__name__}")
-            
-            # Check 'silent' or 'mute_until'
-            # mute_until is a timestamp until which notifications are off.
-            # If it is in the future, it is muted.
-            if settings.mute_until:
-                import datetime
-                # mute_until is usually a future timestamp (int or datetime)
-                # If int, it's a unix timestamp. If datetime, it's TZ aware.
-                # However, Telethon usually returns datetime.datetime
-                # But sometimes it sends a large int for "forever".
-                
-                now = datetime.datetime.now(datetime.timezone.utc)
-                
-                if isinstance(settings.mute_until, int):
-                     # 2147483647 is often used for "Forever"
-                     if settings.mute_until > time.time():
-                         is_muted = True
-                
-                elif hasattr(settings.mute_until, 'timestamp'):
-                    if settings.mute_until > now:
-                        is_muted = True
-            
-            # settings.silent might be true for channels
-            if getattr(settings, 'silent', False):
-                is_muted = True
+            logger.debug(f"Notify Settings for {peer_id}: mute_until={settings.mute_until}, silent={getattr(settings, 'silent', 'N/A')}, type={type(settings).__name__}")
+            mute_until = get_mute_until(settings)
         else:
-             logger.debug(f"Notify Settings for {peer.id}: {settings} (Type: {type(settings).__name__})")
+             logger.debug(f"Notify Settings for {peer_id}: {settings} (Type: {type(settings).__name__})")
 
-        if peer.id:
-            set_cached_mute_status(peer.id, is_muted)
+        if peer_id:
+            set_cached_mute_status(peer_id, is_mute_active(mute_until), mute_until)
             
-        return is_muted
+        return is_mute_active(mute_until)
 
     except Exception as e:
-        logger.error(f"Error checking mute status: {e}")
+        logger.error(f"Error checking mute status for {peer_id}: {e}. Assuming NOT muted.")
         return False
 
+async def seed_mute_cache(client) -> None:
+    """
+    Seeds the mute cache from the notify_settings carried by get_dialogs,
+    so steady-state mute checks need no RPC, and the dialog index from the
+    same result. Called once at startup.
+    """
+    try:
+        dialogs = await client.get_dialogs(limit=MUTE_SEED_LIMIT or None)
+        count = seed_mute_statuses(dialogs)
+        seed_dialog_index(dialogs, complete=not MUTE_SEED_LIMIT or len(dialogs) < MUTE_SEED_LIMIT)
+        logger.info(f"Seeded mute status and dialog index for {count} chats.")
+    except Exception as e:
+        logger.error(f"Failed to seed mute cache: {e}")
+
+async def handle_notify_settings(update):
+    """
+    Raw update handler keeping the mute cache current when notify settings
+    change (from this or any other client of the account).
+    """
+    try:
+        notify_peer = update.peer
+        if not isinstance(notify_peer, types.NotifyPeer):
+            # NotifyUsers/NotifyChats/NotifyBroadcasts change global defaults,
+            # NotifyForumTopic a single topic; per-chat entries are unaffected.
+            return
+        peer_id = get_peer_id(notify_peer.peer, add_mark=False)
+        mute_until = get_mute_until(update.notify_settings)
+        set_cached_mute_status(peer_id, is_mute_active(mute_until), mute_until)
+        logger.debug(f"Notify settings changed for {peer_id}: muted={is_mute_active(mute_until)}")
+    except Exception as e:
+        logger.error(f"Error handling notify settings update: {e}")
+
+# --- Duplicate Suppression ---
+
+_DEDUPER = MessageDeduper(capacity=DEDUPE_CAPACITY, window=DEDUPE_WINDOW)
+
+def get_dedupe_stats() -> Dict[str, int]:
+    return _DEDUPER.stats()
+
+def load_dedupe_state() -> None:
+    """Restores seen message keys from FORWARD_DEDUPE_PATH, if configured."""
+    if DEDUPE_PATH and os.path.exists(DEDUPE_PATH):
+        try:
+            _DEDUPER.load(DEDUPE_PATH)
+        except Exception as e:
+            logger.error(f"Failed to load dedupe state from {DEDUPE_PATH}: {e}")
+
+def save_dedupe_state() -> None:
+    """Persists seen message keys to FORWARD_DEDUPE_PATH, if configured."""
+    if DEDUPE_PATH:
+        try:
+            _DEDUPER.save(DEDUPE_PATH)
+            logger.debug(f"Saved {len(_DEDUPER)} dedupe keys to {DEDUPE_PATH}.")
+        except Exception as e:
+            logger.error(f"Failed to save dedupe state to {DEDUPE_PATH}: {e}")
+
+# --- Entity Resolution (no RPC on the delivery path) ---
+
+_RESOLVE_STATS: Dict[str, int] = {"update": 0, "cache": 0, "miss": 0, "filled": 0, "fill_failed": 0}
+_FILL_PENDING: Dict[int, Any] = {}
+_FILL_TASK: Optional[asyncio.Task] = None
+
+def get_resolve_stats() -> Dict[str, int]:
+    return dict(_RESOLVE_STATS, fill_pending=len(_FILL_PENDING))
+
+def _resolve_local(entity, peer) -> Optional[Any]:
+    """
+    Resolves a sender/chat without network: first from the entities that came
+    with the update, then from the shared entity cache. Misses are queued for
+    a batched background fill and the message goes out with what we have.
+    """
+    if peer is None:
+        return entity
+
+    # 'min' entities lack an access hash; fine for display, not worth caching
+    if entity is not None and not getattr(entity, "min", False):
+        _RESOLVE_STATS["update"] += 1
+        cache_entity(entity.id, entity)
+        return entity
+
+    peer_id = get_peer_id(peer, add_mark=False)
+    cached = get_cached_entity(peer_id)
+    if cached is not None:
+        _RESOLVE_STATS["cache"] += 1
+        return cached
+
+    _RESOLVE_STATS["miss"] += 1
+    _schedule_entity_fill(peer_id, peer)
+    return entity
+
+def _schedule_entity_fill(peer_id: int, peer) -> None:
+    global _FILL_TASK
+    _FILL_PENDING[peer_id] = peer
+    if _FILL_TASK is None or _FILL_TASK.done():
+        _FILL_TASK = asyncio.create_task(_entity_fill_loop())
+
+async def stop_entity_fill() -> None:
+    """Cancels the background entity fill. Called from server_lifespan."""
+    global _FILL_TASK
+    _FILL_PENDING.clear()
+    if _FILL_TASK is not None:
+        _FILL_TASK.cancel()
+        await asyncio.gather(_FILL_TASK, return_exceptions=True)
+        _FILL_TASK = None
+
+async def _entity_fill_loop() -> None:
+    from .client import client
+
+    while _FILL_PENDING:
+        # Let misses from a burst accumulate into one batched lookup
+        await asyncio.sleep(ENTITY_FILL_DELAY)
+        batch = dict(_FILL_PENDING)
+        _FILL_PENDING.clear()
+
+        try:
+            # get_entity with a list batches users/chats/channels into few requests
+            entities = await client.get_entity(list(batch.values()))
+        except Exception as e:
+            logger.debug(f"Batched entity fill failed ({e}). Retrying individually...")
+            entities = []
+            for peer in batch.values():
+                try:
+                    entities.append(await client.get_entity(peer))
+                except Exception as inner_e:
+                    _RESOLVE_STATS["fill_failed"] += 1
+                    logger.debug(f"Could not fill entity {peer}: {inner_e}")
+
+        for entity in entities:
+            cache_entity(entity.id, entity)
+            _RESOLVE_STATS["filled"] += 1
+
+def _get_chat_type(event, chat) -> str:
+    # PeerChannel: use the entity when we have it, otherwise fall back to
+    # the peer-only guess (broadcast channels produce "post" messages)
+    if isinstance(event.message.peer_id, types.PeerChannel) and chat is not None and hasattr(chat, "megagroup"):
+        return "supergroup" if chat.megagroup else "channel"
+    return peer_chat_type(event.message)
+
 async def handle_new_message(event):
     """
     Event handler for new incoming messages.
@@ -122,13 +453,36 @@ async def handle_new_message(event):
         logger.debug("Handling incoming message event...")
 
         message = event.message
-        sender = await event.get_sender()
-        chat = await event.get_chat()
+        chat_id = get_peer_id(message.peer_id, add_mark=False)
+
+        # --- Duplicate check --- (updates can be redelivered after reconnects)
+        if _DEDUPER.seen(chat_id, message.id):
+            logger.debug(f"Skipping duplicate message {message.id} in chat {chat_id}")
+            return
+
+        # --- Forwarding rules --- (raw message fields only, before any other work)
+        ruleset = get_ruleset()
+        if ruleset is not None:
+            forward, rule_name = ruleset.evaluate(message)
+            if not forward:
+                logger.debug(f"Skipping message {message.id} (rule: {rule_name or 'default'})")
+                return
         
-        # --- Mute Check ---
-        if await is_chat_muted(event.client, chat):
-            logger.debug(f"Skipping message from {getattr(chat, 'title', 'Chat')} (Muted)")
+        # --- Per-destination filters --- (also raw message fields only)
+        destinations = [d for d in get_destinations() if d.accepts(message)]
+        if not destinations:
+            logger.debug(f"Skipping message {message.id} (no destination accepts it)")
+            return
+
+        # --- Mute Check --- (cache hit in steady state, before any entity work)
+        if await is_chat_muted(event.client, message.peer_id, peer_id=chat_id):
+            logger.debug(f"Skipping message from chat {chat_id} (Muted)")
             return
+
+        # --- Sender/Chat resolution without RPC ---
+        chat = _resolve_local(event.chat, message.peer_id)
+        sender_peer = message.from_id or message.peer_id
+        sender = _resolve_local(event.sender, sender_peer)
         
         sender_name = "Unknown"
         if sender:
@@ -137,21 +491,16 @@ async def handle_new_message(event):
             if getattr(sender, 'last_name', None):
                 sender_name += f" {sender.last_name}"
         
-        chat_title = getattr(chat, 'title', 'Private Chat')
-        
         # Determine Chat Type
-        chat_type = "private"
-        if event.is_group:
-            chat_type = "group"
-            if getattr(chat, 'megagroup', False):
-                chat_type = "supergroup"
-        elif event.is_channel:
-            chat_type = "channel"
+        chat_type = _get_chat_type(event, chat)
+
+        # A group we could not resolve yet still gets a neutral title
+        chat_title = getattr(chat, 'title', None) or ('Private Chat' if chat_type == "private" else 'Unknown Chat')
             
         logger.debug(f"Processing message from {sender_name} in {chat_title} ({chat_type})")
 
         # Construct payload with clear identifier
-        header = f"📩 [TELEGRAM MESSAGE]\nFrom: {sender_name}\nChat: {chat_title} (ID: {chat.id})\nType: {chat_type.upper()}"
+        header = f"📩 [TELEGRAM MESSAGE]\nFrom: {sender_name}\nChat: {chat_title} (ID: {chat_id})\nType: {chat_type.upper()}"
         content = message.text or "[Media/Non-text message]"
         
         full_text = f"{header}\n\n{content}"
@@ -159,15 +508,15 @@ async def handle_new_message(event):
         data = {
             "message": full_text,
             "sender": sender_name,
-            "chat_id": chat.id,
+            "chat_id": chat_id,
             "chat_title": chat_title,
             "chat_type": chat_type,
             "timestamp": message.date.isoformat() if message.date else "",
             "message_id": message.id
         }
         
-        # Fire forwarding task
-        await forward_to_poke(data)
+        # Hand off to the delivery workers; returns without waiting on the webhook
+        await enqueue_forward(data, destinations)
         
     except Exception as e:
         logger.error(f"Error handling incoming message: {e}")
@@ -181,7 +530,14 @@ def setup_forwarder(client):
     
     # Listen for NewMessage events that are incoming
     # We remove incoming=True from constructor and check inside to be sure we catch EVERYTHING for debug
+    # Compile the forwarding rules now rather than on the first message
+    get_ruleset()
+    get_destinations()
     client.add_event_handler(handle_new_message, events.NewMessage())
+    # Keep the mute cache current without polling GetNotifySettings
+    client.add_event_handler(handle_notify_settings, events.Raw(types.UpdateNotifySettings))
+    # Keep the per-chat message windows current (new, edited, deleted messages)
+    setup_message_windows(client)
     
     logger.info("Telegram Forwarder is active.")
     logger.debug("Handler registered.")
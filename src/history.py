@@ -0,0 +1,471 @@
+import os
+import time
+import base64
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from telethon import events
+from telethon.utils import get_peer_id
+from .client import client
+from .cache import set_cached_sender_name
+from .messagestore import get_message_store, index_messages
+from .ttlcache import TTLCache
+from .utils import entity_name
+
+logger = logging.getLogger("telegram_history")
+
+# Recent-message windows (per chat, and in total across chats)
+HISTORY_CHAT_MAX = int(os.getenv("TELEGRAM_HISTORY_CHAT_MAX", "500"))
+HISTORY_TOTAL_MAX = int(os.getenv("TELEGRAM_HISTORY_TOTAL_MAX", "20000"))
+# How long a fetch of the newest messages is trusted to still reach the top
+HISTORY_TOP_TTL = float(os.getenv("TELEGRAM_HISTORY_TOP_TTL", "300"))
+# Pages of older history read ahead of a cursor walk (0 = off)
+HISTORY_PREFETCH_PAGES = int(os.getenv("TELEGRAM_HISTORY_PREFETCH_PAGES", "2"))
+# How long cursors' read-ahead and page-number cursors are kept
+HISTORY_CURSOR_TTL = 600
+
+# MessageRecord.media flags
+MEDIA_PHOTO = 1
+MEDIA_DOCUMENT = 2      # files, voice notes, videos, stickers
+MEDIA_OTHER = 4         # web pages, polls, locations, contacts, ...
+
+class MessageRecord:
+    """
+    The parts of a message the tools render, kept instead of telethon's
+    Message (which drags its client, peer objects and raw TL tree along).
+    `text` is the message's own string, not a copy; `date` is a unix
+    timestamp; `buttons` holds inline button labels by row.
+    """
+    __slots__ = ("id", "sender_id", "date", "reply_to", "text", "media", "buttons")
+
+    def __init__(self, id: int, sender_id: Optional[int], date: int, reply_to: int, text: str,
+                 media: int = 0, buttons: Optional[Tuple[Tuple[str, ...], ...]] = None):
+        self.id = id
+        self.sender_id = sender_id
+        self.date = date
+        self.reply_to = reply_to
+        self.text = text
+        self.media = media
+        self.buttons = buttons
+
+def to_record(message, senders: Optional[Dict[int, Any]] = None) -> MessageRecord:
+    """
+    Builds the record of a telethon Message, remembering its sender's name
+    for rendering. `senders` (marked peer ID -> entity) supplies the sender
+    of messages from raw requests, which telethon has not attached.
+    """
+    sender = getattr(message, "sender", None)
+    sender_id = getattr(message, "sender_id", None)
+    if sender is None and senders and sender_id is not None:
+        sender = senders.get(sender_id)
+    if sender is not None and sender_id is not None:
+        set_cached_sender_name(sender_id, entity_name(sender))
+
+    media = 0
+    if getattr(message, "media", None) is not None:
+        if getattr(message, "photo", None) is not None:
+            media = MEDIA_PHOTO
+        elif getattr(message, "document", None) is not None:
+            media = MEDIA_DOCUMENT
+        else:
+            media = MEDIA_OTHER
+
+    buttons = getattr(message, "buttons", None)
+    if buttons:
+        buttons = tuple(tuple(button.text for button in row) for row in buttons)
+
+    reply_to = getattr(message, "reply_to", None)
+    date = getattr(message, "date", None)
+    return MessageRecord(
+        message.id,
+        sender_id,
+        int(date.timestamp()) if date else 0,
+        getattr(reply_to, "reply_to_msg_id", None) or 0,
+        getattr(message, "message", None) or "",
+        media,
+        buttons or None
+    )
+
+class ChatWindow:
+    """
+    A contiguous run of one chat's messages: every message with an id from
+    `low` up to the newest one held (or up to the newest one in the chat,
+    while `top_at` is recent). `top_at` is the last fetch of the newest
+    messages or live append. `start` means `low` is the chat's first message.
+    """
+    __slots__ = ("ids", "messages", "low", "top_at", "start")
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.messages: Dict[int, MessageRecord] = {}
+        self.low = 0
+        self.top_at = 0.0
+        self.start = False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def at_top(self) -> bool:
+        return self.top_at > 0 and time.monotonic() - self.top_at < HISTORY_TOP_TTL
+
+    def put(self, record: MessageRecord) -> None:
+        if record.id not in self.messages:
+            insort(self.ids, record.id)
+        self.messages[record.id] = record
+
+    def discard(self, message_id: int) -> bool:
+        if self.messages.pop(message_id, None) is None:
+            return False
+        i = bisect_left(self.ids, message_id)
+        del self.ids[i]
+        return True
+
+    def trim(self, keep: int) -> int:
+        """Drops the oldest messages beyond `keep`. Returns how many were dropped."""
+        drop = len(self.ids) - keep
+        if drop <= 0:
+            return 0
+        for message_id in self.ids[:drop]:
+            del self.messages[message_id]
+        del self.ids[:drop]
+        self.low = self.ids[0] if self.ids else self.low
+        self.start = False
+        return drop
+
+class MessageWindows:
+    """
+    Per-chat windows of recent messages (as MessageRecords), filled by
+    history fetches and kept current by NewMessage/MessageEdited/
+    MessageDeleted events. Writes take telethon Messages; reads return records.
+
+    Only contiguous runs are kept, so a window can answer "the newest N
+    messages" or "N messages around id X" exactly, or not at all. Each
+    window holds at most `chat_max` messages (oldest dropped first) and all
+    windows together at most `total_max` (least recently used chat dropped).
+    """
+
+    def __init__(self, chat_max: int = HISTORY_CHAT_MAX, total_max: int = HISTORY_TOTAL_MAX):
+        self.chat_max = chat_max
+        self.total_max = total_max
+        self._windows: "OrderedDict[int, ChatWindow]" = OrderedDict()
+        self._total = 0
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "fetched": 0, "live": 0, "stale": 0, "evicted": 0}
+
+    def _window(self, peer_id: int) -> Optional[ChatWindow]:
+        window = self._windows.get(peer_id)
+        if window is not None:
+            self._windows.move_to_end(peer_id)
+        return window
+
+    def _hit(self, result):
+        self.counters["hits" if result is not None else "misses"] += 1
+        return result
+
+    # --- Reads ---
+
+    def latest(self, peer_id: int, offset: int, limit: int) -> Optional[List[MessageRecord]]:
+        """The newest messages [offset, offset + limit), newest first, or None if not held."""
+        window = self._window(peer_id)
+        if window is None or not window.at_top or (len(window) < offset + limit and not window.start):
+            return self._hit(None)
+        end = len(window.ids) - offset
+        ids = window.ids[max(0, end - limit):max(0, end)]
+        return self._hit([window.messages[i] for i in reversed(ids)])
+
+    def context(self, peer_id: int, message_id: int, count: int) -> Optional[Tuple[List[MessageRecord], MessageRecord, List[MessageRecord]]]:
+        """(up to `count` older messages, the message, up to `count` newer ones), all ascending, or None."""
+        window = self._window(peer_id)
+        if window is None or message_id not in window.messages:
+            return self._hit(None)
+        i = bisect_left(window.ids, message_id)
+        before = window.ids[max(0, i - count):i]
+        after = window.ids[i + 1:i + 1 + count]
+        if (len(before) < count and not window.start) or (len(after) < count and not window.at_top):
+            return self._hit(None)
+        messages = window.messages
+        return self._hit(([messages[j] for j in before], messages[message_id], [messages[j] for j in after]))
+
+    def older(self, peer_id: int, offset_id: int, limit: int) -> Optional[List[MessageRecord]]:
+        """Up to `limit` messages older than `offset_id`, newest first, or None if not held."""
+        window = self._window(peer_id)
+        if window is None or not window.ids or offset_id <= window.low:
+            return self._hit(None)
+        if offset_id > window.ids[-1] + 1 and not window.at_top:
+            # Messages between the window's newest and offset_id may be missing
+            return self._hit(None)
+        i = bisect_left(window.ids, offset_id)
+        ids = window.ids[max(0, i - limit):i]
+        if len(ids) < limit and not window.start:
+            return self._hit(None)
+        return self._hit([window.messages[j] for j in reversed(ids)])
+
+    def get(self, peer_id: int, message_id: int) -> Optional[MessageRecord]:
+        window = self._window(peer_id)
+        return self._hit(window.messages.get(message_id) if window is not None else None)
+
+    def below(self, peer_id: int) -> Optional[Tuple[int, int]]:
+        """(lowest id, messages held) of a window that still reaches the top, to extend it downwards."""
+        window = self._windows.get(peer_id)
+        if window is None or not window.at_top or window.start or not window.ids:
+            return None
+        return window.low, len(window)
+
+    # --- Writes ---
+
+    def add_newest(self, peer_id: int, messages: list, reached_start: bool) -> None:
+        """Records the result of a fetch of the newest messages (no offset)."""
+        index_messages(messages)
+        window = self._window(peer_id)
+        ids = [m.id for m in messages]
+        overlaps = window is not None and window.at_top and ids and min(ids) <= (window.ids[-1] if window.ids else 0)
+        if not overlaps:
+            if window is not None:
+                self._total -= len(window)
+            window = ChatWindow()
+            self._windows[peer_id] = window
+        for message in messages:
+            self._put(window, message)
+        if ids:
+            window.low = min(window.low, min(ids)) if overlaps else min(ids)
+        window.start = window.start or reached_start
+        window.top_at = time.monotonic()
+        self.counters["fetched"] += len(messages)
+        self._bound(peer_id, window)
+
+    def add_older(self, peer_id: int, messages: list, max_id: int, reached_start: bool) -> None:
+        """Records messages fetched with `max_id` = the window's lowest id (extends it downwards)."""
+        index_messages(messages)
+        window = self._window(peer_id)
+        if window is None or window.low != max_id:
+            return
+        for message in messages:
+            self._put(window, message)
+        if messages:
+            window.low = min(m.id for m in messages)
+        window.start = reached_start
+        self.counters["fetched"] += len(messages)
+        self._bound(peer_id, window)
+
+    def on_message(self, peer_id: int, message) -> None:
+        window = self._window(peer_id)
+        if window is not None and not window.at_top:
+            # Nothing confirmed this window for HISTORY_TOP_TTL, so it may have
+            # missed events (telethon does not report updates it could not
+            # recover); appending could hide a gap, so start over
+            self._total -= len(window)
+            self.counters["stale"] += 1
+            window = None
+        if window is None:
+            # Everything from this message on will arrive as events
+            window = ChatWindow()
+            window.low = message.id
+            window.top_at = time.monotonic()
+            self._windows[peer_id] = window
+        elif window.ids and message.id < window.ids[0]:
+            return
+        if not window.ids or message.id > window.ids[-1]:
+            # A new newest message: the window still follows the chat's top
+            window.top_at = time.monotonic()
+        self._put(window, message)
+        self.counters["live"] += 1
+        self._bound(peer_id, window)
+
+    def on_edit(self, peer_id: int, message) -> None:
+        window = self._windows.get(peer_id)
+        if window is not None and message.id in window.messages:
+            window.messages[message.id] = to_record(message)
+
+    def on_delete(self, peer_id: Optional[int], message_ids: List[int]) -> None:
+        if peer_id is not None:
+            windows = [self._windows.get(peer_id)]
+        else:
+            # Private chats and basic groups share one id sequence per account
+            windows = [w for p, w in self._windows.items() if p > -1000000000000]
+        for window in windows:
+            if window is None:
+                continue
+            for message_id in message_ids:
+                if window.discard(message_id):
+                    self._total -= 1
+
+    def _put(self, window: ChatWindow, message) -> None:
+        if message.id not in window.messages:
+            self._total += 1
+        window.put(to_record(message))
+
+    def _bound(self, peer_id: int, window: ChatWindow) -> None:
+        self._total -= window.trim(self.chat_max)
+        while self._total > self.total_max and len(self._windows) > 1:
+            evicted_id, evicted = self._windows.popitem(last=False)
+            if evicted_id == peer_id:
+                # Keep the chat being written to
+                self._windows[peer_id] = evicted
+                continue
+            self._total -= len(evicted)
+            self.counters["evicted"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"chats": len(self._windows), "messages": self._total, "max_messages": self.total_max, **self.counters}
+
+class _Run:
+    """
+    Read-ahead of one walk through older history: every message older than
+    `upper` down to the last of `records` (newest first), or down to the
+    chat's first message once `start` is set. `fetch` is the read-ahead in
+    flight, if any.
+    """
+    __slots__ = ("upper", "records", "start", "fetch")
+
+    def __init__(self, upper: int):
+        self.upper = upper
+        self.records: List[MessageRecord] = []
+        self.start = False
+        self.fetch: Optional[asyncio.Task] = None
+
+    def take(self, offset_id: int, limit: int) -> Optional[List[MessageRecord]]:
+        """The page older than `offset_id`, or None if not read yet. Drops what earlier pages used."""
+        if offset_id > self.upper:
+            return None
+        records = self.records
+        i = 0
+        while i < len(records) and records[i].id >= offset_id:
+            i += 1
+        page = records[i:i + limit]
+        if len(page) < limit and not self.start:
+            return None
+        self.records = records[i:]
+        self.upper = offset_id
+        return page
+
+class HistoryReader:
+    """
+    Cursor reads of older history (get_messages with `cursor`): each page
+    is "`limit` messages older than `offset_id`", served from the chat's
+    window when it holds them, else from a per-chat read-ahead run that
+    fetches with offset_id (never add_offset) and stays HISTORY_PREFETCH_PAGES
+    pages ahead of the caller in the background. Page-number calls are
+    mapped onto the same reads through remembered page cursors.
+    """
+
+    def __init__(self, windows: MessageWindows):
+        self.windows = windows
+        self._runs = TTLCache("history_runs", ttl=HISTORY_CURSOR_TTL, max_entries=256)
+        self._pages = TTLCache("page_cursors", ttl=HISTORY_CURSOR_TTL, max_entries=10_000)
+        self.counters: Dict[str, int] = {"window_pages": 0, "read_ahead_pages": 0, "fetches": 0, "prefetches": 0}
+
+    async def older(self, entity, peer_id: int, offset_id: int, limit: int) -> Tuple[List[MessageRecord], bool]:
+        """(up to `limit` records older than `offset_id`, newest first; whether more may follow)."""
+        records = self.windows.older(peer_id, offset_id, limit)
+        if records is not None:
+            self.counters["window_pages"] += 1
+            return records, len(records) == limit
+
+        run = self._runs.get(peer_id)
+        if run is None or offset_id > run.upper:
+            # A new walk (or one that jumped back up)
+            run = _Run(offset_id)
+            self._runs.set(peer_id, run)
+        page = run.take(offset_id, limit)
+        if page is None and run.fetch is not None:
+            await asyncio.shield(run.fetch)
+            page = run.take(offset_id, limit)
+        if page is None:
+            # Not read far enough yet (or a walk that skipped ahead): read from here
+            if not run.records or run.records[-1].id >= offset_id:
+                run = _Run(offset_id)
+                self._runs.set(peer_id, run)
+            self.counters["fetches"] += 1
+            await self._extend(entity, run, limit * (1 + HISTORY_PREFETCH_PAGES))
+            page = run.take(offset_id, limit) or []
+        else:
+            self.counters["read_ahead_pages"] += 1
+
+        ahead = len(run.records) - len(page)
+        if HISTORY_PREFETCH_PAGES and not run.start and run.fetch is None and ahead < limit * HISTORY_PREFETCH_PAGES:
+            self.counters["prefetches"] += 1
+            run.fetch = asyncio.create_task(self._extend(entity, run, limit * HISTORY_PREFETCH_PAGES))
+        return page, len(page) == limit and not (run.start and ahead == 0)
+
+    async def _extend(self, entity, run: _Run, count: int) -> None:
+        try:
+            offset_id = run.records[-1].id if run.records else run.upper
+            messages = await client.get_messages(entity, limit=count, offset_id=offset_id)
+            index_messages(messages)
+            if (run.records[-1].id if run.records else run.upper) == offset_id:
+                run.records.extend(to_record(m) for m in messages)
+                run.start = len(messages) < count
+        except Exception as e:
+            if run.fetch is None:
+                raise
+            # Read-ahead only; the next page fetches for itself
+            logger.warning(f"History read-ahead failed: {e}")
+        finally:
+            run.fetch = None
+
+    def page_cursor(self, peer_id: int, page_size: int, page: int) -> Optional[int]:
+        """The offset_id page `page` continues from, if the previous page was served."""
+        return self._pages.get((peer_id, page_size, page))
+
+    def remember_page(self, peer_id: int, page_size: int, page: int, offset_id: int) -> None:
+        self._pages.set((peer_id, page_size, page), offset_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"walks": len(self._runs), "page_cursors": len(self._pages), **self.counters}
+
+def encode_cursor(peer_id: int, record: MessageRecord) -> str:
+    """Opaque cursor continuing after `record` (the last message of a page)."""
+    raw = f"{peer_id}:{record.id}:{record.date}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """(peer_id, offset_id) of a cursor from encode_cursor. Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        peer_id, offset_id, _ = raw.split(":")
+        return int(peer_id), int(offset_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+_WINDOWS = MessageWindows()
+_READER = HistoryReader(_WINDOWS)
+
+def get_message_windows() -> MessageWindows:
+    return _WINDOWS
+
+def get_history_reader() -> HistoryReader:
+    return _READER
+
+# --- Event handlers ---
+
+async def handle_window_message(event):
+    try:
+        # Indexed even when no window takes it
+        index_messages([event.message])
+        _WINDOWS.on_message(get_peer_id(event.message.peer_id), event.message)
+    except Exception as e:
+        logger.error(f"Error recording message in window: {e}")
+
+async def handle_window_edit(event):
+    try:
+        index_messages([event.message])
+        _WINDOWS.on_edit(get_peer_id(event.message.peer_id), event.message)
+    except Exception as e:
+        logger.error(f"Error recording edit in window: {e}")
+
+async def handle_window_delete(event):
+    try:
+        store = get_message_store()
+        if store is not None:
+            store.delete(event.chat_id, list(event.deleted_ids))
+        _WINDOWS.on_delete(event.chat_id, list(event.deleted_ids))
+    except Exception as e:
+        logger.error(f"Error recording deletion in window: {e}")
+
+def setup_message_windows(client) -> None:
+    """Registers the handlers that keep the message windows current."""
+    client.add_event_handler(handle_window_message, events.NewMessage())
+    client.add_event_handler(handle_window_edit, events.MessageEdited())
+    client.add_event_handler(handle_window_delete, events.MessageDeleted())
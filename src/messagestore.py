@@ -0,0 +1,318 @@
+import os
+import re
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from telethon.utils import get_peer_id
+
+logger = logging.getLogger("telegram_messagestore")
+
+# Local full-text message index (opt-in; search_messages needs it)
+MESSAGE_INDEX_PATH = os.getenv("TELEGRAM_MESSAGE_INDEX_PATH")
+MESSAGE_INDEX_COMMIT_S = float(os.getenv("TELEGRAM_MESSAGE_INDEX_COMMIT_S", "1"))
+# Matches ranked per search: the most recently indexed ones, so very common
+# words cost a bounded amount of bm25 scoring
+MESSAGE_INDEX_RANK_WINDOW = int(os.getenv("TELEGRAM_MESSAGE_INDEX_RANK_WINDOW", "5000"))
+
+# `messages` holds the rows; `messages_fts` is an external-content FTS5
+# index over their text, kept in sync by triggers. The chat and sender are
+# indexed as tokens too (see `_peer_token()`), so filtering by them is a
+# doclist intersection inside FTS5 rather than a check per matching row.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    peer_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    sender_id INTEGER,
+    date INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (peer_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE VIEW IF NOT EXISTS messages_doc AS SELECT
+    id, text,
+    'c' || replace(peer_id, '-', 'n') AS chat,
+    coalesce('s' || replace(sender_id, '-', 'n'), '') AS sender
+FROM messages;
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, chat, sender, content='messages_doc', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text, chat, sender)
+    SELECT id, text, chat, sender FROM messages_doc WHERE id = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, chat, sender) VALUES (
+        'delete', old.id, old.text,
+        'c' || replace(old.peer_id, '-', 'n'), coalesce('s' || replace(old.sender_id, '-', 'n'), '')
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, chat, sender) VALUES (
+        'delete', old.id, old.text,
+        'c' || replace(old.peer_id, '-', 'n'), coalesce('s' || replace(old.sender_id, '-', 'n'), '')
+    );
+    INSERT INTO messages_fts (rowid, text, chat, sender)
+    SELECT id, text, chat, sender FROM messages_doc WHERE id = new.id;
+END;
+"""
+
+_UPSERT = (
+    "INSERT INTO messages (peer_id, message_id, sender_id, date, text) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (peer_id, message_id) DO UPDATE SET text = excluded.text WHERE text != excluded.text"
+)
+
+# Marked IDs above this are users and basic groups, which share one message ID sequence
+_CHANNEL_ID_LIMIT = -1000000000000
+
+_WORD_RE = re.compile(r"\w+\*?")
+
+def _peer_token(prefix: str, peer_id: int) -> str:
+    # Matches the chat/sender columns of messages_doc ("-" is a token separator)
+    return f"{prefix}{str(peer_id).replace('-', 'n')}"
+
+def match_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 query over the text column: every word
+    must appear (quoted, so FTS5 syntax characters in the input are
+    harmless); `word*` matches words starting with "word".
+    """
+    terms = []
+    for word in _WORD_RE.findall(query):
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return f"text : ({' '.join(terms)})" if terms else ""
+
+class MessageHit:
+    """One search_messages result."""
+    __slots__ = ("peer_id", "message_id", "sender_id", "date", "snippet")
+
+    def __init__(self, peer_id: int, message_id: int, sender_id: Optional[int], date: int, snippet: str):
+        self.peer_id = peer_id
+        self.message_id = message_id
+        self.sender_id = sender_id
+        self.date = date
+        self.snippet = snippet
+
+class MessageStore:
+    """
+    SQLite (WAL) full-text index of message texts, for search_messages.
+
+    `add()` and `delete()` only buffer; a writer task applies everything
+    buffered in one transaction every `commit_interval` seconds. Messages
+    are keyed by (marked chat ID, message ID), so re-adding a message (a
+    refetch, an edit) updates it in place. Searches run in a worker thread
+    against the committed data and never touch the network.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 1.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._buffer: Dict[Tuple[int, int], Tuple] = {}
+        self._deletes: List[Tuple[Optional[int], int]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {"buffered": 0, "written": 0, "deleted": 0, "commits": 0, "searches": 0, "truncated": 0}
+
+    # --- Lifecycle ---
+
+    async def open(self) -> None:
+        if self._conn is not None:
+            return
+        self._wakeup = asyncio.Event()
+        count = await asyncio.to_thread(self._open)
+        self._writer_task = asyncio.create_task(self._writer_loop(), name="messagestore-writer")
+        logger.info(f"Message index opened at {self.path} ({count} messages).")
+
+    async def close(self) -> None:
+        """Flushes buffered writes and closes the database."""
+        if self._conn is None:
+            return
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        await self._flush()
+        async with self._db_lock:
+            await asyncio.to_thread(self._conn.execute, "INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+            self._conn.close()
+        self._conn = None
+        logger.info("Message index closed.")
+
+    # --- Write path ---
+
+    def add(self, message: Any) -> None:
+        """Buffers a telethon Message (anything without text is skipped)."""
+        text = getattr(message, "message", None)
+        peer = getattr(message, "peer_id", None)
+        if not text or peer is None:
+            return
+        peer_id = get_peer_id(peer)
+        date = getattr(message, "date", None)
+        self._buffer[peer_id, message.id] = (
+            peer_id,
+            message.id,
+            getattr(message, "sender_id", None),
+            int(date.timestamp()) if date else 0,
+            text
+        )
+        self.counters["buffered"] += 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def delete(self, peer_id: Optional[int], message_ids: List[int]) -> None:
+        """Buffers deletions; `peer_id` None means "in any user chat or basic group"."""
+        for message_id in message_ids:
+            self._buffer.pop((peer_id, message_id), None)
+            self._deletes.append((peer_id, message_id))
+        if self._wakeup:
+            self._wakeup.set()
+
+    # --- Search ---
+
+    async def search(
+        self,
+        query: str,
+        peer_id: Optional[int] = None,
+        sender_id: Optional[int] = None,
+        since: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 20
+    ) -> Tuple[List[MessageHit], bool]:
+        """
+        (best matches first (bm25), with a highlighted snippet of each;
+        whether older matches were left out). Only the
+        MESSAGE_INDEX_RANK_WINDOW most recently indexed matches (after the
+        filters) are ranked.
+        """
+        match = match_query(query)
+        if not match or self._conn is None:
+            return [], False
+        if peer_id is not None:
+            match += f' AND chat : "{_peer_token("c", peer_id)}"'
+        if sender_id is not None:
+            match += f' AND sender : "{_peer_token("s", sender_id)}"'
+        where = ["messages_fts MATCH ?"]
+        args: List[Any] = [match]
+        for clause, value in (("m.date >= ?", since), ("m.date < ?", before)):
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        where = " AND ".join(where)
+        source = "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+        # Walking matches newest first stops after the window (and one more,
+        # to tell whether any were left out); the rank query then only reads
+        # doclists above the window's last rowid
+        cutoff_sql = f"SELECT messages_fts.rowid {source} WHERE {where} ORDER BY messages_fts.rowid DESC LIMIT 2 OFFSET ?"
+        rank_sql = (
+            "SELECT m.peer_id, m.message_id, m.sender_id, m.date, "
+            "snippet(messages_fts, 0, '[', ']', '…', 16) "
+            f"{source} WHERE {where} AND messages_fts.rowid >= ? ORDER BY rank LIMIT ?"
+        )
+        self.counters["searches"] += 1
+        # Reads see committed data; no need to wait behind a commit
+        rows, truncated = await asyncio.to_thread(self._search, cutoff_sql, rank_sql, args, limit)
+        if truncated:
+            self.counters["truncated"] += 1
+        return [MessageHit(*row) for row in rows], truncated
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "pending": len(self._buffer) + len(self._deletes), **self.counters}
+
+    # --- Internals (writes run in a worker thread, serialized by _db_lock) ---
+
+    def _open(self) -> int:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def _search(self, cutoff_sql: str, rank_sql: str, args: List[Any], limit: int) -> Tuple[List[Tuple], bool]:
+        # A separate connection per call, so searches run alongside the writer
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cutoff = conn.execute(cutoff_sql, args + [MESSAGE_INDEX_RANK_WINDOW - 1]).fetchall()
+            rows = conn.execute(rank_sql, args + [cutoff[0][0] if cutoff else 0, limit]).fetchall()
+            return rows, len(cutoff) > 1
+        finally:
+            conn.close()
+
+    def _commit(self, rows: List[Tuple], deletes: List[Tuple[Optional[int], int]]) -> None:
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(_UPSERT, rows)
+            for peer_id, message_id in deletes:
+                if peer_id is None:
+                    conn.execute("DELETE FROM messages WHERE message_id = ? AND peer_id > ?", (message_id, _CHANNEL_ID_LIMIT))
+                else:
+                    conn.execute("DELETE FROM messages WHERE peer_id = ? AND message_id = ?", (peer_id, message_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def _flush(self) -> None:
+        if not self._buffer and not self._deletes:
+            return
+        buffer, self._buffer = self._buffer, {}
+        deletes, self._deletes = self._deletes, []
+        async with self._db_lock:
+            try:
+                await asyncio.to_thread(self._commit, list(buffer.values()), deletes)
+            except Exception as e:
+                logger.error(f"Message index commit failed: {e}")
+                # Newer versions buffered meanwhile win over the failed ones
+                self._buffer = {**buffer, **self._buffer}
+                self._deletes = deletes + self._deletes
+                return
+        self.counters["commits"] += 1
+        self.counters["written"] += len(buffer)
+        self.counters["deleted"] += len(deletes)
+
+    async def _writer_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Linger so a burst of messages shares one transaction
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            await self._flush()
+
+_STORE: Optional[MessageStore] = None
+
+def get_message_store() -> Optional[MessageStore]:
+    """The message index, or None if TELEGRAM_MESSAGE_INDEX_PATH is not set."""
+    return _STORE
+
+def index_messages(messages: Iterable[Any]) -> None:
+    """Adds received or fetched telethon Messages to the message index, if enabled."""
+    if _STORE is not None:
+        for message in messages:
+            _STORE.add(message)
+
+async def start_message_store() -> None:
+    """Opens TELEGRAM_MESSAGE_INDEX_PATH, if configured. Called from server_lifespan."""
+    global _STORE
+    if not MESSAGE_INDEX_PATH or _STORE is not None:
+        return
+    store = MessageStore(MESSAGE_INDEX_PATH, commit_interval=MESSAGE_INDEX_COMMIT_S)
+    try:
+        await store.open()
+    except Exception as e:
+        logger.error(f"Failed to open message index {MESSAGE_INDEX_PATH}: {e}")
+        return
+    _STORE = store
+
+async def stop_message_store() -> None:
+    """Writes out buffered messages and closes the index."""
+    global _STORE
+    if _STORE is not None:
+        await _STORE.close()
+        _STORE = None
@@ -0,0 +1,306 @@
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("telegram_outbox")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt);
+"""
+
+class OutboxEntry:
+    """A persisted payload handed to the delivery queue."""
+    __slots__ = ("id", "payload", "attempts")
+
+    def __init__(self, id: int, payload: Dict[str, Any], attempts: int = 0):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+
+class Outbox:
+    """
+    Durable SQLite (WAL) outbox for forwarded payloads.
+
+    Write path: `append()` only buffers the payload; a writer task commits all
+    buffered inserts, acks and retry updates in one transaction every
+    `commit_interval` seconds (group commit, one fsync per batch). Committed
+    entries are handed to `dispatch(entry)`, which returns False if there was
+    no room to take them right now.
+
+    Delivery results come back through `settle(entry, ok)`: acknowledged rows
+    are deleted, failed rows are rescheduled with exponential backoff plus
+    jitter. A scheduler re-dispatches due rows, which also replays whatever
+    was left pending by a previous run.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        commit_interval: float = 0.02,
+        lease: float = 60.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        max_attempts: int = 0,
+        poll_interval: float = 1.0,
+        compact_interval: float = 60.0
+    ):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.compact_interval = compact_interval
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._dispatch: Optional[Callable[[OutboxEntry], bool]] = None
+
+        # Buffers flushed by the next group commit
+        self._inserts: List[Tuple[Dict[str, Any], str]] = []
+        self._acks: List[int] = []
+        self._updates: List[Tuple[float, int, int]] = []
+
+        self._inflight: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self._last_compact = time.monotonic()
+        self._pending = 0
+
+        self.counters: Dict[str, int] = {
+            "appended": 0,
+            "acked": 0,
+            "retried": 0,
+            "deferred": 0,
+            "dead": 0,
+            "replayed": 0,
+            "commits": 0,
+            "committed_rows": 0
+        }
+
+    # --- Lifecycle ---
+
+    async def start(self, dispatch: Callable[[OutboxEntry], bool]) -> None:
+        if self._conn is not None:
+            return
+        self._dispatch = dispatch
+        self._wakeup = asyncio.Event()
+        self._pending = await asyncio.to_thread(self._open)
+        self._writer_task = asyncio.create_task(self._writer_loop(), name="outbox-writer")
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop(), name="outbox-scheduler")
+        if self._inserts:
+            # Appended before the outbox was started
+            self._wakeup.set()
+        logger.info(f"Outbox opened at {self.path} ({self._pending} pending entries).")
+
+    async def close(self) -> None:
+        """Flushes buffered writes, compacts and closes the database."""
+        if self._conn is None:
+            return
+        for task in (self._scheduler_task, self._writer_task):
+            if task:
+                task.cancel()
+        await asyncio.gather(*(t for t in (self._scheduler_task, self._writer_task) if t), return_exceptions=True)
+        self._scheduler_task = self._writer_task = None
+
+        await self._flush()
+        async with self._db_lock:
+            await asyncio.to_thread(self._compact)
+            self._conn.close()
+        self._conn = None
+        self._inflight.clear()
+        logger.info(f"Outbox closed ({self._pending} pending entries).")
+
+    # --- Write path ---
+
+    def append(self, payload: Dict[str, Any], text: Optional[str] = None) -> None:
+        """
+        Buffers a payload; it becomes durable with the next group commit.
+        Pass `text` if the payload is already serialized as JSON.
+        """
+        if text is None:
+            text = json.dumps(payload, ensure_ascii=False)
+        self._inserts.append((payload, text))
+        self.counters["appended"] += 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def settle(self, entry: OutboxEntry, ok: bool) -> None:
+        """Records a delivery result: ack on success, backoff retry on failure."""
+        self._inflight.discard(entry.id)
+        if ok:
+            self._acks.append(entry.id)
+            self.counters["acked"] += 1
+            self._wakeup.set()
+            return
+
+        attempts = entry.attempts + 1
+        if self.max_attempts and attempts >= self.max_attempts:
+            logger.error(f"Outbox entry {entry.id} failed {attempts} times. Giving up.")
+            self._acks.append(entry.id)
+            self.counters["dead"] += 1
+            self._wakeup.set()
+            return
+
+        self._updates.append((time.time() + self.backoff_delay(attempts), attempts, entry.id))
+        self.counters["retried"] += 1
+        self._wakeup.set()
+
+    def defer(self, entry: OutboxEntry, retry_at: float) -> None:
+        """Reschedules an entry that was not attempted (e.g. circuit open) without counting an attempt."""
+        self._inflight.discard(entry.id)
+        self._updates.append((retry_at, entry.attempts, entry.id))
+        self.counters["deferred"] += 1
+        self._wakeup.set()
+
+    def backoff_delay(self, attempts: int) -> float:
+        """Exponential backoff with equal jitter: half fixed, half random."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def stats(self) -> Dict[str, Any]:
+        commits = self.counters["commits"]
+        return {
+            "path": self.path,
+            "pending": self._pending,
+            "inflight": len(self._inflight),
+            "buffered": len(self._inserts),
+            **self.counters,
+            "avg_rows_per_commit": round(self.counters["committed_rows"] / commits, 2) if commits else 0.0
+        }
+
+    # --- Internals (SQLite calls run in a worker thread, serialized by _db_lock) ---
+
+    def _open(self) -> int:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(_SCHEMA)
+        # Entries never attempted by a previous run are due right away
+        conn.execute("UPDATE outbox SET next_attempt = ? WHERE attempts = 0", (time.time(),))
+        self._conn = conn
+        return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _commit(self, inserts, acks, updates) -> List[int]:
+        conn = self._conn
+        now = time.time()
+        ids = []
+        conn.execute("BEGIN")
+        try:
+            for _, text in inserts:
+                # Leased straight away: the writer dispatches it after commit
+                cur = conn.execute(
+                    "INSERT INTO outbox (payload, attempts, next_attempt, created) VALUES (?, 0, ?, ?)",
+                    (text, now + self.lease, now)
+                )
+                ids.append(cur.lastrowid)
+            if acks:
+                conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in acks])
+            if updates:
+                conn.executemany("UPDATE outbox SET next_attempt = ?, attempts = ? WHERE id = ?", updates)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return ids
+
+    def _select_due(self, limit: int) -> List[Tuple[int, str, int]]:
+        return self._conn.execute(
+            "SELECT id, payload, attempts FROM outbox WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+            (time.time(), limit)
+        ).fetchall()
+
+    def _compact(self) -> None:
+        self._conn.execute("PRAGMA incremental_vacuum")
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def _flush(self) -> None:
+        if not (self._inserts or self._acks or self._updates):
+            return
+        inserts, self._inserts = self._inserts, []
+        acks, self._acks = self._acks, []
+        updates, self._updates = self._updates, []
+
+        async with self._db_lock:
+            try:
+                ids = await asyncio.to_thread(self._commit, inserts, acks, updates)
+            except Exception as e:
+                logger.error(f"Outbox commit failed: {e}")
+                # Put everything back for the next attempt
+                self._inserts = inserts + self._inserts
+                self._acks = acks + self._acks
+                self._updates = updates + self._updates
+                return
+
+        self.counters["commits"] += 1
+        self.counters["committed_rows"] += len(inserts) + len(acks) + len(updates)
+        self._pending += len(inserts) - len(acks)
+
+        deferred = []
+        for row_id, (payload, _) in zip(ids, inserts):
+            if not self._offer(OutboxEntry(row_id, payload)):
+                # Queue is full: make it due now instead of after the lease
+                deferred.append((time.time(), 0, row_id))
+        if deferred:
+            self._updates.extend(deferred)
+            self._wakeup.set()
+
+    def _offer(self, entry: OutboxEntry) -> bool:
+        self._inflight.add(entry.id)
+        if self._dispatch and self._dispatch(entry):
+            return True
+        # No room: the scheduler picks it up again once it is due
+        self._inflight.discard(entry.id)
+        return False
+
+    async def _writer_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Linger briefly so concurrent appends share one commit/fsync
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            await self._flush()
+
+            if time.monotonic() - self._last_compact > self.compact_interval:
+                self._last_compact = time.monotonic()
+                async with self._db_lock:
+                    await asyncio.to_thread(self._compact)
+
+    async def _scheduler_loop(self) -> None:
+        while True:
+            async with self._db_lock:
+                rows = await asyncio.to_thread(self._select_due, 500)
+
+            leased = []
+            for row_id, text, attempts in rows:
+                if row_id in self._inflight:
+                    continue
+                try:
+                    payload = json.loads(text)
+                except ValueError:
+                    logger.error(f"Dropping corrupt outbox entry {row_id}")
+                    self._acks.append(row_id)
+                    continue
+                if not self._offer(OutboxEntry(row_id, payload, attempts)):
+                    break
+                self.counters["replayed"] += 1
+                leased.append((time.time() + self.lease, attempts, row_id))
+
+            if leased:
+                self._updates.extend(leased)
+                self._wakeup.set()
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,186 @@
+import time
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from telethon import types
+from telethon.extensions import BinaryReader
+from telethon.utils import get_peer_id
+
+logger = logging.getLogger("telegram_peerstore")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    peer_id INTEGER PRIMARY KEY,
+    access_hash INTEGER,
+    username TEXT,
+    phone TEXT,
+    snapshot BLOB NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Entity types whose snapshots let Telethon build an InputPeer later
+_STORABLE = (types.User, types.Chat, types.Channel)
+
+def _fingerprint(entity) -> Tuple:
+    # Only fields that matter for resolving the peer; status/photo churn is ignored
+    return (
+        getattr(entity, "access_hash", None),
+        getattr(entity, "username", None),
+        getattr(entity, "phone", None),
+        getattr(entity, "first_name", None),
+        getattr(entity, "last_name", None),
+        getattr(entity, "title", None)
+    )
+
+class PeerStore:
+    """
+    SQLite store of entity snapshots (User/Chat/Channel, including access
+    hashes), keyed by marked peer id, so peers seen by a previous run can be
+    resolved after a restart without syncing dialogs.
+
+    `add()` only buffers the entity, and only if its access hash, username,
+    phone or name changed since it was last stored. A writer task commits
+    buffered entities in one transaction every `commit_interval` seconds.
+    `open()` returns every stored entity, to be fed to the Telethon session.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 2.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._known: Dict[int, Tuple] = {}
+        self._buffer: Dict[int, Any] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {"loaded": 0, "skipped": 0, "buffered": 0, "written": 0, "commits": 0}
+
+    # --- Lifecycle ---
+
+    async def open(self) -> List[Any]:
+        """Opens the database and returns the stored entities."""
+        if self._conn is not None:
+            return []
+        self._wakeup = asyncio.Event()
+        entities = await asyncio.to_thread(self._open)
+        for entity in entities:
+            self._known[get_peer_id(entity)] = _fingerprint(entity)
+        self._writer_task = asyncio.create_task(self._writer_loop(), name="peerstore-writer")
+        logger.info(f"Entity store opened at {self.path} ({len(entities)} entities).")
+        return entities
+
+    async def close(self) -> None:
+        """Flushes buffered entities and closes the database."""
+        if self._conn is None:
+            return
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        await self._flush()
+        async with self._db_lock:
+            self._conn.close()
+        self._conn = None
+        logger.info(f"Entity store closed ({len(self._known)} entities).")
+
+    # --- Write path ---
+
+    def add(self, entity: Any) -> None:
+        """Buffers an entity for the next commit if it is new or changed."""
+        if not isinstance(entity, _STORABLE) or getattr(entity, "min", False):
+            return
+        peer_id = get_peer_id(entity)
+        fingerprint = _fingerprint(entity)
+        if self._known.get(peer_id) == fingerprint:
+            return
+        self._known[peer_id] = fingerprint
+        self._buffer[peer_id] = entity
+        self.counters["buffered"] += 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "entities": len(self._known), "pending": len(self._buffer), **self.counters}
+
+    # --- Internals (SQLite calls run in a worker thread, serialized by _db_lock) ---
+
+    def _open(self) -> List[Any]:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+
+        entities = []
+        for peer_id, snapshot in conn.execute("SELECT peer_id, snapshot FROM entities"):
+            try:
+                entities.append(BinaryReader(snapshot).tgread_object())
+            except Exception as e:
+                # e.g. a snapshot from an older TL layer
+                self.counters["skipped"] += 1
+                logger.debug(f"Skipping unreadable snapshot for {peer_id}: {e}")
+        self.counters["loaded"] = len(entities)
+        return entities
+
+    def _commit(self, rows: List[Tuple]) -> None:
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entities (peer_id, access_hash, username, phone, snapshot, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def _flush(self) -> None:
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, {}
+        now = time.time()
+        rows = []
+        for peer_id, entity in buffer.items():
+            try:
+                snapshot = bytes(entity)
+            except Exception as e:
+                # Not serializable (e.g. built locally with missing fields); keep it out of the batch
+                self._known.pop(peer_id, None)
+                logger.debug(f"Cannot serialize entity {peer_id}: {e}")
+                continue
+            rows.append((
+                peer_id,
+                getattr(entity, "access_hash", None),
+                getattr(entity, "username", None),
+                getattr(entity, "phone", None),
+                snapshot,
+                now
+            ))
+        if not rows:
+            return
+
+        async with self._db_lock:
+            try:
+                await asyncio.to_thread(self._commit, rows)
+            except Exception as e:
+                logger.error(f"Entity store commit failed: {e}")
+                # Newer versions buffered meanwhile win over the failed ones
+                self._buffer = {**buffer, **self._buffer}
+                return
+        self.counters["commits"] += 1
+        self.counters["written"] += len(rows)
+
+    async def _writer_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Linger so a burst of new entities shares one transaction
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            await self._flush()
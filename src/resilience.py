@@ -0,0 +1,138 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger("telegram_resilience")
+
+class TokenBucket:
+    """
+    Async token bucket. `rate` tokens per second, up to `burst` stored.
+    A rate of 0 disables throttling.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+        self.wait_total = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                self.throttled += 1
+                self.wait_total += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_limit": self.rate or "unlimited",
+            "throttled": self.throttled,
+            "throttle_wait_s": round(self.wait_total, 2)
+        }
+
+class CircuitBreaker:
+    """
+    Closed -> (failure_threshold consecutive failures) -> Open.
+    Open rejects calls until reset_timeout has passed, then goes Half-Open and
+    lets a single trial call through: success closes the circuit, failure
+    re-opens it with the timeout doubled (capped at max_reset_timeout).
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 300.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self.counters: Dict[str, int] = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """Returns True if a call may go out now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+            logger.info(f"Circuit '{self.name}' half-open. Sending a trial request.")
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed. Destination recovered.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self._trial_in_flight = False
+            return
+
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            self._open()
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+        self.counters["opened"] += 1
+        logger.warning(f"Circuit '{self.name}' open after {self.failures} failure(s). Retrying in {self.reset_timeout:.0f}s.")
+
+    def retry_in(self) -> float:
+        """Seconds until the next call will be let through (0 if now)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_s": round(self.retry_in(), 1),
+            **self.counters
+        }
+
+class DestinationGuard:
+    """Rate limiter and circuit breaker for one delivery destination."""
+
+    def __init__(self, name: str, rate: float, burst: int, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    def retry_at(self) -> float:
+        """Wall-clock time worth retrying a deferred delivery (with a little jitter)."""
+        return time.time() + self.breaker.retry_in() + random.uniform(0, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.breaker.stats(), **self.bucket.stats()}
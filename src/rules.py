@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import time
+import logging
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from telethon.tl import types
+from telethon.utils import get_peer_id, resolve_id
+
+logger = logging.getLogger("telegram_rules")
+
+ACTION_FORWARD = "forward"
+ACTION_DROP = "drop"
+CHAT_TYPES = ("private", "group", "supergroup", "channel")
+MEDIA_MODES = ("any", "only", "none")
+
+# Rule file format (JSON):
+#
+# {
+#     "default": "forward",
+#     "rules": [
+#         {"name": "no-bots", "action": "drop", "senders": [93372553]},
+#         {"name": "alerts", "action": "forward", "chats": [1234567890],
+#          "keywords": ["urgent", "outage"], "regex": ["INC-\\d+"], "media": "any"},
+#         {"name": "quiet-channels", "action": "drop", "chat_types": ["channel"]}
+#     ]
+# }
+#
+# Rules are checked in order and the first match decides. Conditions inside a
+# rule must all match (AND); values inside one condition are alternatives (OR).
+# Chat/sender ids may be raw or marked (-100...) ids.
+
+class CompiledRule:
+    """A rule reduced to set lookups and (at most) two precompiled regexes."""
+    __slots__ = ("name", "action", "chats", "chat_types", "senders", "keywords", "regex", "media", "hits")
+
+    def __init__(self, index: int, spec: Dict[str, Any]):
+        self.name = spec.get("name") or f"rule-{index}"
+        self.action = spec.get("action", ACTION_FORWARD)
+        if self.action not in (ACTION_FORWARD, ACTION_DROP):
+            raise ValueError(f"{self.name}: action must be '{ACTION_FORWARD}' or '{ACTION_DROP}'")
+
+        self.chats = _id_set(spec.get("chats"))
+        self.senders = _id_set(spec.get("senders"))
+
+        chat_types = spec.get("chat_types")
+        if chat_types:
+            unknown = set(chat_types) - set(CHAT_TYPES)
+            if unknown:
+                raise ValueError(f"{self.name}: unknown chat_types {sorted(unknown)}")
+            self.chat_types: Optional[FrozenSet[str]] = frozenset(chat_types)
+        else:
+            self.chat_types = None
+
+        # All keywords of a rule become one case-insensitive alternation
+        keywords = spec.get("keywords")
+        self.keywords = re.compile("|".join(re.escape(k) for k in keywords), re.IGNORECASE) if keywords else None
+        patterns = spec.get("regex")
+        self.regex = re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+        self.media = spec.get("media", "any")
+        if self.media not in MEDIA_MODES:
+            raise ValueError(f"{self.name}: media must be one of {', '.join(MEDIA_MODES)}")
+        self.hits = 0
+
+    def matches(self, chat_id: int, sender_id: Optional[int], chat_type: str, text: str, has_media: bool) -> bool:
+        # Cheapest checks first; regexes only run if every set lookup passed
+        if self.chats is not None and chat_id not in self.chats:
+            return False
+        if self.senders is not None and sender_id not in self.senders:
+            return False
+        if self.chat_types is not None and chat_type not in self.chat_types:
+            return False
+        if self.media == "only" and not has_media:
+            return False
+        if self.media == "none" and has_media:
+            return False
+        if self.keywords is not None and not self.keywords.search(text):
+            return False
+        if self.regex is not None and not self.regex.search(text):
+            return False
+        return True
+
+class RuleSet:
+    """An ordered list of compiled rules plus the default action."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.default = spec.get("default", ACTION_FORWARD)
+        if self.default not in (ACTION_FORWARD, ACTION_DROP):
+            raise ValueError(f"default must be '{ACTION_FORWARD}' or '{ACTION_DROP}'")
+        self.rules: List[CompiledRule] = [CompiledRule(i, r) for i, r in enumerate(spec.get("rules", []))]
+        self.default_hits = 0
+
+    def evaluate(self, message) -> Tuple[bool, Optional[str]]:
+        """
+        Decides whether a raw Telethon message should be forwarded.
+        Uses only fields already on the message (no entity lookups).
+        Returns (forward, matched rule name or None for the default).
+        """
+        chat_id = get_peer_id(message.peer_id, add_mark=False)
+        sender_peer = message.from_id or message.peer_id
+        sender_id = get_peer_id(sender_peer, add_mark=False) if sender_peer else None
+        chat_type = peer_chat_type(message)
+        text = message.message or ""
+        has_media = message.media is not None and not isinstance(message.media, types.MessageMediaWebPage)
+
+        for rule in self.rules:
+            if rule.matches(chat_id, sender_id, chat_type, text, has_media):
+                rule.hits += 1
+                return rule.action == ACTION_FORWARD, rule.name
+
+        self.default_hits += 1
+        return self.default == ACTION_FORWARD, None
+
+    def stats(self) -> Dict[str, int]:
+        stats = {rule.name: rule.hits for rule in self.rules}
+        stats["(default)"] = self.default_hits
+        return stats
+
+def peer_chat_type(message) -> str:
+    """Chat type derived from the peer alone (no entity needed)."""
+    if isinstance(message.peer_id, types.PeerUser):
+        return "private"
+    if isinstance(message.peer_id, types.PeerChat):
+        return "group"
+    # Only broadcast channels produce "post" messages
+    return "channel" if getattr(message, "post", False) else "supergroup"
+
+def _id_set(values) -> Optional[FrozenSet[int]]:
+    if not values:
+        return None
+    return frozenset(resolve_id(int(v))[0] for v in values)
+
+# --- Hot-reloading rule file ---
+
+RULES_PATH = os.getenv("FORWARD_RULES_PATH")
+RULES_RELOAD_INTERVAL = float(os.getenv("FORWARD_RULES_RELOAD_INTERVAL", "2"))
+
+_RULES: Dict[str, Any] = {"ruleset": None, "mtime": None, "checked": float("-inf")}
+
+def load_rules(path: str) -> RuleSet:
+    with open(path, "r", encoding="utf-8") as f:
+        return RuleSet(json.load(f))
+
+def get_ruleset() -> Optional[RuleSet]:
+    """
+    Returns the active rule set, recompiling it if the rule file changed.
+    The file is stat'ed at most every FORWARD_RULES_RELOAD_INTERVAL seconds.
+    Returns None if no rule file is configured (forward everything).
+    """
+    if not RULES_PATH:
+        return None
+
+    now = time.monotonic()
+    if now - _RULES["checked"] < RULES_RELOAD_INTERVAL:
+        return _RULES["ruleset"]
+    _RULES["checked"] = now
+
+    try:
+        mtime = os.stat(RULES_PATH).st_mtime
+    except OSError as e:
+        if _RULES["mtime"] is not None:
+            logger.error(f"Rule file {RULES_PATH} unavailable ({e}). Keeping current rules.")
+        _RULES["mtime"] = None
+        return _RULES["ruleset"]
+
+    if mtime != _RULES["mtime"]:
+        _RULES["mtime"] = mtime
+        try:
+            ruleset = load_rules(RULES_PATH)
+            _RULES["ruleset"] = ruleset
+            logger.info(f"Loaded {len(ruleset.rules)} forwarding rule(s) from {RULES_PATH} (default: {ruleset.default}).")
+        except Exception as e:
+            logger.error(f"Invalid rule file {RULES_PATH}: {e}. Keeping current rules.")
+
+    return _RULES["ruleset"]
+
+def get_rule_stats() -> Optional[Dict[str, int]]:
+    ruleset = _RULES["ruleset"]
+    return ruleset.stats() if ruleset else None
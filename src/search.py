@@ -0,0 +1,288 @@
+import math
+import heapq
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from telethon.utils import get_peer_id
+
+# Cyrillic -> Latin, so "Иван" and "ivan" meet in the middle
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "ґ": "g", "д": "d", "е": "e", "ё": "e", "є": "e",
+    "ж": "zh", "з": "z", "и": "i", "і": "i", "ї": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh",
+    "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e",
+    "ю": "yu", "я": "ya"
+})
+
+# Minimum Dice similarity (over trigrams) for a fuzzy token match
+FUZZY_MIN = 0.5
+# Token length difference still considered for a fuzzy match (one or two typos)
+FUZZY_LENGTH_SLACK = 2
+# Tokens a single trigram may point to before it is too common to help
+TRIGRAM_MAX_POSTINGS = 5000
+
+def normalize(text: str) -> str:
+    """Lowercases, strips accents and transliterates to Latin."""
+    text = unicodedata.normalize("NFKD", text.lower().translate(_TRANSLIT))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def _words(text: str) -> List[str]:
+    return ["".join(c for c in word if c.isalnum()) for word in normalize(text).split()]
+
+def _terms(query: str) -> List[str]:
+    # Query words; a run of digit groups ("+1 555 123") is one phone term,
+    # as phones are indexed as a single run of digits
+    terms: List[str] = []
+    for word in _words(query):
+        if word.isdigit() and terms and terms[-1].isdigit():
+            terms[-1] += word
+        elif word:
+            terms.append(word)
+    return terms
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _display_name(entity: Any) -> str:
+    title = getattr(entity, "title", None)
+    if title:
+        return title
+    return f"{getattr(entity, 'first_name', None) or ''} {getattr(entity, 'last_name', None) or ''}".strip()
+
+class _Doc:
+    __slots__ = ("entity", "tokens", "contact", "dialog")
+
+    def __init__(self, entity: Any, tokens: Tuple[str, ...]):
+        self.entity = entity
+        self.tokens = tokens
+        self.contact = False
+        self.dialog = False
+
+class PeerSearchIndex:
+    """
+    In-memory search over the names, usernames and phones of contacts and
+    dialogs, for search_contacts.
+
+    Every field is split into normalized tokens (see `normalize()`), plus
+    the whole name run together so "johnsm" finds "John Smith". Tokens are
+    kept in a sorted list for prefix lookups and in a trigram index for
+    fuzzy ones. Peers are added and re-indexed as the contacts cache and the
+    dialog index change; a peer stays while it is a contact or a dialog.
+    """
+
+    def __init__(self):
+        self._docs: Dict[int, _Doc] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._sorted: List[str] = []
+        # (trigram, token length) -> tokens, so fuzzy lookups skip tokens of very different length
+        self._trigram_tokens: Dict[Tuple[str, int], Set[str]] = defaultdict(set)
+        self.contacts_loaded = False
+        self.counters: Dict[str, int] = {"searches": 0, "prefix_hits": 0, "fuzzy_hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # --- Writes ---
+
+    @staticmethod
+    def _tokens(entity: Any) -> Tuple[str, ...]:
+        tokens: Set[str] = set()
+        words = [w for w in _words(_display_name(entity)) if w]
+        tokens.update(words)
+        if len(words) > 1:
+            tokens.add("".join(words))
+        usernames = [getattr(entity, "username", None)]
+        usernames += [u.username for u in getattr(entity, "usernames", None) or ()]
+        tokens.update("".join(c for c in u.lower() if c.isalnum()) for u in usernames if u)
+        phone = "".join(c for c in getattr(entity, "phone", None) or "" if c.isdigit())
+        if phone:
+            tokens.add(phone)
+        return tuple(tokens)
+
+    def _link(self, peer_id: int, tokens: Iterable[str]) -> None:
+        for token in tokens:
+            peers = self._postings.get(token)
+            if peers is None:
+                peers = self._postings[token] = set()
+                insort(self._sorted, token)
+                for gram in _trigrams(token):
+                    self._trigram_tokens[gram, len(token)].add(token)
+            peers.add(peer_id)
+
+    def _unlink(self, peer_id: int, tokens: Iterable[str]) -> None:
+        for token in tokens:
+            peers = self._postings.get(token)
+            if peers is None:
+                continue
+            peers.discard(peer_id)
+            if not peers:
+                del self._postings[token]
+                del self._sorted[bisect_left(self._sorted, token)]
+                for gram in _trigrams(token):
+                    bucket = self._trigram_tokens[gram, len(token)]
+                    bucket.discard(token)
+                    if not bucket:
+                        del self._trigram_tokens[gram, len(token)]
+
+    def add(self, entity: Any, contact: bool = False, dialog: bool = False) -> None:
+        """Adds or re-indexes a peer (entity changes such as renames are picked up)."""
+        peer_id = get_peer_id(entity)
+        tokens = self._tokens(entity)
+        doc = self._docs.get(peer_id)
+        if doc is None:
+            doc = self._docs[peer_id] = _Doc(entity, tokens)
+            self._link(peer_id, tokens)
+        else:
+            if set(tokens) != set(doc.tokens):
+                self._unlink(peer_id, doc.tokens)
+                self._link(peer_id, tokens)
+                doc.tokens = tokens
+            doc.entity = entity
+        doc.contact = doc.contact or contact
+        doc.dialog = doc.dialog or dialog
+
+    def set_contacts(self, users: Iterable[Any]) -> None:
+        """Replaces the contact set; peers that are neither contacts nor dialogs any more are dropped."""
+        current = set()
+        for user in users:
+            self.add(user, contact=True)
+            current.add(get_peer_id(user))
+        for peer_id, doc in list(self._docs.items()):
+            if doc.contact and peer_id not in current:
+                doc.contact = False
+                self._drop_unused(peer_id, doc)
+        self.contacts_loaded = True
+
+    def remove_dialogs(self, peer_ids: Iterable[int]) -> None:
+        """Peers that left the dialog list (left chats, deleted dialogs); dropped unless contacts."""
+        for peer_id in peer_ids:
+            doc = self._docs.get(peer_id)
+            if doc is not None and doc.dialog:
+                doc.dialog = False
+                self._drop_unused(peer_id, doc)
+
+    def _drop_unused(self, peer_id: int, doc: _Doc) -> None:
+        if not doc.contact and not doc.dialog:
+            self._unlink(peer_id, doc.tokens)
+            del self._docs[peer_id]
+
+    # --- Search ---
+
+    def _prefix(self, term: str) -> Dict[str, float]:
+        tokens = self._sorted[bisect_left(self._sorted, term):bisect_left(self._sorted, term + "\uffff")]
+        # Exact 1.0; prefixes score by how much of the token they cover
+        n = 0.3 * len(term)
+        matches = {token: 0.6 + n / len(token) for token in tokens}
+        if term in matches:
+            matches[term] = 1.0
+        return matches
+
+    def _fuzzy(self, term: str) -> Dict[str, float]:
+        grams = _trigrams(term)
+        lengths = range(max(1, len(term) - FUZZY_LENGTH_SLACK), len(term) + FUZZY_LENGTH_SLACK + 1)
+        buckets: Dict[str, List[Set[str]]] = {}
+        for gram in grams:
+            buckets[gram] = [
+                tokens for tokens in (self._trigram_tokens.get((gram, length)) for length in lengths)
+                if tokens and len(tokens) <= TRIGRAM_MAX_POSTINGS
+            ]
+        # Fewer shared trigrams than this cannot reach FUZZY_MIN for any
+        # candidate length. So a match shares at least one of the
+        # len(grams) - need + 1 rarest trigrams: only those are counted in
+        # full, the others only for the tokens they turned up.
+        need = math.ceil(FUZZY_MIN * (len(grams) + lengths.start + 1) / 2)
+        ordered = sorted(grams, key=lambda gram: sum(map(len, buckets[gram])))
+        split = max(1, len(grams) - need + 1)
+        shared: Counter = Counter()
+        for gram in ordered[:split]:
+            for tokens in buckets[gram]:
+                shared.update(tokens)
+        candidates = set(shared)
+        for gram in ordered[split:]:
+            for tokens in buckets[gram]:
+                shared.update(tokens & candidates)
+        matches: Dict[str, float] = {}
+        for token, count in shared.items():
+            if count < need:
+                continue
+            # A token of length n has n + 1 padded trigrams
+            dice = 2 * count / (len(grams) + len(token) + 1)
+            if dice >= FUZZY_MIN:
+                matches[token] = 0.5 * dice
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[Any]:
+        """
+        Entities matching every word of `query` (by prefix, or fuzzily when
+        a word has no prefix match), best first. Contacts rank above other
+        peers on equal scores.
+        """
+        self.counters["searches"] += 1
+        terms = _terms(query)
+        if not terms:
+            return []
+        per_term: List[Dict[str, float]] = []
+        fuzzy = False
+        for term in terms:
+            matches = self._prefix(term)
+            if not matches:
+                matches = self._fuzzy(term)
+                fuzzy = True
+            if not matches:
+                self.counters["misses"] += 1
+                return []
+            per_term.append(matches)
+
+        # Walk the most selective word's tokens best first; the other words
+        # are scored against each candidate's own tokens
+        if len(per_term) > 1:
+            per_term.sort(key=lambda m: sum(len(self._postings[t]) for t in m))
+        first, rest = per_term[0], per_term[1:]
+        docs = self._docs
+        scored: Dict[int, float] = {}
+        contacts = 0
+        for token in sorted(first, key=first.get, reverse=True):
+            score = first[token]
+            if not rest and len(scored) >= limit and score < min(scored.values()):
+                # A single word: nothing further down can rank higher
+                break
+            for peer_id in self._postings[token]:
+                if peer_id in scored:
+                    continue
+                if not rest and len(scored) >= limit:
+                    # Enough at this score; only contacts can still rank higher
+                    if contacts >= limit:
+                        break
+                    if not docs[peer_id].contact:
+                        continue
+                contacts += docs[peer_id].contact
+                total = score
+                for matches in rest:
+                    best = max((matches.get(t, 0.0) for t in docs[peer_id].tokens), default=0.0)
+                    if not best:
+                        break
+                    total += best
+                else:
+                    scored[peer_id] = total
+        if not scored:
+            self.counters["misses"] += 1
+            return []
+        self.counters["fuzzy_hits" if fuzzy else "prefix_hits"] += 1
+        ranked = heapq.nsmallest(limit, scored, key=lambda p: (-scored[p], not docs[p].contact, p))
+        return [docs[p].entity for p in ranked]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "peers": len(self._docs),
+            "tokens": len(self._postings),
+            "trigrams": len(self._trigram_tokens),
+            "contacts_loaded": self.contacts_loaded,
+            **self.counters
+        }
+
+_INDEX = PeerSearchIndex()
+
+def get_search_index() -> PeerSearchIndex:
+    return _INDEX
@@ -4,9 +4,16 @@ import logging
 import asyncio
 from fastmcp import FastMCP
 from dotenv import load_dotenv
-from .tools import messages, chats, contacts, admin, profile, media, interactions
+from .tools import messages, chats, contacts, admin, profile, media, interactions, diagnostics
 from .client import client
-from .forwarder import setup_forwarder
+from .cache import start_entity_store, stop_entity_store, warm_caches
+from .messagestore import start_message_store, stop_message_store
+from .export import stop_exports
+from .dialogs import setup_dialog_index
+from .forwarder import (
+    setup_forwarder, open_http_client, close_http_client, start_delivery, stop_delivery, seed_mute_cache,
+    load_dedupe_state, save_dedupe_state, stop_entity_fill
+)
 
 # Configure Logging
 logging.basicConfig(
@@ -31,11 +38,32 @@ async def server_lifespan(server: FastMCP):
     # Startup logic
     # print("Connecting Telegram Client for Forwarder...")
     await client.connect()
+    await start_entity_store()
+    await start_message_store()
+    await open_http_client()
+    await start_delivery()
+    load_dedupe_state()
     setup_forwarder(client)
+    setup_dialog_index(client)
+    # Seed mute status in the background so startup is not blocked on get_dialogs
+    seed_task = asyncio.create_task(seed_mute_cache(client))
+    # Pre-warm contacts and get_me the same way
+    warm_task = asyncio.create_task(warm_caches())
     # print("Telegram Forwarder Connected.")
-    yield
-    # Shutdown logic
-    await client.disconnect()
+    try:
+        yield
+    finally:
+        # Shutdown logic: drain pending deliveries before closing the pool
+        seed_task.cancel()
+        warm_task.cancel()
+        await stop_entity_fill()
+        await stop_exports()
+        await stop_delivery()
+        save_dedupe_state()
+        await close_http_client()
+        await stop_entity_store()
+        await stop_message_store()
+        await client.disconnect()
 
 # Authentication
 try:
@@ -75,6 +103,8 @@ mcp.tool()(interactions.get_message_context)
 
 # Message Tools
 mcp.tool()(messages.get_messages)
+mcp.tool()(messages.search_messages)
+mcp.tool()(messages.export_chat_history)
 mcp.tool()(messages.send_message)
 mcp.tool()(messages.list_inline_buttons)
 mcp.tool()(messages.press_inline_button)
@@ -102,6 +132,10 @@ mcp.tool()(admin.create_group)
 mcp.tool()(profile.get_me)
 mcp.tool()(profile.update_profile)
 
+# Diagnostics Tools
+mcp.tool()(diagnostics.get_forwarder_stats)
+mcp.tool()(diagnostics.get_cache_stats)
+
 if __name__ == "__main__":
     host = "127.0.0.1"
     port = 4444
@@ -2,11 +2,11 @@ from typing import Union, Optional
 from ..client import client
 from ..cache import (
     get_or_fetch_entity, 
-    get_cached_dialogs, 
-    set_cached_dialogs
+    get_cached_mute_status,
+    set_cached_mute_status
 )
-from ..utils import log_and_format_error
-import time
+from ..dialogs import get_dialog_index, DIALOGS_EXTEND_LIMIT
+from ..utils import log_and_format_error, is_mute_active
 from telethon import functions
 from telethon.tl.types import Chat, Channel
 
@@ -22,21 +22,13 @@ async def get_chats(page: int = 1, page_size: int = 20) -> str:
         start_index = (page - 1) * page_size
         end_index = start_index + page_size
 
-        # Check cache validity and coverage
-        cached_data = get_cached_dialogs(end_index)
-        
-        if cached_data:
-             dialogs = cached_data
-        else:
-            # Cache miss or partial cache
-            limit = max(100, end_index + 20)
-            dialogs = await client.get_dialogs(limit=limit)
-            set_cached_dialogs(dialogs)
+        # Update-driven dialog index; only fetches if it does not cover this page yet
+        index = await get_dialog_index(min_count=end_index)
 
         # Slice
-        chats = dialogs[start_index:end_index]
+        chats = index.page(start_index, end_index)
         
-        if not chats and start_index >= len(dialogs):
+        if not chats and start_index >= len(index):
              return "Page out of range."
 
         lines = []
@@ -50,23 +42,10 @@ async def get_chats(page: int = 1, page_size: int = 20) -> str:
             if dialog.is_group: c_type = "Group"
             elif dialog.is_channel: c_type = "Channel"
             
-            # Determine Mute Status
-            is_muted = False
-            settings = getattr(dialog, "notify_settings", None)
-            if not settings and hasattr(dialog, "dialog"):
-                 # Sometimes it's nested in the 'dialog' attribute (TL object)
-                 settings = getattr(dialog.dialog, "notify_settings", None)
-                 
-            if settings:
-                 import datetime
-                 now = datetime.datetime.now(datetime.timezone.utc)
-                 if settings.mute_until:
-                     if isinstance(settings.mute_until, int):
-                         if settings.mute_until > time.time():
-                             is_muted = True
-                     elif hasattr(settings.mute_until, 'timestamp'):
-                         if settings.mute_until > now:
-                             is_muted = True
+            # Determine Mute Status (event-driven cache first; it is newer than the dialog snapshot)
+            is_muted = get_cached_mute_status(chat_id)
+            if is_muted is None:
+                is_muted = is_mute_active(dialog.mute_until)
                      
             mute_str = " [MUTED]" if is_muted else ""
             
@@ -142,30 +121,20 @@ async def get_unread_chats(limit: int = 10) -> str:
         limit: Maximum number of unread chats to return (default: 10).
     """
     try:
-        # Fetch dialogs (chats)
-        # We fetch a bit more than limit to ensure we find enough unread ones if they are scattered
-        dialogs = await client.get_dialogs(limit=limit * 5)
-        
-        unread_chats = []
-        for d in dialogs:
-            # Check for unread count or unread mark (manual)
-            # Safely check for unread_mark as it might not be exposed on all Dialog wrappers
-            # We check both the wrapper 'd' and the underlying 'd.dialog' if possible
-            is_unread = d.unread_count > 0
-            
-            if not is_unread:
-                is_unread = getattr(d, 'unread_mark', False)
-                
-            if not is_unread and hasattr(d, 'dialog'):
-                is_unread = getattr(d.dialog, 'unread_mark', False)
+        # Unread counts and unread marks are kept current by read updates.
+        # Look as deep as the old limit * 5 fetch did, then extend the index
+        # page by page until enough unread chats turn up or the list ends.
+        index = await get_dialog_index(min_count=limit * 5)
+        found = index.unread(limit)
+        while len(found) < limit and not index.complete:
+            index = await get_dialog_index(min_count=len(index) + DIALOGS_EXTEND_LIMIT)
+            found = index.unread(limit)
 
-            if is_unread:
-                entity = d.entity
-                chat_title = getattr(entity, "title", None) or getattr(entity, "first_name", "Unknown")
-                unread_chats.append(f"Chat: {chat_title} (ID: {entity.id}) - Unread: {d.unread_count}")
-                
-                if len(unread_chats) >= limit:
-                    break
+        unread_chats = []
+        for d in found:
+            entity = d.entity
+            chat_title = getattr(entity, "title", None) or getattr(entity, "first_name", "Unknown")
+            unread_chats.append(f"Chat: {chat_title} (ID: {entity.id}) - Unread: {d.unread_count}")
         
         if not unread_chats:
             return "No unread chats found."
@@ -207,8 +176,7 @@ async def mute_chat(chat_id: Union[int, str], duration_seconds: int = 0) -> str:
         ))
         
         # Update cache immediately so it reflects
-        from ..cache import set_cached_mute_status
-        set_cached_mute_status(entity.id, True)
+        set_cached_mute_status(entity.id, True, mute_until.timestamp())
 
         duration_str = "forever" if duration_seconds == 0 else f"for {duration_seconds} seconds"
         return f"Muted chat {chat_id} {duration_str}."
@@ -241,8 +209,7 @@ async def unmute_chat(chat_id: Union[int, str]) -> str:
         ))
         
         # Update cache
-        from ..cache import set_cached_mute_status
-        set_cached_mute_status(entity.id, False)
+        set_cached_mute_status(entity.id, False, 0.0)
         
         return f"Unmuted chat {chat_id}."
         
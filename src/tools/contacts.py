@@ -2,29 +2,22 @@ from typing import Union, Optional
 from ..client import client
 from ..cache import (
     get_or_fetch_entity,
-    get_cached_contacts,
-    set_cached_contacts,
-    get_cached_dialogs,
-    set_cached_dialogs,
+    get_or_fetch_contacts,
     cache_entity
 )
+from ..dialogs import get_dialog_index
+from ..search import get_search_index
 from ..utils import log_and_format_error, format_entity
 from telethon import functions
+from telethon.utils import get_peer_id
 
 async def list_contacts() -> str:
     """
     List all contacts.
     """
     try:
-        cached_contacts = get_cached_contacts()
-        if cached_contacts:
-            contacts = cached_contacts
-        else:
-            contacts = await client(functions.contacts.GetContactsRequest(hash=0))
-            # Cache individual users from the contacts list for entity lookups
-            for user in contacts.users:
-                cache_entity(user.id, user)
-            set_cached_contacts(contacts)
+        # Served from cache; once expired, the stale list is returned while it refreshes
+        contacts = await get_or_fetch_contacts()
 
         if not contacts.users:
             return "No contacts found."
@@ -41,22 +34,19 @@ async def list_contacts() -> str:
 async def search_contacts(query: str, limit: int = 10) -> str:
     """
     Search for contacts or users on Telegram.
-    Checks local contacts cache first.
+    Checks contacts and dialogs first (by name, username or phone; prefix,
+    typo- and script-tolerant), then searches Telegram globally.
     """
     try:
-        # 1. Search local cache first
-        local_results = []
-        cached_contacts = get_cached_contacts()
-        if cached_contacts:
-            q_lower = query.lower()
-            for user in cached_contacts.users:
-                name = f"{user.first_name or ''} {user.last_name or ''}".strip().lower()
-                username = (user.username or "").lower()
-                if q_lower in name or q_lower in username:
-                     local_results.append(format_entity(user))
+        # 1. Search the local index (contacts + dialogs) first
+        index = get_search_index()
+        if not index.contacts_loaded:
+            # Loading contacts fills the index; cheaper than a global search
+            await get_or_fetch_contacts()
+        local_results = [format_entity(entity) for entity in index.search(query, limit)]
         
         if local_results:
-             return f"Found in Contacts:\n" + "\n".join([str(r) for r in local_results[:limit]])
+             return f"Found in Contacts/Chats:\n" + "\n".join([str(r) for r in local_results])
 
         # 2. Global Search
         result = await client(functions.contacts.SearchRequest(
@@ -83,14 +73,12 @@ async def get_direct_chat_by_contact(contact_id: Union[int, str]) -> str:
     try:
         # Resolve contact first
         contact = await get_or_fetch_entity(contact_id)
-        target_id = contact.id
         
-        # Check cached dialogs
-        cached_dialogs = get_cached_dialogs(limit=100) # Check recent
-        if cached_dialogs:
-            for d in cached_dialogs:
-                if d.entity.id == target_id:
-                     return f"Found Cached Dialog | ID: {d.entity.id} | Title: {getattr(d.entity, 'first_name', 'Unknown')}"
+        # Check the dialog index (direct lookup by peer)
+        index = await get_dialog_index()
+        d = index.get(get_peer_id(contact))
+        if d is not None:
+            return f"Found Cached Dialog | ID: {d.entity.id} | Title: {getattr(d.entity, 'first_name', 'Unknown')}"
         
         # If not in cache, we technically should fetch fresh dialogs or just try to get_entity
         # returning the entity info is enough to start a chat usually
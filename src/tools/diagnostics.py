@@ -0,0 +1,81 @@
+from ..forwarder import get_destinations, get_resolve_stats, get_dedupe_stats
+from ..rules import get_rule_stats
+from .. import cache
+from ..dialogs import get_dialog_stats
+from ..history import get_message_windows, get_history_reader
+from ..search import get_search_index
+from ..messagestore import get_message_store
+from ..utils import log_and_format_error
+
+async def get_forwarder_stats() -> str:
+    """
+    Get delivery statistics for the Telegram -> Poke forwarder
+    (per-destination queue depth, delivered/failed/dropped counts, latency).
+    """
+    try:
+        destinations = [d for d in get_destinations() if d.queue]
+        if not destinations:
+            return "Forwarder delivery queue is not running."
+
+        lines = []
+        for destination in destinations:
+            lines.append(f"Destination '{destination.name}':")
+            for key, value in destination.stats().items():
+                lines.append(f"  {key}: {value}")
+            lines.append("  Delivery queue:")
+            for key, value in destination.queue.stats().items():
+                lines.append(f"    {key}: {value}")
+            if destination.outbox:
+                lines.append("  Outbox:")
+                for key, value in destination.outbox.stats().items():
+                    lines.append(f"    {key}: {value}")
+
+        lines.append("Sender/chat resolution (update/cache hits vs. misses):")
+        for key, value in get_resolve_stats().items():
+            lines.append(f"  {key}: {value}")
+
+        lines.append("Duplicate suppression:")
+        for key, value in get_dedupe_stats().items():
+            lines.append(f"  {key}: {value}")
+
+        rule_stats = get_rule_stats()
+        if rule_stats is not None:
+            lines.append("Forwarding rule hits:")
+            for name, hits in rule_stats.items():
+                lines.append(f"  {name}: {hits}")
+
+        return "\n".join(lines)
+    except Exception as e:
+        return log_and_format_error("get_forwarder_stats", e)
+
+async def get_cache_stats() -> str:
+    """
+    Get statistics for the in-memory caches
+    (entries, size budget, hits, misses, expirations and evictions).
+    """
+    try:
+        lines = []
+        for name, stats in cache.get_cache_stats().items():
+            lines.append(f"Cache '{name}':")
+            for key, value in stats.items():
+                lines.append(f"  {key}: {value}")
+        lines.append("Dialog index:")
+        for key, value in get_dialog_stats().items():
+            lines.append(f"  {key}: {value}")
+        lines.append("Message windows:")
+        for key, value in get_message_windows().stats().items():
+            lines.append(f"  {key}: {value}")
+        lines.append("History reads:")
+        for key, value in get_history_reader().stats().items():
+            lines.append(f"  {key}: {value}")
+        lines.append("Search index:")
+        for key, value in get_search_index().stats().items():
+            lines.append(f"  {key}: {value}")
+        store = get_message_store()
+        if store is not None:
+            lines.append("Message index:")
+            for key, value in store.stats().items():
+                lines.append(f"  {key}: {value}")
+        return "\n".join(lines)
+    except Exception as e:
+        return log_and_format_error("get_cache_stats", e)
@@ -1,8 +1,13 @@
 from typing import Union, Optional, List
 from ..client import client
 from ..cache import get_or_fetch_entity
+from ..formatting import format_context_line
+from ..history import get_message_windows, to_record
+from ..messagestore import index_messages
 from ..utils import log_and_format_error
 from telethon import functions, types
+from itertools import chain
+from telethon.utils import get_peer_id
 
 async def react_to_message(chat_id: Union[int, str], message_id: int, emoji: str) -> str:
     """
@@ -70,32 +75,67 @@ async def send_typing_action(chat_id: Union[int, str], action: str = "typing") -
     except Exception as e:
         return log_and_format_error("send_typing_action", e)
 
+# GetHistoryRequest returns at most 100 messages: count + 1 + count <= 100
+MAX_CONTEXT_COUNT = 49
+
+async def _fetch_context(entity, message_id: int, count: int):
+    """
+    (older, target, newer) records around `message_id`, in one history
+    request: offset_id=message_id returns messages below it, and a negative
+    add_offset of count + 1 shifts the slice up to take in the target and
+    the `count` messages after it.
+    """
+    result = await client(functions.messages.GetHistoryRequest(
+        peer=await client.get_input_entity(entity),
+        offset_id=message_id,
+        offset_date=None,
+        add_offset=-(count + 1),
+        limit=2 * count + 1,
+        max_id=0,
+        min_id=0,
+        hash=0
+    ))
+    messages = [m for m in result.messages if not isinstance(m, types.MessageEmpty)]
+    index_messages(messages)
+    senders = {get_peer_id(e): e for e in chain(result.users, result.chats)}
+    records = [to_record(m, senders) for m in messages]
+    # Returned newest first
+    before = [r for r in reversed(records) if r.id < message_id][-count:]
+    after = [r for r in reversed(records) if r.id > message_id][:count]
+    center = next((r for r in records if r.id == message_id), None)
+    return before, center, after
+
 async def get_message_context(chat_id: Union[int, str], message_id: int, count: int = 5) -> str:
     """
     Get context (messages before/after) for a specific message.
     Args:
         chat_id: ID or username.
         message_id: ID of the center message.
-        count: Number of messages *each side* to retrieve.
+        count: Number of messages *each side* to retrieve (at most 49, so
+            the whole context fits in one request).
     """
     try:
+        count = max(0, min(count, MAX_CONTEXT_COUNT))
         entity = await get_or_fetch_entity(chat_id)
         
-        history_before = await client.get_messages(entity, limit=count, max_id=message_id)
-        history_after = await client.get_messages(entity, limit=count, min_id=message_id, reverse=True)
-        center = await client.get_messages(entity, ids=message_id)
+        cached = get_message_windows().context(get_peer_id(entity), message_id, count)
+        if cached is not None:
+            # All ascending already
+            history_before, center, history_after = cached
+        else:
+            history_before, center, history_after = await _fetch_context(entity, message_id, count)
         
         formatted = []
         
-        # Prepend before (reverse to make it chronological)
-        for m in reversed(history_before):
-             formatted.append(f"[{m.id}] {m.message or '<media>'}")
+        # Before (chronological)
+        for r in history_before:
+             formatted.append(format_context_line(r))
              
         if center:
-             formatted.append(f"-> [{center.id}] {center.message or '<media>'} (TARGET)")
+             formatted.append(format_context_line(center, target=True))
              
-        for m in history_after:
-             formatted.append(f"[{m.id}] {m.message or '<media>'}")
+        for r in history_after:
+             formatted.append(format_context_line(r))
              
         return "\n".join(formatted)
     except Exception as e:
@@ -1,9 +1,17 @@
 from fastmcp import FastMCP, Context
-from typing import Union, Optional
+from datetime import datetime, timezone
+from typing import List, Union, Optional
 from ..client import client
-from ..cache import get_or_fetch_entity, get_cached_messages, set_cached_messages, MESSAGE_TTL
-from ..utils import get_sender_name, log_and_format_error
+from ..cache import get_or_fetch_entity
+from ..formatting import format_messages, format_search_hit
+from ..history import (
+    get_message_windows, get_history_reader, to_record, encode_cursor, decode_cursor, HISTORY_CHAT_MAX
+)
+from ..messagestore import MESSAGE_INDEX_RANK_WINDOW, get_message_store, index_messages
+from ..export import start_export, get_export_budget
+from ..utils import log_and_format_error
 from telethon import functions
+from telethon.utils import get_peer_id
 
 # We will attach these to the MCP instance in server.py, 
 # but for modularity, we define the functions here.
@@ -20,45 +28,181 @@ from telethon import functions
 # We can define `mcp` in `server.py` and import it here? Circular import risk.
 # Better: Define functions, and in server.py: `mcp.tool()(imported_function)`.
 
-async def get_messages(chat_id: Union[int, str], page: int = 1, page_size: int = 20) -> str:
+async def get_messages(chat_id: Union[int, str], page: int = 1, page_size: int = 20, cursor: Optional[str] = None) -> str:
     """
-    Get paginated messages from a specific chat.
+    Get paginated messages from a specific chat, newest first.
+    A full page ends with a "Next cursor: ..." line; pass that cursor back
+    to get the next (older) page. Cursor pages do not shift when new
+    messages arrive and stay cheap however deep the history goes.
     Args:
         chat_id: The ID or username of the chat.
-        page: Page number (1-indexed).
+        page: Page number (1-indexed). Ignored when cursor is given.
         page_size: Number of messages per page.
+        cursor: Cursor from a previous call's "Next cursor" line.
     """
     try:
-        # Optimization: Check short-term message cache
-        cache_key = f"{chat_id}_{page}_{page_size}"
-        cached_content = get_cached_messages(cache_key)
-        if cached_content:
-            return cached_content
-
         # Optimization: Use smart entity cache
         entity = await get_or_fetch_entity(chat_id)
-        
-        offset = (page - 1) * page_size
-        messages = await client.get_messages(entity, limit=page_size, add_offset=offset)
-        if not messages:
+        peer_id = get_peer_id(entity)
+        reader = get_history_reader()
+
+        if cursor:
+            cursor_peer, offset_id = decode_cursor(cursor)
+            if cursor_peer != peer_id:
+                return "This cursor belongs to a different chat."
+        else:
+            # Page numbers continue from where the previous page ended, when it was served
+            offset_id = reader.page_cursor(peer_id, page_size, page) if page > 1 else None
+
+        # Message records (from the chat's window or read-ahead); rendered per call
+        if offset_id:
+            records, more = await reader.older(entity, peer_id, offset_id, page_size)
+        else:
+            records = await _get_latest(entity, (page - 1) * page_size, page_size)
+            more = len(records) == page_size
+        if not records:
             return "No messages found for this page."
-        lines = []
-        for msg in messages:
-            sender_name = get_sender_name(msg)
-            reply_info = ""
-            if msg.reply_to and msg.reply_to.reply_to_msg_id:
-                reply_info = f" | reply to {msg.reply_to.reply_to_msg_id}"
-            lines.append(
-                f"ID: {msg.id} | {sender_name} | Date: {msg.date}{reply_info} | Message: {msg.message}"
-            )
-        
-        result = "\n".join(lines)
-        # Cache the result
-        set_cached_messages(cache_key, result)
+
+        if not cursor:
+            reader.remember_page(peer_id, page_size, page + 1, records[-1].id)
+        result = format_messages(records)
+        if more:
+            result += f"\nNext cursor: {encode_cursor(peer_id, records[-1])}"
         return result
     except Exception as e:
         return log_and_format_error("get_messages", e, chat_id=chat_id)
 
+async def _get_latest(entity, offset: int, limit: int) -> list:
+    """
+    Records of the newest messages [offset, offset + limit) of a chat, newest first.
+    Served from the chat's message window; a miss fetches only what the
+    window lacks (older messages below it, or the newest ones if it has none).
+    """
+    windows = get_message_windows()
+    peer_id = get_peer_id(entity)
+    messages = windows.latest(peer_id, offset, limit)
+    if messages is not None:
+        return messages
+
+    need = offset + limit
+    if need > HISTORY_CHAT_MAX:
+        # Deeper than a window keeps; fetch just this page
+        return _fetched_records(await client.get_messages(entity, limit=limit, add_offset=offset))
+
+    extend = windows.below(peer_id)
+    if extend is not None:
+        low, held = extend
+        fetched = await client.get_messages(entity, limit=need - held, max_id=low)
+        windows.add_older(peer_id, fetched, low, reached_start=len(fetched) < need - held)
+    else:
+        fetched = await client.get_messages(entity, limit=need)
+        windows.add_newest(peer_id, fetched, reached_start=len(fetched) < need)
+
+    messages = windows.latest(peer_id, offset, limit)
+    if messages is None:
+        # Window changed under us (e.g. trimmed); fall back to this page only
+        return _fetched_records(await client.get_messages(entity, limit=limit, add_offset=offset))
+    return messages
+
+def _fetched_records(messages: list) -> list:
+    """Records of messages fetched outside the windows; the messages also go to the message index."""
+    index_messages(messages)
+    return [to_record(m) for m in messages]
+
+async def _get_record(entity, message_id: int):
+    """The record of a single message, from the chat's message window if held."""
+    record = get_message_windows().get(get_peer_id(entity), message_id)
+    if record is None:
+        message = await client.get_messages(entity, ids=message_id)
+        record = _fetched_records([message])[0] if message else None
+    return record
+
+def _timestamp(value: str) -> int:
+    # ISO date or datetime; naive ones are taken as UTC
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+async def search_messages(
+    query: str,
+    chat_id: Optional[Union[int, str]] = None,
+    sender_id: Optional[int] = None,
+    since: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = 20
+) -> str:
+    """
+    Full-text search over locally indexed messages, best matches first.
+    Covers messages received or fetched while the message index
+    (TELEGRAM_MESSAGE_INDEX_PATH) was enabled; runs offline.
+    Every word must match; end a word with * to match words starting with it.
+    Only the most recent matches are ranked; the result says when older
+    ones were left out.
+    Args:
+        query: Words to search for.
+        chat_id: Only search this chat (ID or username).
+        sender_id: Only messages from this user ID.
+        since: Only messages on or after this ISO date/time (UTC unless given).
+        before: Only messages before this ISO date/time (UTC unless given).
+        limit: Maximum number of results.
+    """
+    try:
+        store = get_message_store()
+        if store is None:
+            return "Message search is not enabled (set TELEGRAM_MESSAGE_INDEX_PATH)."
+        peer_id = None
+        if chat_id is not None:
+            peer_id = get_peer_id(await get_or_fetch_entity(chat_id))
+        hits, truncated = await store.search(
+            query,
+            peer_id=peer_id,
+            sender_id=sender_id,
+            since=_timestamp(since) if since else None,
+            before=_timestamp(before) if before else None,
+            limit=limit
+        )
+        if not hits:
+            return f"No messages found matching '{query}'."
+        lines = [format_search_hit(hit) for hit in hits]
+        if truncated:
+            lines.append(
+                f"(Only the {MESSAGE_INDEX_RANK_WINDOW} most recent matches were ranked; older ones are not included. "
+                "Narrow the search with chat_id, sender_id, since or before to reach them.)"
+            )
+        return "\n".join(lines)
+    except Exception as e:
+        return log_and_format_error("search_messages", e, query=query, chat_id=chat_id)
+
+async def export_chat_history(
+    chat_ids: Union[int, str, List[Union[int, str]]],
+    file_format: str = "jsonl",
+    update: bool = False
+) -> str:
+    """
+    Export the full history of one or more chats to files on the server,
+    oldest message first, in the background. Several chats are exported
+    concurrently within one shared Telegram request budget.
+    Call again with the same chats to see progress, or the final status
+    once an export has finished. Exports are checkpointed: a failed or
+    interrupted one resumes where it stopped when called again.
+    Args:
+        chat_ids: The ID or username of a chat, or a list of them.
+        file_format: "jsonl", or "parquet" (needs pyarrow on the server).
+        update: Run finished exports again, appending only messages newer than their checkpoint.
+    """
+    try:
+        if not isinstance(chat_ids, list):
+            chat_ids = [chat_ids]
+        lines = []
+        for chat_id in chat_ids:
+            entity = await get_or_fetch_entity(chat_id)
+            lines.append(start_export(entity, file_format, update=update).describe())
+        lines.append(f"Request budget: {get_export_budget().stats()}")
+        return "\n".join(lines)
+    except Exception as e:
+        return log_and_format_error("export_chat_history", e, chat_ids=chat_ids)
+
 async def send_message(chat_id: Union[int, str], text: str) -> str:
     """
     Send a simplified text message.
@@ -82,16 +226,16 @@ async def list_inline_buttons(chat_id: Union[int, str], message_id: int) -> str:
     """
     try:
         entity = await get_or_fetch_entity(chat_id)
-        message = await client.get_messages(entity, ids=message_id)
+        record = await _get_record(entity, message_id)
         
-        if not message or not message.buttons:
+        if not record or not record.buttons:
             return "No buttons found."
             
         rows = []
-        for i, row in enumerate(message.buttons):
+        for i, row in enumerate(record.buttons):
             buttons = []
-            for j, btn in enumerate(row):
-                buttons.append(f"[{i},{j}] {btn.text}")
+            for j, label in enumerate(row):
+                buttons.append(f"[{i},{j}] {label}")
             rows.append(" | ".join(buttons))
             
         return "Buttons:\n" + "\n".join(rows)
@@ -109,6 +253,7 @@ async def press_inline_button(chat_id: Union[int, str], message_id: int, row: in
     """
     try:
         entity = await get_or_fetch_entity(chat_id)
+        # Always the live message: clicking needs it, and its buttons may have changed
         message = await client.get_messages(entity, ids=message_id)
         
         if not message or not message.buttons:
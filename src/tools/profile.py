@@ -1,5 +1,5 @@
 from ..client import client
-from ..cache import get_cached_me, set_cached_me
+from ..cache import get_or_fetch_me
 from ..utils import log_and_format_error, format_entity
 from telethon import functions
 
@@ -8,12 +8,8 @@ async def get_me() -> str:
     Get information about the current user.
     """
     try:
-        cached = get_cached_me()
-        if cached:
-            return str(format_entity(cached))
-            
-        me = await client.get_me()
-        set_cached_me(me)
+        # Served from cache; once expired, the stale copy is returned while it refreshes
+        me = await get_or_fetch_me()
         return str(format_entity(me))
     except Exception as e:
         return log_and_format_error("get_me", e)
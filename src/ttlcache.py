@@ -0,0 +1,157 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class _Entry:
+    __slots__ = ("value", "expires", "size")
+
+    def __init__(self, value: Any, expires: float, size: int):
+        self.value = value
+        self.expires = expires
+        self.size = size
+
+class TTLCache:
+    """
+    Bounded in-memory cache with per-cache TTL and LRU eviction.
+
+    Entries expire `ttl` seconds after they were set (None = never) and are
+    evicted least-recently-used first once the cache holds more than
+    `max_entries` entries or more than `max_bytes` approximate bytes (0 = no
+    limit). Expired entries are dropped when read and by a sweep that runs on
+    writes at most every `sweep_interval` seconds, so entries that are never
+    read again do not linger.
+
+    Sizes come from `sizer(value)` (default: sys.getsizeof, which is shallow
+    and only a rough guide for objects holding other objects).
+    `on_remove(key, value)` is called whenever an entry expires, is evicted
+    or is discarded (not when it is overwritten by `set()`).
+
+    With `max_stale` > 0, expired entries are kept that many more seconds:
+    `get()` still misses on them, but `get_stale()` returns them so callers
+    can serve the old value while they refresh it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: Optional[float] = None,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        sizer: Optional[Callable[[Any], int]] = None,
+        sweep_interval: float = 60.0,
+        on_remove: Optional[Callable[[Hashable, Any], None]] = None,
+        max_stale: float = 0.0
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale if ttl else 0.0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sizer = sizer or sys.getsizeof
+        self._on_remove = on_remove
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._swept_at = time.monotonic()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        if self.max_stale:
+            self.counters["stale_hits"] = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return default
+        if entry.expires and entry.expires <= time.monotonic():
+            if entry.expires + self.max_stale <= time.monotonic():
+                self._remove(key, entry)
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return default
+        self._data.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry.value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Tuple[Any, bool]:
+        """(value, fresh): like get(), but also returns entries that expired less than `max_stale` ago."""
+        entry = self._data.get(key)
+        now = time.monotonic()
+        if entry is None or (entry.expires and entry.expires + self.max_stale <= now):
+            if entry is not None:
+                self._remove(key, entry)
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return default, False
+        self._data.move_to_end(key)
+        fresh = not entry.expires or entry.expires > now
+        self.counters["hits" if fresh else "stale_hits"] += 1
+        return entry.value, fresh
+
+    def set(self, key: Hashable, value: Any) -> None:
+        now = time.monotonic()
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        size = self._sizer(value) if self.max_bytes else 0
+        self._data[key] = _Entry(value, now + self.ttl if self.ttl else 0.0, size)
+        self._bytes += size
+
+        if now - self._swept_at >= self.sweep_interval:
+            self.sweep(now)
+        self._evict()
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._data.get(key)
+        if entry is not None:
+            self._remove(key, entry)
+
+    def clear(self) -> None:
+        for key, entry in list(self._data.items()):
+            self._remove(key, entry)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drops every expired entry. Returns how many were dropped."""
+        now = now or time.monotonic()
+        self._swept_at = now
+        if not self.ttl:
+            return 0
+        expired = [key for key, entry in self._data.items() if entry.expires + self.max_stale <= now]
+        for key in expired:
+            self._remove(key, self._data[key])
+        self.counters["expired"] += len(expired)
+        return len(expired)
+
+    def _remove(self, key: Hashable, entry: _Entry) -> None:
+        del self._data[key]
+        self._bytes -= entry.size
+        if self._on_remove:
+            self._on_remove(key, entry.value)
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_entries and len(self._data) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self.counters["evictions"] += 1
+            if self._on_remove:
+                self._on_remove(key, entry.value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not (entry.expires and entry.expires <= time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"entries": len(self._data)}
+        if self.max_entries:
+            stats["max_entries"] = self.max_entries
+        if self.max_bytes:
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        stats.update(self.counters)
+        return stats
@@ -1,3 +1,4 @@
+import time
 import logging
 import traceback
 from datetime import datetime
@@ -29,18 +30,49 @@ def format_entity(entity) -> Dict[str, Any]:
 
     return result
 
+# Telegram uses 2**31 - 1 as "muted forever"
+MUTE_FOREVER = 2147483647
+
+def get_mute_until(settings) -> float:
+    """
+    Helper to read (Input)PeerNotifySettings as a unix timestamp until which
+    the peer is muted. Returns 0.0 if notifications are on.
+    """
+    if settings is None:
+        return 0.0
+
+    # 'silent' might be set for channels; treated as muted
+    if getattr(settings, "silent", False):
+        return float(MUTE_FOREVER)
+
+    mute_until = getattr(settings, "mute_until", None)
+    if not mute_until:
+        return 0.0
+    # Telethon usually returns a TZ-aware datetime, but "forever" can arrive as a large int
+    if isinstance(mute_until, (int, float)):
+        return float(mute_until)
+    if hasattr(mute_until, "timestamp"):
+        return mute_until.timestamp()
+    return 0.0
+
+def is_mute_active(mute_until: float) -> bool:
+    return mute_until > time.time()
+
 def get_sender_name(message) -> str:
     """Helper function to get sender name from a message."""
     if not message.sender:
         return "Unknown"
+    return entity_name(message.sender)
 
+def entity_name(entity) -> str:
+    """Display name of a user (first + last name) or chat/channel (title)."""
     # Check for group/channel title first
-    if hasattr(message.sender, "title") and message.sender.title:
-        return message.sender.title
-    elif hasattr(message.sender, "first_name"):
+    if hasattr(entity, "title") and entity.title:
+        return entity.title
+    elif hasattr(entity, "first_name"):
         # User sender
-        first_name = getattr(message.sender, "first_name", "") or ""
-        last_name = getattr(message.sender, "last_name", "") or ""
+        first_name = getattr(entity, "first_name", "") or ""
+        last_name = getattr(entity, "last_name", "") or ""
         full_name = f"{first_name} {last_name}".strip()
         return full_name if full_name else "Unknown"
     else:
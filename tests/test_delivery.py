@@ -0,0 +1,147 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+from src.delivery import DeliveryQueue, OVERFLOW_SPILL
+from src.destinations import Destination, Envelope
+from src.forwarder import enqueue_forward
+from src.resilience import DestinationGuard
+
+def _spill_lines(path) -> list:
+    return [json.loads(line) for line in path.read_text().splitlines() if line]
+
+async def test_stop_while_unspilling_keeps_spilled_payloads(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text("".join(json.dumps({"chat_id": 1, "n": n}) + "\n" for n in range(10)))
+    release = asyncio.Event()
+
+    async def deliver(payload):
+        await release.wait()
+        return True
+
+    queue = DeliveryQueue("test", deliver, maxsize=2, workers=1, overflow=OVERFLOW_SPILL, spill_path=str(spill))
+    await queue.start()
+    # Let the unspill task take the file and fill the lane
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+    await queue.stop(timeout=0)
+
+    draining = tmp_path / "spill.jsonl.draining"
+    left = _spill_lines(draining)
+    assert left and [p["n"] for p in left] == list(range(10 - len(left), 10))
+    assert not spill.exists()
+
+async def test_spilled_payloads_keep_their_chat_order(tmp_path):
+    gate = asyncio.Event()
+    delivered = []
+
+    async def deliver(payload):
+        await gate.wait()
+        delivered.append(payload["n"])
+        return True
+
+    queue = DeliveryQueue("test", deliver, maxsize=1, workers=1, overflow=OVERFLOW_SPILL, spill_path=str(tmp_path / "spill.jsonl"), key=lambda p: p["chat_id"])
+    await queue.start()
+    # 0 is taken by the worker, 1 waits in the lane, 2-4 are spilled
+    for n in range(5):
+        await queue.put({"chat_id": 1, "n": n})
+        await asyncio.sleep(0)
+    assert queue.counters["spilled"] == 3
+    gate.set()
+    await asyncio.sleep(0)
+    # The lane has room now, but older payloads of this chat are on disk
+    for n in range(5, 8):
+        await queue.put({"chat_id": 1, "n": n})
+    for _ in range(50):
+        if len(delivered) == 8:
+            break
+        await asyncio.sleep(0.02)
+    await queue.stop()
+    assert delivered == list(range(8))
+
+class FakeHTTPClient:
+    """Fails the first `failures` POSTs with a 500, then accepts everything."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.bodies = []
+
+    async def post(self, url, content, headers):
+        self.bodies.append(json.loads(content))
+        status = 500 if len(self.bodies) <= self.failures else 200
+        return SimpleNamespace(status_code=status, is_error=status >= 400, text="")
+
+async def test_deferred_payloads_go_out_before_newer_ones():
+    http = FakeHTTPClient(failures=1)
+
+    async def get_client():
+        return http
+
+    destination = Destination("test", "http://test", guard=DestinationGuard("test", 0, 1, 1, 0.05), get_client=get_client)
+    await destination.start({"maxsize": 10, "workers": 1}, {})
+    await destination.submit(Envelope({"chat_id": 1, "n": 0}))
+    await asyncio.sleep(0.01)
+    # The circuit is open: 1 is held back
+    await destination.submit(Envelope({"chat_id": 1, "n": 1}))
+    await asyncio.sleep(0.1)
+    # The circuit would let a trial through now, but 2 must wait for 1
+    await destination.submit(Envelope({"chat_id": 1, "n": 2}))
+    for _ in range(100):
+        if len(http.bodies) == 3:
+            break
+        await asyncio.sleep(0.02)
+    await destination.stop(timeout=1)
+    assert [body["n"] for body in http.bodies] == [0, 1, 2]
+
+async def test_outbox_takes_over_payloads_spilled_without_it(tmp_path):
+    http = FakeHTTPClient()
+
+    async def get_client():
+        return http
+
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text("".join(json.dumps({"chat_id": 1, "n": n}) + "\n" for n in range(3)))
+    destination = Destination(
+        "test", "http://test", guard=DestinationGuard("test", 0, 1, 5, 30), get_client=get_client,
+        outbox_path=str(tmp_path / "outbox.db"), spill_path=str(spill)
+    )
+    await destination.start({"maxsize": 10, "workers": 2, "overflow": OVERFLOW_SPILL}, {"commit_interval": 0.01})
+    await destination.submit(Envelope({"chat_id": 2, "n": 3}))
+    for _ in range(100):
+        if len(http.bodies) == 4:
+            break
+        await asyncio.sleep(0.02)
+    await destination.stop(timeout=1)
+    assert sorted(body["n"] for body in http.bodies) == [0, 1, 2, 3]
+    assert not spill.exists()
+
+class StalledHTTPClient:
+    """Never answers."""
+
+    async def post(self, url, content, headers):
+        await asyncio.Event().wait()
+
+async def test_stalled_destination_does_not_hold_up_the_others():
+    healthy_http, stalled_http = FakeHTTPClient(), StalledHTTPClient()
+
+    async def healthy_client():
+        return healthy_http
+
+    async def stalled_client():
+        return stalled_http
+
+    healthy = Destination("healthy", "http://healthy", guard=DestinationGuard("healthy", 0, 1, 5, 30), get_client=healthy_client)
+    stalled = Destination("stalled", "http://stalled", guard=DestinationGuard("stalled", 0, 1, 5, 30), get_client=stalled_client)
+    for destination in (healthy, stalled):
+        await destination.start({"maxsize": 2, "workers": 1}, {})
+
+    for n in range(20):
+        # The stalled destination's queue is full after the first few
+        await asyncio.wait_for(enqueue_forward({"chat_id": 1, "n": n}, [stalled, healthy]), timeout=1)
+    for _ in range(50):
+        if len(healthy_http.bodies) == 20:
+            break
+        await asyncio.sleep(0.02)
+    assert [body["n"] for body in healthy_http.bodies] == list(range(20))
+    assert stalled.stats()["handoff_dropped"] > 0
+    await asyncio.gather(healthy.stop(timeout=1), stalled.stop(timeout=0.1))
@@ -0,0 +1,39 @@
+import datetime
+
+from telethon.tl.types import Message, PeerUser
+
+from src import history
+
+DATE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _message(message_id: int) -> Message:
+    return Message(id=message_id, peer_id=PeerUser(7), date=DATE, message=f"message {message_id}")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_busy_window_outlives_the_top_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history.time, "monotonic", clock)
+    windows = history.MessageWindows()
+    for message_id in range(1, 11):
+        windows.on_message(7, _message(message_id))
+        clock.now += history.HISTORY_TOP_TTL / 3
+    # Well past the TTL since the window was created, but events kept arriving
+    assert windows.counters["stale"] == 0
+    assert [r.id for r in windows.latest(7, 0, 10)] == list(range(10, 0, -1))
+
+def test_quiet_window_is_restarted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history.time, "monotonic", clock)
+    windows = history.MessageWindows()
+    windows.on_message(7, _message(1))
+    clock.now += history.HISTORY_TOP_TTL + 1
+    assert windows.latest(7, 0, 1) is None
+    windows.on_message(7, _message(5))
+    assert windows.counters["stale"] == 1
+    assert [r.id for r in windows.latest(7, 0, 1)] == [5]
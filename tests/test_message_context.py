@@ -0,0 +1,41 @@
+import pytest
+from telethon.utils import get_peer_id
+
+from benchmarks.context import CHAT, FakeClient, _message
+from src import history
+from src.tools import interactions
+
+TOTAL = 1000
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient(TOTAL)
+    monkeypatch.setattr(interactions, "client", fake)
+
+    async def get_or_fetch_entity(chat_id):
+        return CHAT
+    monkeypatch.setattr(interactions, "get_or_fetch_entity", get_or_fetch_entity)
+    monkeypatch.setattr(history, "_WINDOWS", history.MessageWindows())
+    return fake
+
+def _ids(text: str) -> list:
+    return [int(line.split("]")[0].split("[")[1]) for line in text.splitlines()]
+
+async def test_cache_miss_sends_one_history_request(client):
+    text = await interactions.get_message_context(CHAT.id, 500, 3)
+    assert len(client.requests) == 1
+    assert _ids(text) == [497, 498, 499, 500, 501, 502, 503]
+    assert "-> [500] message 500 (TARGET)" in text
+
+async def test_window_hit_sends_no_request(client):
+    history.get_message_windows().add_newest(get_peer_id(CHAT), [_message(i) for i in range(TOTAL, TOTAL - 50, -1)], reached_start=False)
+    text = await interactions.get_message_context(CHAT.id, TOTAL - 20, 5)
+    assert client.requests == []
+    assert _ids(text) == list(range(TOTAL - 25, TOTAL - 14))
+
+async def test_large_count_stays_within_one_request(client):
+    text = await interactions.get_message_context(CHAT.id, 500, 80)
+    assert len(client.requests) == 1
+    assert client.requests[0].limit <= 100
+    count = interactions.MAX_CONTEXT_COUNT
+    assert _ids(text) == list(range(500 - count, 501 + count))
@@ -0,0 +1,31 @@
+import datetime
+
+from telethon.tl.types import Message, PeerChannel
+
+from src import messagestore
+from src.messagestore import MessageStore
+
+DATE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+async def test_search_reports_matches_past_the_rank_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(messagestore, "MESSAGE_INDEX_RANK_WINDOW", 5)
+    store = MessageStore(str(tmp_path / "messages.db"))
+    await store.open()
+    try:
+        for message_id in range(1, 9):
+            store.add(Message(id=message_id, peer_id=PeerChannel(1), date=DATE, message=f"deploy number {message_id}"))
+        store.add(Message(id=9, peer_id=PeerChannel(2), date=DATE, message="deploy elsewhere"))
+        await store._flush()
+
+        hits, truncated = await store.search("deploy", limit=20)
+        assert truncated
+        assert len(hits) == 5
+        assert {hit.message_id for hit in hits} == {5, 6, 7, 8, 9}
+
+        # Narrowed down to one chat the older matches are ranked too
+        hits, truncated = await store.search("deploy", peer_id=-1000000000002, limit=20)
+        assert not truncated and [hit.message_id for hit in hits] == [9]
+        hits, truncated = await store.search("number 2", limit=20)
+        assert not truncated and [hit.message_id for hit in hits] == [2]
+    finally:
+        await store.close()
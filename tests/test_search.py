@@ -0,0 +1,26 @@
+from telethon.tl.types import User
+
+from src.search import PeerSearchIndex
+
+def _index() -> PeerSearchIndex:
+    index = PeerSearchIndex()
+    index.set_contacts([
+        User(id=1, first_name="John", last_name="Smith", phone="15551234567"),
+        User(id=2, first_name="John", last_name="Doe", phone="447700900123"),
+        User(id=3, first_name="Иван", last_name="Петров"),
+    ])
+    return index
+
+def _ids(index: PeerSearchIndex, query: str) -> list:
+    return [user.id for user in index.search(query)]
+
+def test_phone_fragment_in_a_multi_word_query():
+    index = _index()
+    assert _ids(index, "john +1555") == [1]
+    assert _ids(index, "john +1 555 123") == [1]
+    assert _ids(index, "+44 7700") == [2]
+
+def test_typo_and_transliteration():
+    index = _index()
+    assert _ids(index, "smiht") == [1]
+    assert _ids(index, "ivan petrov") == [3]